@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Before/after benchmark for event-loop lag caused by Firestore calls.
+
+Runs against a local Firestore emulator, e.g.
+    gcloud emulators firestore start --host-port=localhost:8080
+A ticker task measures how late the event loop wakes it up while a burst of
+concurrent "handlers" each do what /introduceyourself and /log do: read a
+document, then write one. The first pass makes the blocking calls the bot
+used to make from async code; the second goes through data_access.store.
+
+Usage: python benchmarks/bench_firestore_loop_lag.py [handlers]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("FIRESTORE_EMULATOR_HOST", "localhost:8080")
+sys.path.append('.')
+from data_access import db, store
+
+TICK = 0.005  # Seconds between ticker wake-ups
+
+
+async def measure_lag(work):
+    """Run `work()` while sampling how late a periodic timer fires; returns (lags, seconds)."""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    return lags, elapsed
+
+
+async def blocking_handlers(n):
+    async def handler(i):
+        uid = f"bench-{i}"
+        snapshot = db.collection("logs").document(uid).get()
+        if snapshot.exists:
+            db.collection("logs").document(uid).set({"2025-05-01": i}, merge=True)
+    await asyncio.gather(*(handler(i) for i in range(n)))
+
+
+async def async_handlers(n):
+    async def handler(i):
+        uid = f"bench-{i}"
+        if await store.exists("logs", uid):
+            await store.set("logs", uid, {"2025-05-01": i}, merge=True)
+    await asyncio.gather(*(handler(i) for i in range(n)))
+
+
+def report(name, lags, elapsed):
+    p99 = sorted(lags)[int(len(lags) * 0.99) - 1] if lags else 0.0
+    mean = statistics.mean(lags) if lags else 0.0
+    worst = max(lags) if lags else 0.0
+    print(f"{name:<12}{elapsed:>10.2f}{mean * 1000:>12.1f}{p99 * 1000:>12.1f}{worst * 1000:>12.1f}")
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for i in range(n):
+        await store.set("logs", f"bench-{i}", {"2025-05-01": 0})
+
+    before = await measure_lag(lambda: blocking_handlers(n))
+    after = await measure_lag(lambda: async_handlers(n))
+
+    print(f"{n} concurrent handlers against {os.environ['FIRESTORE_EMULATOR_HOST']}")
+    print(f"{'mode':<12}{'total (s)':>10}{'mean lag':>12}{'p99 lag':>12}{'max lag':>12}  (ms)")
+    report("blocking", *before)
+    report("async", *after)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Free-form vs grammar-constrained /plan generation.
+
+For each goal, generates a plan with the old free-form prompt (max_tokens=768,
+then a search for "Monday:") and with the GBNF-constrained prompt, and reports
+generated tokens, latency and how many of the seven days came back usable.
+
+Usage: python benchmarks/bench_plan_grammar.py [rounds]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.append('.')
+from llama_cpp import Llama
+from plan_grammar import PLAN_GRAMMAR, PLAN_MAX_TOKENS, PLAN_FORMAT_INSTRUCTIONS, compile_grammar, parse_constrained_plan
+from plan_parser import parse_plan
+from prompt_budget import N_CTX
+from utils import MODEL_PATH, PLAN_PREFIX
+GOALS = ["strength training", "5k run", "yoga", "weight loss", "upper body"]
+
+
+def free_form(llm, goal):
+    prompt = (
+        f"{PLAN_PREFIX} {goal}. "
+        "List only the days and the workout for each day. "
+        "Format exactly as: Monday: ...\\nTuesday: ...\\nWednesday: ...\\nThursday: ...\\nFriday: ...\\nSaturday: ...\\nSunday: ... "
+        "No introduction, no summary, just the plan. [/INST]"
+    )
+    output = llm(prompt, max_tokens=768, stop=["<s>"], top_p=0.95)
+    return output, len(parse_plan(output["choices"][0]["text"]))
+
+
+def constrained(llm, goal):
+    prompt = f"{PLAN_PREFIX} {goal}. {PLAN_FORMAT_INSTRUCTIONS} [/INST]"
+    output = llm(prompt, max_tokens=PLAN_MAX_TOKENS, stop=["<s>"], top_p=0.95, grammar=compile_grammar(PLAN_GRAMMAR))
+    return output, len(parse_constrained_plan(output["choices"][0]["text"]))
+
+
+def run(llm, generate, rounds):
+    tokens, latencies, days = [], [], []
+    for _ in range(rounds):
+        for goal in GOALS:
+            start = time.perf_counter()
+            output, parsed = generate(llm, goal)
+            latencies.append(time.perf_counter() - start)
+            tokens.append(output["usage"]["completion_tokens"])
+            days.append(parsed)
+    return tokens, latencies, days
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    llm = Llama(model_path=MODEL_PATH, n_ctx=N_CTX, n_threads=os.cpu_count() or 8, verbose=False)
+
+    start = time.perf_counter()
+    compile_grammar(PLAN_GRAMMAR)
+    print(f"Grammar compiled in {(time.perf_counter() - start) * 1000:.1f} ms (once per process)")
+
+    print(f"{'mode':<14}{'tokens (mean)':>15}{'tokens (max)':>14}{'latency (s)':>13}{'p95 (s)':>10}{'days parsed':>13}")
+    for name, generate in (("free-form", free_form), ("constrained", constrained)):
+        tokens, latencies, days = run(llm, generate, rounds)
+        p95 = sorted(latencies)[max(0, int(len(latencies) * 0.95) - 1)]
+        print(f"{name:<14}{statistics.mean(tokens):>15.0f}{max(tokens):>14}"
+              f"{statistics.mean(latencies):>13.2f}{p95:>10.2f}{statistics.mean(days):>11.1f}/7")
+
+
+if __name__ == "__main__":
+    main()
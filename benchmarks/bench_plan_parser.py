@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the workout plan parser on large and adversarial inputs.
+
+Compares the old parser (regex rebuilt per call, lazy DOTALL body with a
+repeated-alternation lookahead) with plan_parser's single pass at growing
+input sizes. Time per input should grow linearly for the new parser; the old
+one is skipped at larger sizes once a single parse takes over the time limit.
+
+Usage: python benchmarks/bench_plan_parser.py [max_kib]
+"""
+import re
+import sys
+import time
+
+sys.path.append('.')
+from plan_parser import parse_plan, DAYS
+
+OLD_TIME_LIMIT = 5.0  # Seconds; larger sizes are skipped for the old parser after this
+
+
+def old_parse_workout_plan(plan_text: str):
+    days = DAYS
+    events = []
+    day_pattern = r"(" + "|".join(days) + "):(.*?)(?=(?:" + "|".join(days) + "):(?!\\S)|$)"
+    for day, content in re.findall(day_pattern, plan_text, re.DOTALL):
+        events.append((day, content.strip()))
+    return events
+
+
+def well_formed(size):
+    lines = [f"**{day}:** 45 minutes of strength training, 3x10 squats" for day in DAYS]
+    block = "\n".join(lines) + "\n"
+    return block * (size // len(block) + 1)
+
+
+def day_names_without_separators(size):
+    # Every position starts a lazy body that re-tries the day alternation lookahead
+    return "Monday:" + "Monday Tuesday Wednesday " * (size // 25)
+
+
+def one_huge_line(size):
+    return "Monday: " + "x" * size
+
+
+def whitespace_runs(size):
+    # Long runs of spaces and tabs in front of almost-headers
+    return ("\t " * 200 + "Mondayx\n") * (size // 410 + 1)
+
+
+INPUTS = [
+    ("well-formed", well_formed),
+    ("day names, no ':'", day_names_without_separators),
+    ("one huge line", one_huge_line),
+    ("whitespace runs", whitespace_runs),
+]
+
+
+def timed(fn, text):
+    start = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    max_kib = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    sizes = [kib * 1024 for kib in (4, 16, 64, 256, 1024, 4096) if kib <= max_kib]
+    print(f"{'input':<20}{'size':>10}{'old (s)':>12}{'new (s)':>12}{'new µs/KiB':>12}")
+    for name, make in INPUTS:
+        old_too_slow = False
+        for size in sizes:
+            text = make(size)
+            new = timed(parse_plan, text)
+            if old_too_slow:
+                old_cell = "skipped"
+            else:
+                old = timed(old_parse_workout_plan, text)
+                old_too_slow = old > OLD_TIME_LIMIT
+                old_cell = f"{old:.4f}"
+            print(f"{name:<20}{len(text) // 1024:>8}Ki{old_cell:>12}{new:>12.4f}{new * 1e6 / (len(text) / 1024):>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Before/after benchmark for prompt prefix KV-cache reuse.
+
+Runs the bot's prompt templates interleaved (so llama.cpp's own "same prompt
+as last time" reuse can't help) with max_tokens=1, which makes the timing
+almost entirely prompt evaluation. The first pass uses the bare model, the
+second restores the warmed prefix state before every request.
+
+Usage: python benchmarks/bench_prefix_cache.py [rounds]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.append('.')
+from llama_cpp import Llama
+from prefix_cache import PrefixStateCache, PrefixCachedModel
+from prompt_budget import N_CTX
+from utils import MODEL_PATH, COACH_PREFIX, PLAN_PREFIX, MOTIVATION_PREFIX  # The bot's own templates
+
+PROMPTS = [
+    f"{COACH_PREFIX} How do I stay motivated? [/INST]",
+    f"{PLAN_PREFIX} strength training. List only the days and the workout for each day. "
+    "Format exactly as: Monday: ...\\nTuesday: ...\\nWednesday: ...\\nThursday: ...\\nFriday: ...\\nSaturday: ...\\nSunday: ... "
+    "No introduction, no summary, just the plan. [/INST]",
+    f"{MOTIVATION_PREFIX} 30 minutes.\nGive them a short, energetic motivational message. [/INST]",
+]
+
+
+def run(model, rounds):
+    timings = []
+    for _ in range(rounds):
+        for prompt in PROMPTS:
+            start = time.perf_counter()
+            model(prompt, max_tokens=1)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    llm = Llama(
+        model_path=MODEL_PATH,
+        n_ctx=N_CTX,
+        n_threads=os.cpu_count() or 8,
+        verbose=False
+    )
+    cache = PrefixStateCache([COACH_PREFIX, PLAN_PREFIX, MOTIVATION_PREFIX])
+
+    start = time.perf_counter()
+    cache.warm(llm)
+    warm_time = time.perf_counter() - start
+    prefix_tokens = {prefix: len(tokens) for prefix, tokens in cache.tokens.items()}
+
+    before = run(llm, rounds)
+    after = run(PrefixCachedModel(llm, cache), rounds)
+
+    print(f"Prefix warm-up: {warm_time:.2f}s for {sum(prefix_tokens.values())} tokens")
+    print(f"{'mode':<16}{'mean (s)':>10}{'median (s)':>12}{'p95 (s)':>10}")
+    for name, timings in (("no reuse", before), ("prefix reuse", after)):
+        p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+        print(f"{name:<16}{statistics.mean(timings):>10.3f}{statistics.median(timings):>12.3f}{p95:>10.3f}")
+    saved = statistics.mean(before) - statistics.mean(after)
+    print(f"Mean prompt-eval time saved per request: {saved:.3f}s "
+          f"({saved / statistics.mean(before):.0%}); {cache.restores} restores, {cache.reuses} in-place reuses")
+
+
+if __name__ == "__main__":
+    main()
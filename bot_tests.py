@@ -19,14 +19,31 @@ import re
 from unittest.mock import Mock, patch, MagicMock
 import datetime
 from llama_log_redirect import llama_log_redirect
+import threading
 
 # Import the functions we want to test from the main bot file
 import sys
 sys.path.append('.')
-from project5k_bot import get_motivation, parse_workout_plan, llm
+from project5k_bot import parse_workout_plan
+import utils
+from utils import get_motivation
+from motivation_pool import MotivationPool
+from response_cache import ResponseCache
+from prefix_cache import PrefixStateCache, PrefixCachedModel, tokenize
+from llm_worker_pool import core_slices
+from streaks import advance_streak, streak_from_dates
+from llm_scheduler import (
+    LLMScheduler, LLMQueueFull,
+    PRIORITY_INTERACTIVE, PRIORITY_ASK, PRIORITY_PLAN, PRIORITY_BACKGROUND
+)
 
 class TestLLMFunctionality(unittest.TestCase):
     """Test suite for LLM-based functions"""
+
+    @classmethod
+    def setUpClass(cls):
+        # The model is no longer loaded at import time
+        utils.load_llm()
     
     def test_get_motivation_basic(self):
         """Test basic motivation message generation"""
@@ -60,7 +77,7 @@ class TestLLMFunctionality(unittest.TestCase):
         )
         prompt = f"<s>[INST] You are a friendly, supportive fitness coach. {prompt} [/INST]"
         with llama_log_redirect("logs/bot_tests_llm.log"):
-            output = llm(
+            output = utils.llm(
                 prompt,
                 max_tokens=500,  # Reduced for faster testing
                 top_p=0.95,
@@ -82,6 +99,33 @@ class TestLLMFunctionality(unittest.TestCase):
         print("   Note: LLM generation verified - additional goals would work similarly")
 
 
+class TestLLMLoading(unittest.TestCase):
+    """Test suite for the background model loader's failure handling"""
+
+    def test_failed_import_releases_waiters(self):
+        """If llama_cpp can't be imported, the error is logged and waiters see a failed load"""
+        print("\n🧪 Testing LLM load failure...")
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.chdir(tmpdir)  # No logs/ directory yet
+            try:
+                with patch.dict(sys.modules, {"llama_cpp": None}), \
+                        patch.object(utils, "LLM_WORKERS", 0), \
+                        patch.object(utils, "llm_loaded", threading.Event()), \
+                        patch.object(utils, "llm_status", "not_loaded"), \
+                        patch.object(utils, "_llm_loader", None):
+                    utils.load_llm()
+                    self.assertTrue(utils.llm_loaded.is_set())
+                    self.assertEqual(utils.llm_status, "failed")
+                    self.assertFalse(asyncio.run(utils.wait_for_llm(timeout=1)))
+                self.assertTrue(os.path.exists(os.path.join("logs", "utils_llm_error.log")))
+            finally:
+                os.chdir(cwd)
+
+        print("✅ LLM load failure logged and waiters released")
+
+
 class TestWorkoutPlanParsing(unittest.TestCase):
     """Test suite for workout plan parsing functionality"""
     
@@ -166,6 +210,307 @@ Friday: Legs and shoulders"""
         
         print("✅ Empty/invalid plan parsing handled correctly")
 
+    def test_parse_markdown_plan_records(self):
+        """Markdown, bold, lowercase and numbered days become structured records"""
+        print("\n🧪 Testing markdown plan parsing...")
+        from plan_parser import parse_plan
+
+        plan_text = """Here is your plan:
+
+### **Monday:**
+- Squats 3x10
+- Lunges (20 min)
+**Tuesday**: 1 hour run
+2. wednesday - Yoga 45-60 minutes
+- **Thursday (Rest)**
+friday: Swim 1.5 hours
+* Saturday: Rest day or light walk
+Sunday: Full body stretching, 15 mins
+
+Stick with it and you'll see results!"""
+
+        records = parse_plan(plan_text)
+        self.assertEqual([r.day for r in records],
+                         ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"])
+        self.assertEqual(records[0].title, "Squats 3x10")
+        self.assertEqual([r.duration_minutes for r in records], [20, 60, 45, None, 90, None, 15])
+        self.assertEqual([r.rest_day for r in records], [False, False, False, True, False, True, False])
+        self.assertNotIn("Stick with it", records[-1].description)
+        self.assertEqual(parse_workout_plan(plan_text)[1], ("Tuesday", "1 hour run"))
+
+        print("✅ Markdown plan parsing successful")
+
+    def test_parse_mid_line_day_headers(self):
+        """Days listed on one line or after a label are still split into separate days"""
+        print("\n🧪 Testing mid-line day headers...")
+
+        events = parse_workout_plan("Monday: run 5k, Tuesday: yoga, Wednesday: rest, Thursday: swim")
+        self.assertEqual(events, [("Monday", "run 5k"), ("Tuesday", "yoga"), ("Wednesday", "rest"), ("Thursday", "swim")])
+
+        events = parse_workout_plan("Day 1 - Monday: Squats\nDay 2 - Tuesday: Run")
+        self.assertEqual(events, [("Monday", "Squats"), ("Tuesday", "Run")])
+
+        events = parse_workout_plan("Week plan: Monday: Squats\nTuesday: Run")
+        self.assertEqual(events, [("Monday", "Squats"), ("Tuesday", "Run")])
+
+        print("✅ Mid-line day headers parsed")
+
+    def test_parse_adversarial_input_is_fast(self):
+        """Large malformed inputs parse in time proportional to their size"""
+        print("\n🧪 Testing parser on adversarial input...")
+        import time
+        from plan_parser import parse_plan
+
+        inputs = [
+            "Monday:" + "Monday Tuesday Wednesday " * 40000,
+            "Monday: " + "x" * 1000000,
+            ("\t " * 200 + "Mondayx\n") * 2500,
+        ]
+        for text in inputs:
+            start = time.perf_counter()
+            parse_plan(text)
+            self.assertLess(time.perf_counter() - start, 2.0)
+
+        print("✅ Adversarial inputs parsed quickly")
+
+
+class TestPlanGrammar(unittest.TestCase):
+    """Test suite for grammar-constrained plan output"""
+
+    def test_grammar_lists_days_in_order(self):
+        """The grammar admits exactly the seven days, in order, one bounded line each"""
+        print("\n🧪 Testing plan grammar...")
+        from plan_grammar import PLAN_GRAMMAR
+
+        root = PLAN_GRAMMAR.splitlines()[0]
+        days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        positions = [root.index(f'"{day}: " entry') for day in days]
+        self.assertEqual(positions, sorted(positions))
+        self.assertIn("{0,89}", PLAN_GRAMMAR)
+
+        print("✅ Plan grammar covers the week in order")
+
+    def test_parse_constrained_plan(self):
+        """Constrained output becomes PlanDay records; a truncated last line is skipped"""
+        print("\n🧪 Testing constrained plan parsing...")
+        from plan_grammar import parse_constrained_plan, plan_entries
+
+        text = (
+            "Monday: Squats, lunges and planks (45 min)\n"
+            "Tuesday: Easy run (30 min)\n"
+            "Wednesday: Rest (0 min)\n"
+            "Thursday: Push-ups: 3 sets (20 min)\n"
+            "Friday: Intervals (2"
+        )
+        records = parse_constrained_plan(text)
+        self.assertEqual([r.day for r in records], ["Monday", "Tuesday", "Wednesday", "Thursday"])
+        self.assertEqual(records[0].title, "Squats, lunges and planks")
+        self.assertEqual(records[0].duration_minutes, 45)
+        self.assertTrue(records[2].rest_day)
+        self.assertIsNone(records[2].duration_minutes)
+        self.assertEqual(records[3].title, "Push-ups: 3 sets")
+        self.assertEqual(plan_entries(records)[1], ("Tuesday", "Easy run (30 min)"))
+
+        print("✅ Constrained plan parsed into structured days")
+
+    def test_grammar_argument_per_model(self):
+        """Worker proxies get the GBNF text; local models get a grammar compiled once"""
+        print("\n🧪 Testing grammar compilation caching...")
+        import plan_grammar
+        from llm_worker_pool import RemoteModel
+
+        remote = RemoteModel.__new__(RemoteModel)
+        self.assertEqual(plan_grammar.grammar_for(remote, plan_grammar.PLAN_GRAMMAR), plan_grammar.PLAN_GRAMMAR)
+
+        compiled = []
+        with patch.dict(sys.modules, {"llama_cpp": Mock(LlamaGrammar=Mock(
+                from_string=lambda text, verbose=False: compiled.append(text) or object()))}):
+            plan_grammar.compile_grammar.cache_clear()
+            local = PrefixCachedModel(FakeLlama(), PrefixStateCache([]))
+            first = plan_grammar.grammar_for(local, plan_grammar.PLAN_GRAMMAR)
+            second = plan_grammar.grammar_for(local, plan_grammar.PLAN_GRAMMAR)
+            plan_grammar.compile_grammar.cache_clear()
+        self.assertIs(first, second)
+        self.assertEqual(len(compiled), 1)
+
+        print("✅ Grammar compiled once and passed as text to workers")
+
+
+class TestPlanStore(unittest.TestCase):
+    """Test suite for the precomputed plan store"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "plans.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def make_plan(workout):
+        days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        return "\n".join(f"{day}: {workout} (30 min)" for day in days) + "\n"
+
+    def test_fuzzy_hits_rotation_and_live_goals(self):
+        """Free-text goals map onto stored goals, variants rotate, and live plans become hits"""
+        print("\n🧪 Testing plan store...")
+        from plan_store import PlanStore
+
+        async def generate(goal, priority):
+            return self.make_plan(goal)
+
+        store = PlanStore(["weight loss", "5k run", "HIIT"], generate, path=self.path, per_goal=2)
+        self.assertTrue(store.add("weight loss", self.make_plan("A")))
+        self.assertTrue(store.add("weight loss", self.make_plan("B")))
+        self.assertFalse(store.add("weight loss", "Monday: Run (30 min)\n"))  # Incomplete plans are rejected
+
+        self.assertEqual(store.get("Weight-Loss!"), self.make_plan("A").strip())
+        self.assertEqual(store.get("weightloss"), self.make_plan("B").strip())
+        self.assertEqual(store.get("wieght loss"), self.make_plan("A").strip())  # Typos still hit
+        self.assertIsNone(store.get("5 k run"))  # Known goal, nothing precomputed yet
+        self.assertIsNone(store.get("rock climbing"))
+
+        self.assertTrue(store.add("rock climbing", self.make_plan("Bouldering")))
+        self.assertEqual(store.get("Rock climbing"), self.make_plan("Bouldering").strip())
+        self.assertEqual(store.stats()["hits"], 4)
+        self.assertEqual(store.stats()["misses"], 2)
+        store.close()
+
+        # Plans survive a restart
+        reopened = PlanStore(["weight loss"], generate, path=self.path, per_goal=2)
+        self.assertEqual(reopened.get("rock climbing"), self.make_plan("Bouldering").strip())
+        reopened.close()
+
+        print("✅ Plan store matched, rotated and persisted plans")
+
+    def test_similar_goals_are_not_merged(self):
+        """Goals that only look alike miss instead of getting another goal's plan, and live plans keep their own key"""
+        print("\n🧪 Testing plan store near-misses...")
+        from plan_store import PlanStore
+
+        async def generate(goal, priority):
+            return self.make_plan(goal)
+
+        goals = ["muscle gain", "HIIT", "strength training", "weight loss"]
+        store = PlanStore(goals, generate, path=self.path)
+        for goal in goals:
+            store.add(goal, self.make_plan(goal))
+        for goal in ["muscle pain", "muscle again", "hit", "strength raining", "weight"]:
+            self.assertIsNone(store.match(goal), goal)
+        self.assertEqual(store.match("strenght trainning"), "strength training")
+
+        store.add("muscle pain", self.make_plan("Gentle mobility"))
+        self.assertEqual(store.get("muscle pain"), self.make_plan("Gentle mobility").strip())
+        self.assertEqual(store.get("muscle gain"), self.make_plan("muscle gain").strip())
+        store.close()
+
+        print("✅ Similar-looking goals kept apart")
+
+    def test_precompute_while_idle(self):
+        """The idle-time job fills every precomputed goal up to per_goal variants"""
+        print("\n🧪 Testing plan precompute...")
+        from plan_store import PlanStore
+        from llm_scheduler import PRIORITY_BACKGROUND
+
+        calls = []
+
+        async def generate(goal, priority):
+            calls.append((goal, priority))
+            return self.make_plan(f"{goal} #{len(calls)}")
+
+        store = PlanStore(["yoga", "cardio"], generate, path=self.path, per_goal=2)
+        asyncio.run(store.precompute(lambda: len(calls) < 3))
+        self.assertEqual(len(calls), 3)  # Stops as soon as the model is busy
+        asyncio.run(store.precompute(lambda: True))
+        self.assertEqual(len(calls), 4)
+        self.assertTrue(all(priority == PRIORITY_BACKGROUND for _, priority in calls))
+        self.assertEqual(store.stats()["plans"], 4)
+        store.close()
+
+        print("✅ Plans precomputed at background priority while idle")
+
+
+class TestExpiringStore(unittest.TestCase):
+    """Test suite for the pending-confirmation store"""
+
+    def test_expiry_sweep_cap_and_persistence(self):
+        """Entries expire on read and on sweep, the cap drops the soonest-expiring, and a reopen restores them"""
+        print("\n🧪 Testing expiring store...")
+        from expiring_store import ExpiringStore
+
+        now = [1000.0]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "pending.sqlite3")
+            store = ExpiringStore(120, max_entries=3, path=path, namespace="plans", clock=lambda: now[0])
+            store.put(1, {"plan_text": "a"})
+            now[0] += 60
+            store.put(2, {"plan_text": "b"})
+            store.put(3, {"plan_text": "c"}, ttl=30)
+            self.assertEqual(store.get(1), {"plan_text": "a"})
+
+            now[0] += 40  # 3 has expired; 1 and 2 have not
+            self.assertNotIn(3, store)
+            self.assertEqual(store.sweep(), 0)  # Already dropped on read
+            store.put(4, {"plan_text": "d"})
+            store.put(5, {"plan_text": "e"})  # Over the cap: 1 expires soonest and is evicted
+            self.assertIsNone(store.get(1))
+            self.assertEqual(store.stats(), {"pending": 3, "expired": 1, "evicted": 1})
+
+            now[0] += 80  # 2 expires (put at 1060, ttl 120); 4 and 5 have 40 seconds left
+            self.assertEqual(store.sweep(), 1)
+            self.assertEqual(store.pop(4), {"plan_text": "d"})
+            self.assertIsNone(store.pop(4))
+            store.close()
+
+            # A restart keeps the pending entry and its deadline; other namespaces are separate
+            reopened = ExpiringStore(120, path=path, namespace="plans", clock=lambda: now[0])
+            other = ExpiringStore(120, path=path, namespace="other", clock=lambda: now[0])
+            self.assertEqual(reopened.get(5), {"plan_text": "e"})
+            self.assertEqual(len(other), 0)
+            now[0] += 120
+            self.assertIsNone(reopened.get(5))
+            reopened.close()
+            other.close()
+
+        print("✅ Expiring store enforced TTL, cap and persistence")
+
+    def test_sweep_from_another_thread(self):
+        """The scheduler thread can sweep while handlers put and pop on another thread"""
+        print("\n🧪 Testing expiring store under a concurrent sweep...")
+        from expiring_store import ExpiringStore
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                store = ExpiringStore(0.001, max_entries=50, path=os.path.join(tmpdir, "pending.sqlite3"))
+                stop = threading.Event()
+                errors = []
+
+                def sweeper():
+                    try:
+                        while not stop.is_set():
+                            store.sweep()
+                    except Exception as e:
+                        errors.append(e)
+
+                thread = threading.Thread(target=sweeper)
+                thread.start()
+                try:
+                    for i in range(5000):
+                        store.put(i % 100, {"plan_text": str(i)}, ttl=0.001 if i % 2 else 60)
+                        store.pop((i * 7) % 100)
+                finally:
+                    stop.set()
+                    thread.join()
+                self.assertEqual(errors, [])
+                self.assertLessEqual(len(store), 50)
+                store.close()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        print("✅ Concurrent sweep, put and pop stay consistent")
+
 
 class TestGoogleCalendarIntegration(unittest.TestCase):
     """Test suite for Google Calendar API integration (without actual API calls)"""
@@ -267,9 +612,1076 @@ class TestGoogleCalendarIntegration(unittest.TestCase):
         for event in calendar_events:
             print(f"   {event['start']['date']}: {event['summary']}")
 
+    def test_batched_idempotent_insert(self):
+        """Plan events go out in one batch with stable ids; 409s count as already added"""
+        print("\n🧪 Testing batched calendar insert...")
+        from calendar_events import insert_plan_events, event_id, describe_results
+
+        plan = [("Monday", "Upper body"), ("Tuesday", "Cardio"), ("Wednesday", "Rest day")]
+        today = datetime.date(2025, 5, 5)  # A Monday
+        calendar = {"2025-05-05": None}  # Already inserted by an earlier confirmation
+        batches = []
+
+        class FakeBatch:
+            def __init__(self, callback):
+                self.callback = callback
+                self.requests = []
+
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+
+            def execute(self):
+                batches.append(len(self.requests))
+                for request_id, body in self.requests:
+                    if body["start"]["date"] in calendar:
+                        self.callback(request_id, None, Mock(resp=Mock(status=409)))
+                    elif "Rest" in body["summary"]:
+                        self.callback(request_id, None, RuntimeError("backend error"))
+                    else:
+                        calendar[body["start"]["date"]] = body["id"]
+                        self.callback(request_id, body, None)
+
+        service = Mock()
+        service.new_batch_http_request = lambda callback: FakeBatch(callback)
+        service.events.return_value.insert = lambda calendarId, body: body
+
+        results = asyncio.run(insert_plan_events(service, self.test_user_id, plan, today))
+        self.assertEqual(batches, [3])
+        self.assertEqual([r.status for r in results], ["exists", "created", "failed"])
+        self.assertEqual(calendar["2025-05-06"], event_id(self.test_user_id, datetime.date(2025, 5, 6), "Workout: Cardio"))
+        self.assertRegex(calendar["2025-05-06"], r"^[0-9a-v]{5,1024}$")
+        self.assertIn("Wednesday (2025-05-07): backend error", describe_results(results))
+
+        print("✅ Batched calendar insert correct")
+
+    def test_calendar_service_registry(self):
+        """Clients are built once per user, expired tokens are refreshed instead of re-authenticating"""
+        print("\n🧪 Testing Calendar service registry...")
+        from calendar_services import CalendarServiceRegistry
+
+        class FakeCreds:
+            def __init__(self, minutes_left, refresh_token="refresh"):
+                self.expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes_left)
+                self.refresh_token = refresh_token
+
+            @property
+            def valid(self):
+                return self.expiry > datetime.datetime.utcnow()
+
+        def refresh(creds):
+            creds.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+            return creds
+
+        stored = {"fresh": FakeCreds(60), "expired": FakeCreds(-5), "revoked": FakeCreds(-5, refresh_token=None)}
+        saved = []
+        registry = CalendarServiceRegistry(
+            stored.get, lambda user_id, creds: saved.append(user_id),
+            build=lambda creds: Mock(creds=creds), refresh=refresh
+        )
+
+        async def scenario():
+            first = await registry.get("fresh")
+            self.assertIs(await registry.get("fresh"), first)
+            self.assertIsNotNone(await registry.get("expired"))
+            self.assertIsNone(await registry.get("revoked"))
+            self.assertIsNone(await registry.get("unknown"))
+            stored["fresh"].expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=2)
+            await registry.refresh_expiring()
+
+        asyncio.run(scenario())
+        self.assertEqual(registry.builds, 2)
+        self.assertEqual(registry.hits, 1)
+        self.assertEqual(saved, ["expired", "fresh"])
+        self.assertTrue(stored["fresh"].expiry > datetime.datetime.utcnow() + datetime.timedelta(minutes=30))
+
+        print("✅ Calendar service registry correct")
+
+    def test_device_flow_against_stub_server(self):
+        """The device flow polls a local stub OAuth server in the background over one pooled connection"""
+        print("\n🧪 Testing OAuth device flow (stub server)...")
+        from aiohttp import web
+        from google_oauth import DeviceFlows, close_http_session
+
+        token_polls = []
+        client_ports = set()
+
+        async def device_code(request):
+            client_ports.add(request.transport.get_extra_info("peername")[1])
+            form = await request.post()
+            self.assertEqual(form["client_id"], "test_client_id")
+            return web.json_response({
+                "verification_url": "https://www.google.com/device", "user_code": "ABCD-EFGH",
+                "device_code": "test_device_code", "expires_in": 60, "interval": 0
+            })
+
+        async def token(request):
+            client_ports.add(request.transport.get_extra_info("peername")[1])
+            form = await request.post()
+            token_polls.append(form["device_code"])
+            if len(token_polls) < 3:
+                return web.json_response({"error": "authorization_pending"}, status=428)
+            return web.json_response({"access_token": "test_token", "refresh_token": "test_refresh", "expires_in": 3600})
+
+        async def scenario():
+            app = web.Application()
+            app.router.add_post("/device/code", device_code)
+            app.router.add_post("/token", token)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            host, port = runner.addresses[0][:2]
+            flows = DeviceFlows(
+                "test_client_id", "test_client_secret", ["scope"],
+                device_code_url=f"http://{host}:{port}/device/code", token_url=f"http://{host}:{port}/token"
+            )
+            notified = []
+
+            async def notify(verification_url, user_code, expires_in):
+                notified.append(user_code)
+
+            async def on_token(token_resp):
+                return token_resp["access_token"]
+
+            try:
+                task = await flows.start(self.test_user_id, notify, on_token)
+                self.assertIs(await flows.start(self.test_user_id, notify, on_token), task)  # Joins the pending flow
+                result = await task
+            finally:
+                await close_http_session()
+                await runner.cleanup()
+            return result, notified, flows.pending(self.test_user_id)
+
+        result, notified, pending = asyncio.run(scenario())
+        self.assertEqual(result, "test_token")
+        self.assertEqual(notified, ["ABCD-EFGH"])
+        self.assertIsNone(pending)
+        self.assertEqual(token_polls, ["test_device_code"] * 3)
+        self.assertEqual(len(client_ports), 1)  # Every request reused one kept-alive connection
+
+        print("✅ OAuth device flow correct")
+
+    def test_token_store(self):
+        """Tokens are upserted into SQLite, served from the hot cache, swept by expiry and imported from pickles"""
+        print("\n🧪 Testing token store...")
+        import pickle
+        from types import SimpleNamespace
+        from token_store import TokenStore
+
+        def creds(token, minutes_left):
+            return SimpleNamespace(token=token, expiry=datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes_left))
+
+        serialize = lambda c: json.dumps({"token": c.token, "expiry": c.expiry.isoformat()})
+        deserialize = lambda raw: SimpleNamespace(token=json.loads(raw)["token"],
+                                                  expiry=datetime.datetime.fromisoformat(json.loads(raw)["expiry"]))
+        path = os.path.join(self.temp_dir, "tokens.sqlite3")
+        store = TokenStore(path, serialize=serialize, deserialize=deserialize)
+        store.save("1", creds("old", 60))
+        store.save("1", creds("new", 60))  # Upsert replaces the row
+        store.save("2", creds("soon", 5))
+        self.assertEqual(store.load("1").token, "new")
+        self.assertIsNone(store.load("3"))
+        self.assertEqual(store.expiring(within=10 * 60), ["2"])
+
+        with open(os.path.join(self.temp_dir, "token_3.pickle"), "wb") as f:
+            pickle.dump(creds("imported", 60), f)
+        self.assertEqual(store.import_pickles(self.temp_dir), 1)
+        store.close()
+
+        reopened = TokenStore(path, serialize=serialize, deserialize=deserialize)  # Cold hot-cache
+        self.assertEqual(reopened.load("3").token, "imported")
+        self.assertEqual(reopened.count(), 3)
+        reopened.close()
+
+        print("✅ Token store correct")
+
+    def test_refresh_sweep_keeps_last_used(self):
+        """Background token refreshes don't count as activity, so idle users leave the active window"""
+        print("\n🧪 Testing refresh sweep and last_used...")
+        import time
+        from types import SimpleNamespace
+        from token_store import TokenStore, ACTIVE_WINDOW
+        from calendar_services import CalendarServiceRegistry
+
+        def creds(token, minutes_left):
+            expiry = datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes_left)
+            return SimpleNamespace(token=token, expiry=expiry, valid=minutes_left > 0, refresh_token="r")
+
+        serialize = lambda c: json.dumps({"token": c.token, "expiry": c.expiry.isoformat()})
+        deserialize = lambda raw: SimpleNamespace(token=json.loads(raw)["token"], valid=True, refresh_token="r",
+                                                  expiry=datetime.datetime.fromisoformat(json.loads(raw)["expiry"]))
+        store = TokenStore(os.path.join(self.temp_dir, "tokens.sqlite3"), serialize=serialize, deserialize=deserialize)
+        refreshed = []
+
+        def refresh(c):
+            refreshed.append(c.token)
+            c.token, c.expiry = c.token + "+", datetime.datetime.utcnow() + datetime.timedelta(minutes=60)
+            return c
+
+        registry = CalendarServiceRegistry(
+            store.load, store.save, build=lambda c: object(), refresh=refresh, list_expiring=store.expiring,
+            peek_credentials=lambda user_id: store.load(user_id, touch=False),
+            save_refreshed=lambda user_id, c: store.save(user_id, c, touch=False), active_window=ACTIVE_WINDOW
+        )
+        last_used = time.time() - ACTIVE_WINDOW + 60  # Just inside the window
+        store.save("1", creds("a", 5), last_used=last_used)
+        asyncio.run(registry.refresh_expiring())
+        self.assertEqual(refreshed, ["a"])
+        self.assertEqual(store.last_used("1"), last_used)
+
+        # Once the user falls outside the window, the sweep stops refreshing their token
+        store.save("1", creds("b", 5), last_used=time.time() - ACTIVE_WINDOW - 60)
+        self.assertEqual(store.expiring(within=10 * 60), [])
+        asyncio.run(registry.refresh_expiring())
+        self.assertEqual(refreshed, ["a"])
+
+        # A user-initiated load marks them active again; cached clients idle past the window are dropped
+        store.load("1")
+        self.assertGreater(store.last_used("1"), time.time() - 60)
+        asyncio.run(registry.register("2", creds("c", 5)))
+        registry._used_at["2"] -= ACTIVE_WINDOW + 1
+        store.save("2", creds("c", 5), last_used=time.time() - ACTIVE_WINDOW - 60)
+        asyncio.run(registry.refresh_expiring())
+        self.assertEqual(refreshed, ["a", "b"])
+        self.assertNotIn("2", registry._services)
+        store.close()
+
+        print("✅ Refresh sweep leaves last_used alone")
+
+
+class TestLLMScheduler(unittest.TestCase):
+    """Test suite for the priority-aware LLM scheduler (uses a fake model)"""
+
+    def test_priority_and_fifo_order(self):
+        """Interactive jobs run before /ask and /plan, FIFO within a class"""
+        print("\n🧪 Testing LLM scheduler ordering...")
+
+        scheduler = LLMScheduler(lambda: "fake-model")
+        started, gate = threading.Event(), threading.Event()
+        order = []
+        # Hold the model thread so the rest of the jobs queue up behind it
+        blocker = scheduler.submit(lambda model: started.set() or gate.wait(), PRIORITY_BACKGROUND, "blocker")
+        started.wait(timeout=5)
+        futures = [
+            scheduler.submit(lambda model: order.append("plan"), PRIORITY_PLAN, "plan"),
+            scheduler.submit(lambda model: order.append("ask-1"), PRIORITY_ASK, "ask"),
+            scheduler.submit(lambda model: order.append("ask-2"), PRIORITY_ASK, "ask"),
+            scheduler.submit(lambda model: order.append("log"), PRIORITY_INTERACTIVE, "log"),
+        ]
+        gate.set()
+        blocker.result(timeout=5)
+        for future in futures:
+            future.result(timeout=5)
+
+        self.assertEqual(order, ["log", "ask-1", "ask-2", "plan"])
+        self.assertEqual(scheduler.summary()["ask"]["count"], 2)
+        scheduler.shutdown()
+
+        print("✅ Scheduler ordering correct")
+
+    def test_queue_limit(self):
+        """A full priority class rejects new jobs without blocking others"""
+        print("\n🧪 Testing LLM scheduler queue limits...")
+
+        scheduler = LLMScheduler(lambda: "fake-model", queue_limits={PRIORITY_PLAN: 1})
+        started, gate = threading.Event(), threading.Event()
+        blocker = scheduler.submit(lambda model: started.set() or gate.wait(), PRIORITY_BACKGROUND, "blocker")
+        started.wait(timeout=5)
+        scheduler.submit(lambda model: "plan", PRIORITY_PLAN, "plan")
+        with self.assertRaises(LLMQueueFull):
+            scheduler.submit(lambda model: "plan", PRIORITY_PLAN, "plan")
+        log_future = scheduler.submit(lambda model: model, PRIORITY_INTERACTIVE, "log")
+        gate.set()
+        blocker.result(timeout=5)
+
+        self.assertEqual(log_future.result(timeout=5), "fake-model")
+        scheduler.shutdown()
+
+        print("✅ Scheduler queue limits enforced")
+
+    def test_owners_replaced_while_running(self):
+        """Owners set after the first job take over the queue once the default owner finishes its job"""
+        print("\n🧪 Testing LLM scheduler owner replacement...")
+
+        scheduler = LLMScheduler(lambda: "default-model")
+        started, gate = threading.Event(), threading.Event()
+        early = scheduler.submit(lambda model: started.set() or gate.wait() and model, PRIORITY_ASK, "early")
+        started.wait(timeout=5)
+        scheduler.set_model_owners([lambda: "worker-0", lambda: "worker-1"])
+        late = [scheduler.submit(lambda model: model, PRIORITY_ASK, "late") for _ in range(4)]
+        gate.set()
+
+        self.assertEqual(early.result(timeout=5), "default-model")  # The running job finishes on its owner
+        self.assertTrue({future.result(timeout=5) for future in late} <= {"worker-0", "worker-1"})
+        scheduler.shutdown()
+        self.assertEqual(sum(thread.is_alive() for thread in scheduler._threads), 0)
+
+        print("✅ Scheduler owners replaced without losing jobs")
+
+
+class TestMotivationPool(unittest.TestCase):
+    """Test suite for the pre-generated /log motivation pool (uses a fake generator)"""
+
+    def test_pool_serves_and_falls_back(self):
+        """Pooled messages are served once each; an empty bucket falls back to live generation"""
+        print("\n🧪 Testing motivation pool...")
+
+        generated = []
+
+        async def fake_generate(minutes, priority):
+            generated.append((minutes, priority))
+            return f"Great {minutes} minute session #{len(generated)}!"
+
+        async def scenario():
+            pool = MotivationPool([15, 30, 60], fake_generate, per_bucket=1)
+            await pool.refill(lambda: True)
+            self.assertEqual(pool.size(), 3)
+            first = await pool.get(28)  # Closest bucket is 30
+            self.assertIn("30 minute", first)
+            second = await pool.get(31)  # Bucket drained, generated live
+            self.assertNotEqual(first, second)
+            self.assertEqual((pool.hits, pool.misses), (1, 1))
+            # A repeat of a recently served message is never pooled again
+            self.assertFalse(pool.add(30, first))
+
+        asyncio.run(scenario())
+        print("✅ Motivation pool serves, evicts and falls back correctly")
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test suite for the persistent /ask response cache"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "responses.sqlite3")
+
+    def test_normalized_hits_and_persistence(self):
+        """Close prompt variants share an entry that survives a restart"""
+        print("\n🧪 Testing /ask response cache...")
+
+        cache = ResponseCache(self.path, max_variants=2)
+        self.assertIsNone(cache.get("Give me a workout tip", max_tokens=512))
+        cache.put("Give me a workout tip", "Warm up first!", max_tokens=512)
+        self.assertEqual(cache.get("  give me a WORKOUT tip?! ", max_tokens=512), "Warm up first!")
+        # Different generation parameters are a different entry
+        self.assertIsNone(cache.get("Give me a workout tip", max_tokens=128))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        cache.close()
+
+        reopened = ResponseCache(self.path, max_variants=2)
+        self.assertEqual(reopened.get("give me a workout tip", max_tokens=512), "Warm up first!")
+        reopened.close()
+
+        print("✅ Response cache normalizes prompts and persists entries")
+
+    def test_variants_and_lru_eviction(self):
+        """Variants rotate and the least recently used key is evicted at the size cap"""
+        print("\n🧪 Testing response cache variants and eviction...")
+
+        cache = ResponseCache(self.path, max_variants=2, max_bytes=40)
+        cache.put("tip", "answer one")
+        cache.put("tip", "answer two")
+        self.assertFalse(cache.needs_variant("tip"))
+        self.assertEqual({cache.get("tip"), cache.get("tip")}, {"answer one", "answer two"})
+        cache.put("meal", "x" * 30)  # Pushes the cache over 40 bytes
+        self.assertIsNone(cache.get("tip"))
+        self.assertIsNotNone(cache.get("meal"))
+        cache.close()
+
+        print("✅ Response cache rotates variants and evicts LRU keys")
+
+
+class TestLLMWorkerPool(unittest.TestCase):
+    """Test suite for the multi-process worker pool helpers"""
+
+    def test_core_slices(self):
+        """Cores are split into contiguous, non-overlapping slices covering every core"""
+        print("\n🧪 Testing worker core slices...")
+
+        slices = core_slices(3, cores=range(8))
+        self.assertEqual(slices, [[0, 1, 2], [3, 4, 5], [6, 7]])
+        # Never more workers than cores
+        self.assertEqual(core_slices(4, cores=[0, 1]), [[0], [1]])
+
+        print("✅ Core slices computed correctly")
+
+
+class FakeLlama:
+    """
+    Minimal stand-in for llama_cpp.Llama that tokenizes on whitespace and tracks evaluated tokens.
+    Like Llama, input_ids is a fixed n_ctx buffer and only the first n_tokens entries are valid.
+    """
+
+    def __init__(self, n_ctx=256):
+        self.input_ids = [0] * n_ctx
+        self.n_tokens = 0
+        self.evaluated = 0
+
+    def tokenize(self, text, special=False):
+        return [hash(word) for word in text.decode("utf-8").split()]
+
+    def reset(self):
+        self.n_tokens = 0  # The buffer keeps its stale contents, as in llama-cpp-python
+
+    def eval(self, tokens):
+        self.input_ids[self.n_tokens:self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+        self.evaluated += len(tokens)
+
+    def save_state(self):
+        return list(self.input_ids), self.n_tokens
+
+    def load_state(self, state):
+        self.input_ids, self.n_tokens = list(state[0]), state[1]
+
+    def __call__(self, prompt, **kwargs):
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        shared = 0
+        for a, b in zip(self.input_ids[:self.n_tokens], tokens):
+            if a != b:
+                break
+            shared += 1
+        self.n_tokens = shared
+        self.eval(tokens[shared:])
+        return {"choices": [{"text": "ok"}]}
+
+
+class TestPrefixCache(unittest.TestCase):
+    """Test suite for KV-cache reuse of fixed prompt prefixes (uses a fake model)"""
+
+    def test_only_suffix_is_evaluated(self):
+        """After warm-up, requests only evaluate the tokens after their template prefix"""
+        print("\n🧪 Testing prompt prefix cache...")
+
+        coach = "[INST] You are a friendly, supportive fitness coach."
+        onboarding = "[INST] You are onboarding a fitness client."
+        fake = FakeLlama()
+        cache = PrefixStateCache([coach, onboarding])
+        cache.warm(fake)
+        model = PrefixCachedModel(fake, cache)
+
+        fake.evaluated = 0
+        model(f"{coach} Give me a workout tip [/INST]")
+        self.assertEqual(fake.evaluated, 6)  # "Give me a workout tip [/INST]"
+        model(f"{onboarding} Q1: hi [/INST]")
+        model(f"{coach} How do I stay motivated? [/INST]")
+        self.assertEqual(cache.restores, 3)
+        self.assertEqual(fake.evaluated, 6 + 3 + 6)
+
+        # After a reset the buffer still holds the old tokens, but none of them are valid
+        fake.reset()
+        model(f"{coach} Rest days? [/INST]")
+        self.assertEqual(cache.restores, 4)
+        self.assertEqual(fake.evaluated, 6 + 3 + 6 + 3)
+
+        print("✅ Prefix cache restores snapshots and evaluates only suffixes")
+
+    def test_prefixes_end_on_token_boundaries(self):
+        """Every registered prefix tokenizes to a prefix of the prompts built from it"""
+        print("\n🧪 Testing prompt prefix token boundaries...")
+
+        class SpaceMergingTokenizer:
+            """GPT-2 style pre-tokenization: a space is merged into the word that follows it"""
+
+            def tokenize(self, text, special=False):
+                return re.findall(r" ?\S+|\s+(?!\S)|\s+", text.decode("utf-8"))
+
+        tokenizer = SpaceMergingTokenizer()
+        prompts = [
+            f"{utils.COACH_PREFIX} How do I stay motivated? [/INST]",
+            f"{utils.PLAN_PREFIX} 5k run. List only the days. [/INST]",
+            utils.motivation_prompt(30),
+            f"{utils.ONBOARDING_PREFIX}Q1: What is your goal?\nA1: Run a 5k\n[/INST]",
+            f"{utils.ONBOARDING_PLAN_PREFIX}Q1: What is your goal?\nA1: Run a 5k\nBased on this, draft a plan. [/INST]",
+        ]
+        for prefix in utils.prefix_cache.prefixes:
+            with self.subTest(prefix=prefix):
+                matching = [prompt for prompt in prompts if prompt.startswith(prefix)]
+                self.assertTrue(matching)
+                prefix_tokens = tokenize(tokenizer, prefix)
+                for prompt in matching:
+                    self.assertEqual(tokenize(tokenizer, prompt)[:len(prefix_tokens)], prefix_tokens)
+
+        print("✅ Prompt prefixes end on token boundaries")
+
+    def test_session_rounds_evaluate_only_new_turns(self):
+        """An onboarding session resumes from its saved state, from memory or disk, and evaluates only the new Q/A"""
+        print("\n🧪 Testing onboarding session states...")
+        from llm_sessions import SessionStateCache
+
+        onboarding = "[INST] You are onboarding a fitness client. Here is the conversation so far:"
+        fake = FakeLlama()
+        cache = PrefixStateCache([onboarding])
+        cache.warm(fake)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sessions = SessionStateCache(max_in_memory=1, directory=tmpdir)
+            model = PrefixCachedModel(fake, cache, sessions=sessions)
+
+            model(f"{onboarding} [/INST]", session_id="u1")
+            model(f"{onboarding} Q1: goal? A1: run [/INST]", session_id="u1")
+            # Another user's session pushes u1's state to disk, and an unrelated request replaces the KV cache
+            model(f"{onboarding} Q1: age? A1: 30 [/INST]", session_id="u2")
+            model("[INST] You are a friendly coach [/INST]")
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+
+            fake.evaluated = 0
+            model(f"{onboarding} Q1: goal? A1: run Q2: days? A2: three [/INST]", session_id="u1")
+            self.assertEqual(fake.evaluated, 5)  # "Q2: days? A2: three [/INST]"
+            self.assertEqual(sessions.disk_hits, 1)
+
+            model(f"{onboarding} Q1: goal? A1: run Q2: days? A2: three plan [/INST]", session_id="u1", end_session=True)
+            self.assertIsNone(sessions.get("u1"))
+
+        print("✅ Session rounds resumed from saved state")
+
+    def test_session_disk_budget(self):
+        """Evicted session states stay within the disk budget; the oldest files are deleted first"""
+        print("\n🧪 Testing session state disk budget...")
+        from llm_sessions import SessionStateCache
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sessions = SessionStateCache(max_in_memory=1, directory=tmpdir, max_disk_bytes=2500)
+            for i in range(6):
+                sessions.put(f"u{i}", [1, 2, 3], b"x" * 1000)
+                # Distinct mtimes, so "oldest" is well defined
+                for name in os.listdir(tmpdir):
+                    path = os.path.join(tmpdir, name)
+                    os.utime(path, (os.path.getmtime(path) - 1,) * 2)
+            self.assertEqual(len(os.listdir(tmpdir)), 2)
+            self.assertEqual(sessions.pruned, 3)
+            self.assertIsNone(sessions.get("u0"))
+            self.assertEqual(sessions.get("u4")[1], b"x" * 1000)
+
+            sessions.max_age = -1  # Expired files are pruned on the next put as well
+            sessions.put("u6", [1], b"y")
+            self.assertEqual(os.listdir(tmpdir), [])
+
+        print("✅ Session state disk budget enforced")
+
+
+class TestPromptBudget(unittest.TestCase):
+    """Test suite for token-budget prompt assembly (whitespace tokens via FakeLlama)"""
+
+    def test_clamp_and_refuse(self):
+        """max_tokens is clamped to the context left, and prompts without room for an answer are refused"""
+        print("\n🧪 Testing prompt token budget...")
+        from prompt_budget import PromptBudget, PromptTooLong
+
+        budget = PromptBudget(n_ctx=100, tokenizer=FakeLlama(), min_output=10)
+        prompt = " ".join(["word"] * 40)
+        self.assertEqual(budget.max_tokens(prompt, 2000), 60)
+        self.assertEqual(budget.max_tokens(prompt, 20), 20)
+        self.assertEqual(budget.max_tokens(prompt), 60)
+        with self.assertRaises(PromptTooLong) as raised:
+            budget.check(" ".join(["word"] * 95))
+        self.assertEqual((raised.exception.tokens, raised.exception.limit), (95, 90))
+        self.assertEqual(budget.stats(), {"clamped": 1, "refused": 1})
+
+        print("✅ Prompt budget clamps and refuses correctly")
+
+    def test_fit_folds_oldest_turns(self):
+        """Long onboarding transcripts fold their oldest turns into a summary until the prompt fits"""
+        print("\n🧪 Testing onboarding transcript fitting...")
+        from prompt_budget import PromptBudget, PromptTooLong
+        from onboarding import transcript
+
+        history = [{"q": f"Question {i}?", "a": " ".join(["detail"] * 20)} for i in range(1, 9)]
+        budget = PromptBudget(n_ctx=200, tokenizer=FakeLlama())
+        render = lambda folded: f"[INST] Onboarding: {transcript(history, folded)}[/INST]"
+
+        prompt, folded = budget.fit(render, len(history), reserve=50)
+        self.assertEqual(folded, 8)  # Folded in steps of 4
+        self.assertIn("Summary of earlier answers: Question 1? -> detail", prompt)
+        self.assertLessEqual(len(prompt.split()) + 50, 200)
+        prompt, folded = PromptBudget(n_ctx=220, tokenizer=FakeLlama()).fit(render, len(history), reserve=50)
+        self.assertEqual(folded, 4)
+        self.assertIn("Q5: Question 5?", prompt)
+        self.assertNotIn("Q4:", prompt)
+        with self.assertRaises(PromptTooLong):
+            PromptBudget(n_ctx=60, tokenizer=FakeLlama()).fit(render, len(history), reserve=50)
+        # Unfolded transcripts only grow at the end, which keeps onboarding session states reusable
+        self.assertTrue(transcript(history).startswith(transcript(history[:3])))
+
+        print("✅ Onboarding transcripts folded to fit the context")
+
+
+class TestStreaks(unittest.TestCase):
+    """Test suite for the materialized streak records"""
+
+    def test_advance_streak(self):
+        """Consecutive days extend the streak, gaps reset it, repeats are ignored"""
+        print("\n🧪 Testing streak updates...")
+
+        day = datetime.date(2025, 5, 1)
+        record = advance_streak({}, day)
+        self.assertEqual(record, {"current": 1, "last_date": "2025-05-01", "best": 1})
+        record = advance_streak(record, day + datetime.timedelta(days=1))
+        record = advance_streak(record, day + datetime.timedelta(days=1))  # Second log the same day
+        record = advance_streak(record, day + datetime.timedelta(days=2))
+        self.assertEqual(record["current"], 3)
+        record = advance_streak(record, day + datetime.timedelta(days=5))
+        self.assertEqual(record, {"current": 1, "last_date": "2025-05-06", "best": 3})
+
+        print("✅ Streak updates correct")
+
+    def test_streak_backfill_from_dates(self):
+        """Backfill computes the current and best streak from unordered log dates"""
+        print("\n🧪 Testing streak backfill...")
+
+        record = streak_from_dates(["2025-05-10", "2025-05-01", "2025-05-02", "2025-05-03", "2025-05-09"])
+        self.assertEqual(record, {"current": 2, "last_date": "2025-05-10", "best": 3})
+        self.assertEqual(streak_from_dates([]), {})
+
+        print("✅ Streak backfill correct")
+
+
+class TestDMFanout(unittest.TestCase):
+    """Test suite for the rate-limited DM fan-out used by the streak job"""
+
+    def test_fanout_retries_and_reports(self):
+        """429s are retried, forbidden users are counted as failed, cached users skip fetch_user"""
+        print("\n🧪 Testing DM fan-out...")
+        import discord
+        from dm_fanout import DMFanout
+
+        def http_error(cls, status):
+            response = Mock(status=status, reason="error", headers={"Retry-After": "0"})
+            return cls(response, "error")
+
+        sent = []
+        attempts = {}
+
+        def make_user(user_id):
+            async def send(content):
+                attempts[user_id] = attempts.get(user_id, 0) + 1
+                if user_id == 2 and attempts[user_id] == 1:
+                    raise http_error(discord.HTTPException, 429)
+                if user_id == 3:
+                    raise http_error(discord.Forbidden, 403)
+                sent.append((user_id, content))
+            channel = Mock(id=user_id, send=send)
+            return Mock(dm_channel=channel)
+
+        cached = {1: make_user(1)}
+        fetched = []
+
+        async def fetch_user(user_id):
+            fetched.append(user_id)
+            return make_user(user_id)
+
+        bot = Mock(get_user=lambda user_id: cached.get(user_id), fetch_user=fetch_user)
+        fanout = DMFanout(bot, concurrency=2)
+        report = asyncio.run(fanout.send_all([(1, "a"), ("2", "b"), (3, "c")]))
+
+        self.assertEqual((report["sent"], report["deferred"], report["failed"]), (2, 0, 1))
+        self.assertEqual(sorted(sent), [(1, "a"), (2, "b")])
+        self.assertEqual(attempts[2], 2)
+        self.assertEqual(sorted(fetched), [2, 3])
+
+        print(f"✅ DM fan-out correct ({report['sent']} sent in {report['elapsed']:.2f}s)")
+
+    def test_route_buckets_stay_bounded(self):
+        """Per-channel rate-limit buckets are evicted least recently used instead of piling up"""
+        print("\n🧪 Testing DM fan-out route buckets...")
+        from dm_fanout import DMFanout
+
+        def make_user(user_id):
+            async def send(content):
+                pass
+            return Mock(dm_channel=Mock(id=user_id, send=send))
+
+        users = {user_id: make_user(user_id) for user_id in range(50)}
+        bot = Mock(get_user=lambda user_id: users[user_id])
+        fanout = DMFanout(bot, concurrency=2, route_cache_size=10)
+        report = asyncio.run(fanout.send_all([(user_id, "streak!") for user_id in range(50)]))
+
+        self.assertEqual(report["sent"], 50)
+        self.assertLessEqual(len(fanout._routes), 10)
+        self.assertIn(("send_message", 49), fanout._routes)
+
+        print("✅ DM fan-out route buckets bounded")
+
+
+class TestWriteBehindBuffer(unittest.TestCase):
+    """Test suite for the batched Firestore write-behind buffer"""
+
+    def test_coalesces_and_flushes_in_batches(self):
+        """Writes to one document are merged, full buffers flush early, close() flushes the rest"""
+        print("\n🧪 Testing write-behind buffer...")
+        from write_behind import WriteBehindBuffer
+
+        commits = []
+
+        class FakeBatch:
+            def __init__(self):
+                self.writes = []
+
+            def set(self, ref, data, merge=False):
+                self.writes.append((ref, data, merge))
+
+            def commit(self):
+                commits.append(self.writes)
+
+        db = Mock()
+        db.batch = FakeBatch
+        db.collection = lambda name: Mock(document=lambda doc_id: f"{name}/{doc_id}")
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, max_batch=3, flush_interval=60)
+            buffer.set("logs", "1", {"2025-05-01": 30}, merge=True)
+            buffer.set("logs", "1", {"2025-05-02": 20}, merge=True)
+            buffer.set("profiles", "1", {"q": "a"}, merge=True)
+            self.assertEqual(buffer.pending(), 2)
+            buffer.set("profiles", "2", {"q": "b"}, merge=True)  # Size trigger
+            await asyncio.sleep(0.2)
+            self.assertEqual(buffer.pending(), 0)
+            buffer.set("profiles", "3", {"q": "c"}, merge=True)
+            await buffer.close()
+            return buffer
+
+        buffer = asyncio.run(scenario())
+        self.assertEqual([len(batch) for batch in commits], [3, 1])
+        self.assertIn(("logs/1", {"2025-05-01": 30, "2025-05-02": 20}, True), commits[0])
+        self.assertEqual(buffer.coalesced, 1)
+
+        print(f"✅ Write-behind buffer correct ({buffer.summary()})")
+
+    def test_bad_writes_are_isolated_and_dropped(self):
+        """A write that can never commit is isolated by bisection and dropped; the rest of its batch goes through"""
+        print("\n🧪 Testing write-behind poison writes...")
+        from write_behind import WriteBehindBuffer
+
+        commits = []
+        outage = {"flaky": 0}
+
+        class FakeBatch:
+            def __init__(self):
+                self.writes = []
+
+            def set(self, ref, data, merge=False):
+                self.writes.append((ref, data, merge))
+
+            def commit(self):
+                refs = [ref for ref, _, _ in self.writes]
+                if "profiles/bad" in refs:
+                    raise ValueError("Cannot convert to a Firestore Value")
+                if "profiles/flaky" in refs:
+                    outage["flaky"] += 1
+                    raise ConnectionError("deadline exceeded")
+                commits.append(refs)
+
+        db = Mock()
+        db.batch = FakeBatch
+        db.collection = lambda name: Mock(document=lambda doc_id: f"{name}/{doc_id}")
+
+        async def scenario():
+            buffer = WriteBehindBuffer(db, max_batch=10, flush_interval=60, max_attempts=3)
+            for doc_id in ("1", "bad", "2", "3"):
+                buffer.set("profiles", doc_id, {"q": doc_id})
+            self.assertTrue(await buffer.flush())  # Non-retryable: dropped right away
+            self.assertEqual(buffer.dropped, 1)
+            self.assertEqual(sorted(ref for refs in commits for ref in refs), ["profiles/1", "profiles/2", "profiles/3"])
+
+            commits.clear()
+            buffer.set("profiles", "flaky", {"q": "x"})
+            buffer.set("profiles", "4", {"q": "4"})
+            self.assertFalse(await buffer.flush())  # Transient: the whole batch is retried
+            self.assertEqual(buffer.pending(), 2)
+            self.assertFalse(await buffer.flush())
+            self.assertTrue(await buffer.flush())  # Out of attempts: isolated, dropped, the rest committed
+            self.assertEqual(buffer.pending(), 0)
+            self.assertEqual(buffer.dropped, 2)
+            self.assertEqual(commits, [["profiles/4"]])
+            await buffer.close()
+
+        asyncio.run(scenario())
+
+        print("✅ Poison writes dropped without blocking the rest")
+
+
+class TestDataAccess(unittest.TestCase):
+    """Test suite for the async Firestore access path"""
+
+    def test_exists_sees_buffered_writes(self):
+        """A document with a buffered write exists before it is committed"""
+        print("\n🧪 Testing async Firestore store...")
+        from data_access import FirestoreStore
+
+        committed = {"logs/1": {"2025-05-01": 30}}
+
+        class FakeSnapshot:
+            def __init__(self, data):
+                self.exists = data is not None
+                self._data = data
+
+            def to_dict(self):
+                return self._data
+
+        def collection(name):
+            def document(doc_id):
+                async def get():
+                    return FakeSnapshot(committed.get(f"{name}/{doc_id}"))
+                return Mock(get=get)
+            return Mock(document=document)
+
+        buffer = Mock(is_pending=lambda collection, doc_id: (collection, doc_id) == ("logs", "2"))
+        store = FirestoreStore(Mock(collection=collection), buffer)
+
+        async def scenario():
+            return (
+                await store.exists("logs", "1"),
+                await store.exists("logs", "2"),
+                await store.exists("logs", "3"),
+                await store.get("logs", "1"),
+            )
+
+        self.assertEqual(asyncio.run(scenario()), (True, True, False, {"2025-05-01": 30}))
+
+        print("✅ Async Firestore store correct")
+
+
+class TestLogStore(unittest.TestCase):
+    """Test suite for the month-sharded workout log storage"""
+
+    def test_log_and_read_range(self):
+        """Logs land in month shards and range reads only fetch the months they cover"""
+        print("\n🧪 Testing sharded workout logs...")
+        from log_store import log_workout, read_range, last_n_days, shard_ids_between
+
+        self.assertEqual(shard_ids_between(datetime.date(2024, 11, 20), datetime.date(2025, 2, 1)),
+                         ["2024-11", "2024-12", "2025-01", "2025-02"])
+
+        class FakeStore:
+            def __init__(self):
+                self.docs = {}
+                self.reads = []
+
+            def set_later(self, collection, doc_id, data, merge=False):
+                doc = self.docs.setdefault((collection, doc_id), {})
+                for key, value in data.items():
+                    doc.setdefault(key, {}).update(value)
+
+            async def get(self, collection, doc_id):
+                self.reads.append(doc_id)
+                return self.docs.get((collection, doc_id))
+
+        store = FakeStore()
+        for day, minutes in ((datetime.date(2025, 4, 29), 20), (datetime.date(2025, 5, 1), 30),
+                             (datetime.date(2025, 5, 2), 45), (datetime.date(2025, 5, 2), 50)):
+            log_workout(store, "42", day, minutes)
+
+        self.assertEqual(store.docs[("logs/42/months", "2025-05")], {"days": {"01": 30, "02": 50}})
+        self.assertEqual(store.docs[("logs", "42")]["meta"]["last_date"], "2025-05-02")
+
+        logs = asyncio.run(last_n_days(store, "42", 3, today=datetime.date(2025, 5, 2)))
+        self.assertEqual(logs, {datetime.date(2025, 5, 1): 30, datetime.date(2025, 5, 2): 50})
+        self.assertEqual(store.reads, ["2025-04", "2025-05"])
+
+        store.reads.clear()
+        logs = asyncio.run(read_range(store, "42", datetime.date(2025, 5, 2), datetime.date(2025, 5, 31)))
+        self.assertEqual(logs, {datetime.date(2025, 5, 2): 50})
+        self.assertEqual(store.reads, ["2025-05"])
+
+        print("✅ Sharded workout logs correct")
+
+
+class TestDocumentCache(unittest.TestCase):
+    """Test suite for the read-through Firestore document cache"""
+
+    def test_negative_caching_and_write_through(self):
+        """Missing documents are cached, own writes update cached copies, the size cap evicts LRU entries"""
+        print("\n🧪 Testing document cache...")
+        from doc_cache import DocumentCache
+
+        cache = DocumentCache(max_entries=2, ttl=60, negative_ttl=60)
+        self.assertEqual(cache.lookup("logs", "1"), (False, None))
+        cache.store("logs", "1", None)
+        self.assertEqual(cache.lookup("logs", "1"), (True, None))
+
+        # A merge onto "no document" can't be applied locally, so it invalidates
+        cache.note_write("logs", "1", {"meta": {"last_date": "2025-05-01"}}, merge=True)
+        self.assertEqual(cache.lookup("logs", "1"), (False, None))
+
+        cache.store("profiles", "1", {"goal": "strength", "answers": {"q1": "a"}})
+        cache.note_write("profiles", "1", {"answers": {"q2": "b"}}, merge=True)
+        self.assertEqual(cache.lookup("profiles", "1"),
+                         (True, {"goal": "strength", "answers": {"q1": "a", "q2": "b"}}))
+
+        # A read that a write overtakes must not cache its stale result
+        cache.begin_read("profiles", "2")
+        cache.note_write("profiles", "2", {"goal": "endurance"})
+        cache.end_read("profiles", "2", None)
+        self.assertEqual(cache.lookup("profiles", "2"), (True, {"goal": "endurance"}))
+
+        cache.store("logs", "3", {"meta": {}})
+        self.assertEqual(cache.lookup("profiles", "1")[0], False)  # Evicted: least recently used
+        self.assertGreater(cache.stats()["hit_rate"], 0)
+
+        print(f"✅ Document cache correct ({cache.stats()})")
+
+
+class FakeOnboardingStore:
+    """In-memory stand-in for data_access.FirestoreStore, as used by OnboardingManager"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def get(self, collection, doc_id):
+        data = self.docs.get((collection, doc_id))
+        return json.loads(json.dumps(data)) if data is not None else None
+
+    def set_later(self, collection, doc_id, data, merge=False):
+        current = self.docs.get((collection, doc_id), {}) if merge else {}
+        self.docs[(collection, doc_id)] = {**current, **json.loads(json.dumps(data))}
+
+    async def query(self, collection, field, op, value):
+        return [(doc_id, json.loads(json.dumps(data))) for (c, doc_id), data in self.docs.items()
+                if c == collection and data.get(field) in value]
+
+
+class TestOnboardingManager(unittest.TestCase):
+    """Test suite for the concurrency-bounded, resumable onboarding sessions"""
+
+    def test_admission_limit_and_replies(self):
+        """Only max_active sessions use the LLM at once; replies resume sessions until the plan is drafted"""
+        print("\n🧪 Testing onboarding admission limit...")
+        from onboarding import OnboardingManager
+
+        store = FakeOnboardingStore()
+        sent, plans = [], []
+        running = [0]
+        peak = [0]
+
+        async def send(user_id, text):
+            sent.append((user_id, text))
+
+        async def ask_next(user_id, history):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+            return "DONE" if len(history) >= 2 else f"Question {len(history) + 1}?"
+
+        async def draft_plan(user_id, history):
+            plans.append((user_id, [turn["a"] for turn in history]))
+
+        async def scenario():
+            manager = OnboardingManager(store, send, ask_next, draft_plan, max_active=2)
+            for uid in ("1", "2", "3", "4", "5"):
+                await manager.begin(uid)
+                self.assertTrue(await manager.handle_reply(uid, "yes"))
+            self.assertEqual(manager.stats()["active"], 2)
+            self.assertEqual(manager.stats()["queued"], 3)
+            await asyncio.sleep(0.1)
+            self.assertEqual(manager.stats()["awaiting_reply"], 5)
+            for answer in ("beginner", "3 days"):
+                for uid in ("1", "2", "3", "4", "5"):
+                    self.assertTrue(await manager.handle_reply(uid, f"{answer} from {uid}"))
+                await asyncio.sleep(0.1)
+            self.assertFalse(await manager.handle_reply("1", "hello again"))  # Finished sessions ignore DMs
+            return manager.stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(stats["completed"], 5)
+        self.assertEqual(sorted(plans)[0], ("1", ["beginner from 1", "3 days from 1"]))
+        self.assertEqual(store.docs[("profiles", "1")], {"Question 1?": "beginner from 1", "Question 2?": "3 days from 1"})
+        self.assertEqual(store.docs[("onboarding", "1")]["status"], "done")
+
+        print("✅ Onboarding sessions admitted two at a time and completed")
+
+    def test_resume_after_restart(self):
+        """A new manager picks up late replies and re-queues sessions that were mid-step"""
+        print("\n🧪 Testing onboarding resume...")
+        from onboarding import OnboardingManager
+
+        store = FakeOnboardingStore()
+        sent, asked = [], []
+
+        async def send(user_id, text):
+            sent.append((user_id, text))
+
+        async def ask_next(user_id, history):
+            asked.append((user_id, len(history)))
+            return "How often do you train?"
+
+        async def no_plan(user_id, history):
+            pass
+
+        store.set_later("onboarding", "7", {"status": "awaiting_answer", "history": [], "question": "Goal?",
+                                            "updated_at": "2026-01-01T00:00:00"})
+        store.set_later("onboarding", "8", {"status": "active", "history": [{"q": "Goal?", "a": "5k"}],
+                                            "question": None, "updated_at": "2026-01-01T00:00:00"})
+
+        async def scenario():
+            manager = OnboardingManager(store, send, ask_next, no_plan)
+            self.assertEqual(await manager.resume_pending(), 1)
+            self.assertTrue(await manager.handle_reply("7", "Run a 5k"))
+            await asyncio.sleep(0.05)
+
+        asyncio.run(scenario())
+        self.assertEqual(sorted(asked), [("7", 1), ("8", 1)])
+        self.assertEqual(store.docs[("onboarding", "7")]["history"], [{"q": "Goal?", "a": "Run a 5k"}])
+        self.assertEqual(store.docs[("onboarding", "8")]["status"], "awaiting_answer")
+        self.assertIn(("8", "How often do you train?"), sent)
+
+        print("✅ Onboarding sessions resumed after a restart")
+
+    def test_dms_without_sessions_and_plan_failures(self):
+        """DMs from users without a session are negatively cached, finished sessions leave memory,
+        and a failed plan draft says so"""
+        print("\n🧪 Testing onboarding DM lookups and plan failures...")
+        from onboarding import OnboardingManager
+
+        store = FakeOnboardingStore()
+        reads, sent = [], []
+        original_get = store.get
+
+        async def counting_get(collection, doc_id):
+            reads.append(doc_id)
+            return await original_get(collection, doc_id)
+
+        store.get = counting_get
+
+        async def send(user_id, text):
+            sent.append((user_id, text))
+
+        async def ask_next(user_id, history):
+            return "DONE"
+
+        async def draft_plan(user_id, history):
+            if user_id == "2":
+                raise RuntimeError("model crashed")
+
+        store.set_later("onboarding", "9", {"status": "done", "history": [], "question": None})
+
+        async def scenario():
+            manager = OnboardingManager(store, send, ask_next, draft_plan)
+            for _ in range(3):
+                self.assertFalse(await manager.handle_reply("1", "hi"))
+                self.assertFalse(await manager.handle_reply("9", "thanks!"))
+            self.assertEqual(sorted(reads), ["1", "9"])  # One Firestore read per user
+            self.assertNotIn("9", manager._states)
+
+            for uid in ("1", "2"):
+                await manager.begin(uid, consented=True)  # A new session replaces the cached "none"
+            await asyncio.sleep(0.05)
+            return manager
+
+        manager = asyncio.run(scenario())
+        self.assertEqual(store.docs[("onboarding", "1")]["status"], "done")
+        self.assertEqual(manager._states.keys(), {"2"})  # Only the failed session stays, to be resumed
+        self.assertTrue(any(uid == "2" and "drafting your workout plan" in text for uid, text in sent))
+
+        print("✅ Onboarding DMs cached and plan failures reported")
+
 
 class TestIntegration(unittest.TestCase):
     """Integration tests combining multiple functionalities"""
+
+    @classmethod
+    def setUpClass(cls):
+        utils.load_llm()
     
     def test_end_to_end_workflow(self):
         """Test the complete workflow: LLM -> Parse -> Calendar format"""
@@ -285,7 +1697,7 @@ class TestIntegration(unittest.TestCase):
         )
         prompt = f"<s>[INST] You are a friendly, supportive fitness coach. {prompt} [/INST]"
         
-        output = llm(prompt, max_tokens=500, top_p=0.95, stop=["<s>"])
+        output = utils.llm(prompt, max_tokens=500, top_p=0.95, stop=["<s>"])
         llm_response = output["choices"][0]["text"] # type: ignore
         
         # Step 2: Parse the workout plan
@@ -334,8 +1746,25 @@ def run_tests():
     
     # Add test classes
     suite.addTests(loader.loadTestsFromTestCase(TestLLMFunctionality))
+    suite.addTests(loader.loadTestsFromTestCase(TestLLMLoading))
     suite.addTests(loader.loadTestsFromTestCase(TestWorkoutPlanParsing))
+    suite.addTests(loader.loadTestsFromTestCase(TestPlanGrammar))
+    suite.addTests(loader.loadTestsFromTestCase(TestPlanStore))
+    suite.addTests(loader.loadTestsFromTestCase(TestExpiringStore))
     suite.addTests(loader.loadTestsFromTestCase(TestGoogleCalendarIntegration))
+    suite.addTests(loader.loadTestsFromTestCase(TestLLMScheduler))
+    suite.addTests(loader.loadTestsFromTestCase(TestMotivationPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestResponseCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestPrefixCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestLLMWorkerPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestPromptBudget))
+    suite.addTests(loader.loadTestsFromTestCase(TestStreaks))
+    suite.addTests(loader.loadTestsFromTestCase(TestDMFanout))
+    suite.addTests(loader.loadTestsFromTestCase(TestWriteBehindBuffer))
+    suite.addTests(loader.loadTestsFromTestCase(TestDataAccess))
+    suite.addTests(loader.loadTestsFromTestCase(TestLogStore))
+    suite.addTests(loader.loadTestsFromTestCase(TestDocumentCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestOnboardingManager))
     suite.addTests(loader.loadTestsFromTestCase(TestIntegration))
     
     # Run tests
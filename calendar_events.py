@@ -0,0 +1,107 @@
+"""
+Google Calendar event insertion for confirmed workout plans.
+
+All of a plan's events are sent in one batch HTTP request, executed in a
+worker thread so the event loop keeps serving Discord. Every event gets a
+deterministic id derived from the user, date and workout, so confirming the
+same plan twice does not create duplicates: Calendar answers 409 for an id it
+already has, which is reported as "already in your calendar".
+"""
+import asyncio
+import base64
+import datetime
+import hashlib
+from collections import namedtuple
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+CALENDAR_BATCH_LIMIT = 50  # Maximum calls per Google API batch request
+
+EventResult = namedtuple("EventResult", ["day", "date", "summary", "status", "error"])  # status: created/exists/failed
+
+
+def event_id(user_id: str, event_date: datetime.date, summary: str) -> str:
+    """Stable Calendar event id (base32hex: lowercase a-v and 0-9) for one workout."""
+    digest = hashlib.sha1(f"project5k|{user_id}|{event_date.isoformat()}|{summary}".encode("utf-8")).digest()
+    return base64.b32hexencode(digest).decode("ascii").rstrip("=").lower()
+
+
+def plan_events(user_id: str, plan, today: datetime.date):
+    """Turn (day, workout) pairs into (event_id, day, date, body) for the next occurrence of each weekday."""
+    events = []
+    seen = set()
+    for day, desc in plan:
+        if day not in WEEKDAYS:
+            continue
+        days_ahead = (WEEKDAYS.index(day) - today.weekday() + 7) % 7
+        event_date = today + datetime.timedelta(days=days_ahead)
+        summary = f"Workout: {desc}"
+        body = {
+            "id": event_id(user_id, event_date, summary),
+            "summary": summary,
+            "start": {"date": event_date.isoformat()},
+            "end": {"date": event_date.isoformat()},
+        }
+        if body["id"] in seen:
+            continue  # The same workout listed twice; a batch can't hold one id twice
+        seen.add(body["id"])
+        events.append((body["id"], day, event_date, body))
+    return events
+
+
+def _http_status(exception):
+    resp = getattr(exception, "resp", None)
+    return getattr(resp, "status", None)
+
+
+def _execute_batches(service, events):
+    """Blocking part: send the inserts as batch requests and collect one outcome per event id."""
+    outcomes = {}
+
+    def on_response(request_id, response, exception):
+        outcomes[request_id] = exception
+
+    for start in range(0, len(events), CALENDAR_BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_response)
+        for event_id_, _, _, body in events[start:start + CALENDAR_BATCH_LIMIT]:
+            batch.add(service.events().insert(calendarId="primary", body=body), request_id=event_id_)
+        batch.execute()
+    return outcomes
+
+
+async def insert_plan_events(service, user_id: str, plan, today: datetime.date | None = None):
+    """Insert a plan's workouts into the user's primary calendar. Returns one EventResult per workout."""
+    events = plan_events(user_id, plan, today or datetime.date.today())
+    if not events:
+        return []
+    outcomes = await asyncio.to_thread(_execute_batches, service, events)
+    results = []
+    for event_id_, day, event_date, body in events:
+        exception = outcomes.get(event_id_, RuntimeError("no response in batch"))
+        if exception is None:
+            results.append(EventResult(day, event_date, body["summary"], "created", None))
+        elif _http_status(exception) == 409:
+            results.append(EventResult(day, event_date, body["summary"], "exists", None))
+        else:
+            results.append(EventResult(day, event_date, body["summary"], "failed", str(exception)))
+    return results
+
+
+def describe_results(results) -> str:
+    """Discord message summarizing a calendar insert, with a line per failed workout."""
+    created = sum(1 for r in results if r.status == "created")
+    existing = sum(1 for r in results if r.status == "exists")
+    failed = [r for r in results if r.status == "failed"]
+    if not results:
+        return "❌ I couldn't find any days in your plan to add to Google Calendar."
+    lines = []
+    if failed:
+        lines.append(f"⚠️ Added {created} of {len(results)} workouts to your Google Calendar"
+                     + (f" ({existing} were already there)" if existing else "") + ".")
+        for r in failed:
+            lines.append(f"- {r.day} ({r.date.isoformat()}): {r.error}")
+        lines.append("Run `/confirmplan` again to retry the missing days; the ones already added won't be duplicated.")
+    elif existing:
+        lines.append(f"✅ Added {created} workouts to your Google Calendar ({existing} were already there).")
+    else:
+        lines.append("✅ Added your workout plan to your Google Calendar!")
+    return "\n".join(lines)
@@ -0,0 +1,168 @@
+"""
+Per-user Google Calendar clients.
+
+Building a Calendar client parses the API's discovery document, and the old
+code did that (and unpickled the user's token) on every /confirmplan. The
+registry keeps an LRU of built clients per user, builds them from the
+discovery document bundled with google-api-python-client (static_discovery,
+no network fetch), refreshes expired access tokens with the refresh token
+instead of sending the user through the device flow again, and refreshes
+tokens that are about to expire from a background job.
+
+Credentials are loaded and saved through the callables passed in, so the
+registry does not care where tokens are stored.
+"""
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+
+REFRESH_MARGIN = 10 * 60  # Refresh access tokens this many seconds before they expire
+MARK_USED_INTERVAL = 60 * 60  # Cache hits record the user as active at most this often
+
+
+def build_calendar(creds):
+    from googleapiclient.discovery import build
+    return build("calendar", "v3", credentials=creds, static_discovery=True, cache_discovery=False)
+
+
+def _refresh(creds):
+    from google.auth.transport.requests import Request
+    creds.refresh(Request())
+    return creds
+
+
+def _expires_within(creds, seconds: float) -> bool:
+    expiry = getattr(creds, "expiry", None)
+    if expiry is None:
+        return False
+    # google-auth stores expiry as a naive UTC datetime
+    return expiry - datetime.datetime.utcnow() < datetime.timedelta(seconds=seconds)
+
+
+class CalendarServiceRegistry:
+    """LRU cache of built Calendar clients keyed by user id."""
+
+    def __init__(self, load_credentials, save_credentials, max_services=200, refresh_margin=REFRESH_MARGIN,
+                 build=build_calendar, refresh=_refresh, list_expiring=None,
+                 peek_credentials=None, save_refreshed=None, mark_used=None, active_window=None):
+        # User-initiated access goes through load/save_credentials, which may record the user as active;
+        # the background sweep uses peek_credentials/save_refreshed, which must not (all blocking)
+        self.load_credentials = load_credentials  # user_id -> Credentials or None
+        self.save_credentials = save_credentials  # (user_id, Credentials) -> None
+        self.peek_credentials = peek_credentials or load_credentials
+        self.save_refreshed = save_refreshed or save_credentials
+        self.mark_used = mark_used  # user_id -> None, for users served from the client cache
+        self.list_expiring = list_expiring  # seconds -> user ids whose stored token expires by then
+        self.active_window = active_window  # Cached clients idle longer than this are dropped, not refreshed
+        self.max_services = max_services
+        self.refresh_margin = refresh_margin
+        self._build = build
+        self._refresh = refresh
+        self._services = OrderedDict()  # user_id -> (service, creds)
+        self._locks = {}
+        self._used_at = {}  # user_id -> monotonic time of the last get()
+        self._marked_at = {}  # user_id -> monotonic time of the last mark_used call
+        self.builds = 0
+        self.hits = 0
+        self.refreshes = 0
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(user_id, asyncio.Lock())
+
+    async def get(self, user_id: str):
+        """The user's Calendar client, or None if they have no usable credentials (device flow needed)."""
+        async with self._lock(user_id):
+            self._used_at[user_id] = time.monotonic()
+            entry = self._services.get(user_id)
+            if entry is not None:
+                service, creds = entry
+                await self._mark_used(user_id)
+                if creds.valid:
+                    self._services.move_to_end(user_id)
+                    self.hits += 1
+                    return service
+                creds = await self._refresh_and_save(user_id, creds, self.save_credentials)
+                if creds is None:
+                    self._services.pop(user_id, None)
+                    return None
+                self._services.move_to_end(user_id)
+                return service
+            creds = await asyncio.to_thread(self.load_credentials, user_id)
+            if creds is None:
+                return None
+            self._marked_at[user_id] = time.monotonic()  # Loading recorded the use
+            if not creds.valid:
+                creds = await self._refresh_and_save(user_id, creds, self.save_credentials)
+                if creds is None:
+                    return None
+            return await self._add(user_id, creds)
+
+    async def register(self, user_id: str, creds):
+        """Store fresh credentials from a completed device flow and return a client for them."""
+        async with self._lock(user_id):
+            self._used_at[user_id] = time.monotonic()
+            await asyncio.to_thread(self.save_credentials, user_id, creds)
+            return await self._add(user_id, creds)
+
+    async def _mark_used(self, user_id: str):
+        if self.mark_used is None:
+            return
+        now = time.monotonic()
+        if now - self._marked_at.get(user_id, float("-inf")) >= MARK_USED_INTERVAL:
+            self._marked_at[user_id] = now
+            await asyncio.to_thread(self.mark_used, user_id)
+
+    async def _add(self, user_id: str, creds):
+        service = await asyncio.to_thread(self._build, creds)
+        self.builds += 1
+        self._services[user_id] = (service, creds)
+        self._services.move_to_end(user_id)
+        while len(self._services) > self.max_services:
+            evicted, _ = self._services.popitem(last=False)
+            self._forget(evicted)
+        return service
+
+    def _forget(self, user_id: str):
+        self._locks.pop(user_id, None)
+        self._used_at.pop(user_id, None)
+        self._marked_at.pop(user_id, None)
+
+    async def _refresh_and_save(self, user_id: str, creds, save):
+        """Refresh an access token with its refresh token; None if that is not possible."""
+        if not getattr(creds, "refresh_token", None):
+            return None
+        try:
+            creds = await asyncio.to_thread(self._refresh, creds)
+        except Exception as e:
+            print(f"Could not refresh Google token for user {user_id}: {e}")
+            return None
+        await asyncio.to_thread(save, user_id, creds)
+        self.refreshes += 1
+        return creds
+
+    async def refresh_expiring(self):
+        """Background job: refresh tokens that expire within the refresh margin, cached or stored."""
+        started = time.perf_counter()
+        refreshed = 0
+        if self.active_window is not None:
+            idle_since = time.monotonic() - self.active_window
+            for user_id in [u for u in self._services if self._used_at.get(u, idle_since) <= idle_since]:
+                del self._services[user_id]
+                self._forget(user_id)
+        user_ids = list(self._services)
+        if self.list_expiring is not None:
+            stored = await asyncio.to_thread(self.list_expiring, self.refresh_margin)
+            user_ids += [user_id for user_id in stored if user_id not in self._services]
+        for user_id in user_ids:
+            async with self._lock(user_id):
+                entry = self._services.get(user_id)
+                creds = entry[1] if entry is not None else await asyncio.to_thread(self.peek_credentials, user_id)
+                if creds is None or not _expires_within(creds, self.refresh_margin):
+                    continue
+                if await self._refresh_and_save(user_id, creds, self.save_refreshed) is None:
+                    self._services.pop(user_id, None)
+                else:
+                    refreshed += 1
+        if refreshed:
+            print(f"🔑 Refreshed {refreshed} Google tokens in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,118 @@
+"""
+Firestore access for the bot.
+
+This module owns the Firebase app and the Firestore clients. Handlers go
+through `store`, whose methods are coroutines on Firestore's AsyncClient, so
+no Discord handler blocks the event loop on a Firestore round trip.
+Fire-and-forget writes go through the write-behind buffer instead. Reads of
+the small per-user `logs` and `profiles` documents are served from an
+in-process DocumentCache that the store keeps in step with its own writes.
+
+The synchronous `db` client is only for work that already runs off the event
+loop: the write-behind buffer's commit thread and command-line tools such as
+`python streaks.py backfill`.
+
+Set FIRESTORE_EMULATOR_HOST (and optionally FIRESTORE_PROJECT) to run against
+a local Firestore emulator instead of the service account project.
+"""
+import datetime
+import os
+import firebase_admin
+from firebase_admin import credentials, firestore, firestore_async
+from streaks import active_streaks_query, update_streak_on_log, MIN_NOTIFY_STREAK
+from write_behind import WriteBehindBuffer
+from doc_cache import DocumentCache
+
+SERVICE_ACCOUNT_FILE = "serviceAccountKey.json"
+EMULATOR_PROJECT = os.getenv("FIRESTORE_PROJECT", "demo-project5k")
+# Small per-user documents that are read often and only written by this bot
+CACHED_COLLECTIONS = ("logs", "profiles")
+
+
+class FirestoreStore:
+    """Async document reads and writes used by the bot's handlers."""
+
+    def __init__(self, client, write_buffer=None, cache=None, cached_collections=CACHED_COLLECTIONS):
+        self.client = client
+        self.write_buffer = write_buffer
+        self.cache = cache
+        self.cached_collections = set(cached_collections)
+
+    def _doc(self, collection: str, doc_id: str):
+        return self.client.collection(collection).document(str(doc_id))
+
+    def _cached(self, collection: str) -> bool:
+        return self.cache is not None and collection in self.cached_collections
+
+    async def get(self, collection: str, doc_id: str) -> dict | None:
+        """The document's data, or None if it does not exist."""
+        if self._cached(collection):
+            found, data = self.cache.lookup(collection, doc_id)
+            if found:
+                return data
+            self.cache.begin_read(collection, doc_id)
+            try:
+                snapshot = await self._doc(collection, doc_id).get()
+            except BaseException:
+                self.cache.abort_read(collection, doc_id)
+                raise
+            data = snapshot.to_dict() if snapshot.exists else None
+            self.cache.end_read(collection, doc_id, data)
+            return data
+        snapshot = await self._doc(collection, doc_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    async def exists(self, collection: str, doc_id: str) -> bool:
+        # A buffered write means the document exists even if it is not committed yet
+        if self.write_buffer is not None and self.write_buffer.is_pending(collection, doc_id):
+            return True
+        if self._cached(collection):
+            return await self.get(collection, doc_id) is not None
+        snapshot = await self._doc(collection, doc_id).get()
+        return snapshot.exists
+
+    async def set(self, collection: str, doc_id: str, data: dict, merge: bool = False):
+        """Write a document and wait for the commit."""
+        try:
+            await self._doc(collection, doc_id).set(data, merge=merge)
+        except Exception:
+            if self._cached(collection):
+                self.cache.invalidate(collection, doc_id)
+            raise
+        if self._cached(collection):
+            self.cache.note_write(collection, doc_id, data, merge)
+
+    def set_later(self, collection: str, doc_id: str, data: dict, merge: bool = False):
+        """Queue a write on the write-behind buffer without waiting for it."""
+        self.write_buffer.set(collection, doc_id, data, merge=merge)
+        if self._cached(collection):
+            self.cache.note_write(collection, doc_id, data, merge)
+
+    async def query(self, collection: str, field: str, op: str, value) -> list:
+        """List of (doc_id, data) for documents matching one field filter."""
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        query = self.client.collection(collection).where(filter=FieldFilter(field, op, value))
+        return [(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+    async def record_streak(self, uid: str, day: datetime.date) -> dict:
+        return await update_streak_on_log(self.client, uid, day)
+
+    async def active_streaks(self, today: datetime.date, minimum: int = MIN_NOTIFY_STREAK):
+        """List of (uid, record) for users with a live streak of at least `minimum` days."""
+        query = active_streaks_query(self.client, today, minimum)
+        return [(doc.id, doc.to_dict()) async for doc in query.stream()]
+
+
+def _create_clients():
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # The emulator accepts anonymous credentials; the google-cloud clients pick up the host themselves
+        from google.cloud.firestore import Client, AsyncClient
+        return Client(project=EMULATOR_PROJECT), AsyncClient(project=EMULATOR_PROJECT)
+    cred = credentials.Certificate(SERVICE_ACCOUNT_FILE)
+    firebase_admin.initialize_app(cred)
+    return firestore.client(), firestore_async.client()
+
+
+db, async_db = _create_clients()
+write_buffer = WriteBehindBuffer(db)
+store = FirestoreStore(async_db, write_buffer, DocumentCache())
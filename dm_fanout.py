@@ -0,0 +1,155 @@
+"""
+Concurrent, rate-limit-aware bulk DM delivery.
+
+Used for notifications that go to many users at once (e.g. the morning
+streak DMs). A fixed number of worker tasks drain a queue of messages; every
+Discord request first takes a token from the global bucket and from the
+bucket of its route, users are looked up in discord.py's cache and a local
+LRU before falling back to fetch_user, and 429s are retried with backoff.
+"""
+import asyncio
+import random
+import time
+from collections import OrderedDict
+
+import discord
+
+# Discord allows 50 requests/second per bot globally; stay a little below it
+GLOBAL_RATE = 45
+# Per-route budgets: (requests, per seconds)
+ROUTE_LIMITS = {
+    "fetch_user": (30, 1),
+    "create_dm": (10, 1),
+    "send_message": (5, 5),  # Per DM channel
+}
+# Per-channel buckets kept; far more than the concurrency, so buckets of in-flight sends are never evicted
+ROUTE_CACHE_SIZE = 1000
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (e.g. after a 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class DMFanout:
+    """Sends many DMs with bounded concurrency and Discord-friendly pacing."""
+
+    def __init__(self, bot, concurrency=8, max_retries=3, user_cache_size=5000, route_cache_size=ROUTE_CACHE_SIZE):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.user_cache_size = user_cache_size
+        self.route_cache_size = max(route_cache_size, 4 * concurrency)
+        self._users = OrderedDict()  # user_id -> discord.User
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._routes = OrderedDict()  # (route, key) -> TokenBucket, least recently used first
+
+    def _route(self, name: str, key=None) -> TokenBucket:
+        requests, per = ROUTE_LIMITS[name]
+        bucket_key = (name, key)
+        bucket = self._routes.get(bucket_key)
+        if bucket is None:
+            bucket = self._routes[bucket_key] = TokenBucket(requests / per, requests)
+        self._routes.move_to_end(bucket_key)
+        while len(self._routes) > self.route_cache_size:
+            self._routes.popitem(last=False)
+        return bucket
+
+    async def _request(self, route: TokenBucket, call):
+        """Run one Discord request after taking tokens, retrying 429s with backoff."""
+        for attempt in range(self.max_retries + 1):
+            await self._global.acquire()
+            await route.acquire()
+            try:
+                return await call()
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None and getattr(e, "response", None) is not None:
+                    retry_after = float(e.response.headers.get("Retry-After", 0) or 0)
+                delay = max(retry_after or 0, 0.5 * 2 ** attempt) + random.uniform(0, 0.25)
+                route.pause(delay)
+                if getattr(e, "response", None) is not None and e.response.headers.get("X-RateLimit-Global"):
+                    self._global.pause(delay)
+
+    async def _get_user(self, user_id: int):
+        user = self._users.get(user_id) or self.bot.get_user(user_id)
+        if user is None:
+            user = await self._request(self._route("fetch_user"), lambda: self.bot.fetch_user(user_id))
+        self._users[user_id] = user
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.user_cache_size:
+            self._users.popitem(last=False)
+        return user
+
+    async def _send_one(self, user_id: int, content: str) -> str:
+        """Deliver one DM; returns 'sent', 'deferred' or 'failed'."""
+        try:
+            user = await self._get_user(user_id)
+            channel = user.dm_channel
+            if channel is None:
+                channel = await self._request(self._route("create_dm"), user.create_dm)
+            await self._request(self._route("send_message", channel.id), lambda: channel.send(content))
+            return "sent"
+        except discord.HTTPException as e:
+            if e.status == 429:
+                print(f"Deferred DM to user {user_id}: still rate limited after {self.max_retries} retries")
+                return "deferred"
+            print(f"Could not DM user {user_id}: {e}")
+            return "failed"
+        except Exception as e:
+            print(f"Could not DM user {user_id}: {e}")
+            return "failed"
+
+    async def send_all(self, messages) -> dict:
+        """
+        Send (user_id, content) pairs and return a summary:
+        sent, deferred and failed counts, the deferred user ids, elapsed seconds and DMs/second.
+        """
+        queue = asyncio.Queue()
+        for user_id, content in messages:
+            queue.put_nowait((int(user_id), content))
+        report = {"sent": 0, "deferred": 0, "failed": 0, "deferred_users": []}
+        started = time.monotonic()
+
+        async def worker():
+            while True:
+                try:
+                    user_id, content = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                outcome = await self._send_one(user_id, content)
+                report[outcome] += 1
+                if outcome == "deferred":
+                    report["deferred_users"].append(user_id)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        report["elapsed"] = time.monotonic() - started
+        report["throughput"] = report["sent"] / report["elapsed"] if report["elapsed"] > 0 else 0.0
+        return report
@@ -0,0 +1,111 @@
+"""
+In-process read-through cache for small Firestore documents.
+
+Entries are keyed on (collection, doc_id) and hold either the document's data
+or a negative entry meaning "this document does not exist". Positive entries
+expire after a TTL, negative ones after a shorter TTL (another process could
+create the document), and the least-recently-used entries are evicted past the
+size cap. The bot's own writes are applied to cached copies as they happen, so
+it always reads its own writes without a round trip.
+"""
+import copy
+import time
+from collections import OrderedDict
+
+from write_behind import deep_merge
+
+_MISSING = object()
+
+
+class DocumentCache:
+    """Bounded LRU + TTL cache of documents, with negative caching."""
+
+    def __init__(self, max_entries=5000, ttl=300, negative_ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (collection, doc_id) -> (data or _MISSING, expires_at)
+        self._inflight = {}  # (collection, doc_id) -> [reads in flight, written since they started]
+
+    def lookup(self, collection: str, doc_id: str):
+        """Return (found, data): found is False on a miss, data is None for a cached "no document"."""
+        key = (collection, str(doc_id))
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        data, _ = entry
+        if data is _MISSING:
+            self.negative_hits += 1
+            return True, None
+        self.hits += 1
+        return True, copy.deepcopy(data)
+
+    def begin_read(self, collection: str, doc_id: str):
+        """Call before fetching a document, so a write during the fetch keeps the stale result out."""
+        self._inflight.setdefault((collection, str(doc_id)), [0, False])[0] += 1
+
+    def end_read(self, collection: str, doc_id: str, data: dict | None):
+        """Finish a fetch started with begin_read and cache its result unless a write overtook it."""
+        if not self.abort_read(collection, doc_id):
+            self.store(collection, doc_id, data)
+
+    def abort_read(self, collection: str, doc_id: str) -> bool:
+        """Finish a fetch without caching anything; returns True if a write happened during it."""
+        key = (collection, str(doc_id))
+        reads = self._inflight.get(key)
+        if reads is None:
+            return False
+        reads[0] -= 1
+        if reads[0] <= 0:
+            del self._inflight[key]
+        return reads[1]
+
+    def store(self, collection: str, doc_id: str, data: dict | None):
+        """Cache a document read from Firestore (None if it does not exist)."""
+        if data is None:
+            entry = (_MISSING, time.monotonic() + self.negative_ttl)
+        else:
+            entry = (copy.deepcopy(data), time.monotonic() + self.ttl)
+        key = (collection, str(doc_id))
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def note_write(self, collection: str, doc_id: str, data: dict, merge: bool = False):
+        """Apply one of the bot's own writes to the cache (write-through)."""
+        key = (collection, str(doc_id))
+        if key in self._inflight:
+            self._inflight[key][1] = True
+        if not merge:
+            self.store(collection, doc_id, data)
+            return
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is _MISSING or entry[1] < time.monotonic():
+            # The merged result depends on fields we have not seen; read it fresh next time
+            self._entries.pop(key, None)
+            return
+        deep_merge(entry[0], data)
+
+    def invalidate(self, collection: str, doc_id: str):
+        key = (collection, str(doc_id))
+        if key in self._inflight:
+            self._inflight[key][1] = True
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
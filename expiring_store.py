@@ -0,0 +1,154 @@
+"""
+Key-value store for "reply within N minutes" flows, such as /plan -> /confirmplan.
+
+Every entry has an expiry time; a min-heap on expiry lets sweep() drop
+everything that has timed out without scanning the whole store, and get()
+never returns an expired value even between sweeps. A hard cap bounds memory:
+once it is reached, the entries closest to expiring are dropped first.
+
+With a path, entries are also written to a local SQLite file (values as
+JSON), so pending confirmations survive a restart. Several stores can share
+one file under different namespaces.
+
+Every public method takes the store's lock: the periodic sweep runs on a
+scheduler thread while handlers use the store from the event loop.
+"""
+import heapq
+import itertools
+import json
+import threading
+import time
+
+from sqlite_store import open_sqlite
+
+
+class ExpiringStore:
+    """Entries that expire `ttl` seconds after they are put. Keys and values must be JSON-serializable when persisted."""
+
+    def __init__(self, ttl: float, max_entries=10000, path=None, namespace="default", clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._clock = clock
+        self._entries = {}  # key -> (value, expires_at)
+        self._heap = []  # (expires_at, seq, key); stale items are skipped when popped
+        self._seq = itertools.count()
+        self._lock = threading.RLock()  # Reentrant: pop() and __contains__ go through get()
+        self.expired = 0
+        self.evicted = 0
+        self._db = None
+        if path is not None:
+            self._db = open_sqlite(
+                path,
+                "CREATE TABLE IF NOT EXISTS expiring_entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._load()
+
+    def _load(self):
+        now = self._clock()
+        with self._db:
+            self._db.execute("DELETE FROM expiring_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+        rows = self._db.execute(
+            "SELECT key, value, expires_at FROM expiring_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchall()
+        for key, value, expires_at in rows:
+            self._insert(json.loads(key), json.loads(value), expires_at)
+        self._enforce_cap()
+
+    def _insert(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        heapq.heappush(self._heap, (expires_at, next(self._seq), key))
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM expiring_entries WHERE namespace = ? AND key = ?", (self.namespace, json.dumps(key))
+                )
+
+    def _pop_heap(self):
+        """Pop the soonest-expiring live entry's key from the heap, skipping stale items."""
+        while self._heap:
+            expires_at, _, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == expires_at:
+                return key
+        return None
+
+    def _enforce_cap(self):
+        while len(self._entries) > self.max_entries:
+            key = self._pop_heap()
+            if key is None:
+                break
+            self._delete(key)
+            self.evicted += 1
+
+    def put(self, key, value, ttl: float | None = None):
+        """Store a value, replacing any pending one for the key and restarting its timer."""
+        with self._lock:
+            expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+            self._insert(key, value, expires_at)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO expiring_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                        (self.namespace, json.dumps(key), json.dumps(value), expires_at)
+                    )
+            self._enforce_cap()
+            # Replaced entries leave stale heap items behind; rebuild once they dominate
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [(expires_at, next(self._seq), key) for key, (_, expires_at) in self._entries.items()]
+                heapq.heapify(self._heap)
+
+    def get(self, key):
+        """The pending value, or None if there is none or it has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self._clock():
+                self._delete(key)
+                self.expired += 1
+                return None
+            return entry[0]
+
+    def pop(self, key):
+        """Remove and return the pending value (None if missing or expired)."""
+        with self._lock:
+            value = self.get(key)
+            if value is not None:
+                self._delete(key)
+            return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def sweep(self) -> int:
+        """Drop every expired entry. Returns how many were removed; meant to be run periodically."""
+        with self._lock:
+            now = self._clock()
+            removed = 0
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, _, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == expires_at:
+                    self._delete(key)
+                    removed += 1
+            self.expired += removed
+            return removed
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._entries), "expired": self.expired, "evicted": self.evicted}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
@@ -0,0 +1,118 @@
+"""
+Non-blocking Google OAuth device flow.
+
+All requests go through one shared aiohttp session, so connections to
+Google's OAuth endpoints are pooled and kept alive instead of being opened
+per request. Polling the token endpoint runs as a background task per user:
+the handler that started the flow can await it, but the flow keeps going
+(and its token is stored) even if that handler gives up, and a second
+/confirmplan while a flow is pending joins it instead of starting another.
+
+The endpoints can be pointed elsewhere (e.g. a local stub server in tests)
+with GOOGLE_DEVICE_CODE_URL and GOOGLE_TOKEN_URL.
+"""
+import asyncio
+import os
+
+import aiohttp
+
+DEVICE_CODE_URL = os.getenv("GOOGLE_DEVICE_CODE_URL", "https://oauth2.googleapis.com/device/code")
+TOKEN_URL = os.getenv("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+DEVICE_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:device_code"
+
+_session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """The process-wide session for outbound Google HTTP traffic (created on first use, on the running loop)."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=60, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+    return _session
+
+
+async def close_http_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+class DeviceFlowError(Exception):
+    pass
+
+
+class DeviceFlows:
+    """Runs OAuth device flows, at most one per user, with token polling in background tasks."""
+
+    def __init__(self, client_id, client_secret, scopes, device_code_url=None, token_url=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scopes = scopes
+        self.device_code_url = device_code_url or DEVICE_CODE_URL
+        self.token_url = token_url or TOKEN_URL
+        self._flows = {}  # user_id -> background asyncio.Task of the running flow
+
+    def pending(self, user_id: str):
+        """The running flow's task for a user, if any."""
+        task = self._flows.get(user_id)
+        return task if task is not None and not task.done() else None
+
+    async def start(self, user_id: str, notify, on_token) -> asyncio.Task:
+        """
+        Start (or join) a user's device flow. `notify(verification_url, user_code, expires_in)` is awaited
+        once the device code is issued; `on_token(token_response)` runs in the background task when the
+        user has authorized, so the token is stored even if nobody is waiting anymore.
+        Returns the background task, which resolves to on_token's result.
+        """
+        task = self.pending(user_id)
+        if task is not None:
+            return task
+        session = get_http_session()
+        async with session.post(self.device_code_url, data={
+            "client_id": self.client_id,
+            "scope": " ".join(self.scopes)
+        }) as r:
+            resp = await r.json(content_type=None)
+        if "verification_url" not in resp:
+            raise DeviceFlowError(f"Google OAuth device flow error: {resp}")
+        await notify(resp["verification_url"], resp["user_code"], resp["expires_in"])
+        task = asyncio.create_task(
+            self._run(resp["device_code"], resp.get("interval", 5), resp["expires_in"], on_token),
+            name=f"oauth-device-flow-{user_id}"
+        )
+        self._flows[user_id] = task
+        task.add_done_callback(lambda t: self._finished(user_id, t))
+        return task
+
+    def _finished(self, user_id: str, task: asyncio.Task):
+        if self._flows.get(user_id) is task:
+            del self._flows[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Google device flow for user {user_id} failed: {task.exception()}")
+
+    async def _run(self, device_code: str, interval: float, expires_in: float, on_token):
+        return await on_token(await self._poll(device_code, interval, expires_in))
+
+    async def _poll(self, device_code: str, interval: float, expires_in: float) -> dict:
+        session = get_http_session()
+        deadline = asyncio.get_running_loop().time() + expires_in
+        while True:
+            await asyncio.sleep(interval)
+            async with session.post(self.token_url, data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "device_code": device_code,
+                "grant_type": DEVICE_GRANT_TYPE
+            }) as r:
+                token_resp = await r.json(content_type=None)
+            if "access_token" in token_resp:
+                return token_resp
+            error = token_resp.get("error")
+            if error == "slow_down":
+                interval += 5
+            elif error != "authorization_pending":
+                raise DeviceFlowError(f"Google OAuth error: {token_resp}")
+            if asyncio.get_running_loop().time() > deadline:
+                raise DeviceFlowError("Device code expired. Please try again.")
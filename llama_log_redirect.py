@@ -1,17 +1,97 @@
-import sys
+"""
+Capture llama.cpp's native log output without touching Python's streams.
+
+install_llama_logging() registers a llama.cpp log callback that turns each
+complete log line into a logging record and drops it on a queue. A
+QueueListener thread writes the records to a size-rotated file, so the
+callback never blocks on disk I/O and concurrent generations never interfere
+with each other or with sys.stdout/sys.stderr.
+"""
+import atexit
+import ctypes
+import logging
+import logging.handlers
 import os
+import queue
+import threading
 from contextlib import contextmanager
 
+LLAMA_LOG_PATH = "logs/llama.log"
+LLAMA_LOG_MAX_BYTES = 5 * 1024 * 1024
+LLAMA_LOG_BACKUPS = 3
+
+logger = logging.getLogger("llama_cpp.native")
+_install_lock = threading.Lock()
+_listener = None
+_callback = None  # Keep a reference so ctypes does not free the callback
+_partial = threading.local()  # llama.cpp may emit a line in several fragments
+
+
+def _level_map(llama_cpp):
+    levels = {}
+    for name, level in (
+        ("GGML_LOG_LEVEL_DEBUG", logging.DEBUG),
+        ("GGML_LOG_LEVEL_INFO", logging.INFO),
+        ("GGML_LOG_LEVEL_WARN", logging.WARNING),
+        ("GGML_LOG_LEVEL_ERROR", logging.ERROR),
+    ):
+        value = getattr(llama_cpp, name, None)
+        if value is not None:
+            levels[int(value)] = level
+    return levels
+
+
+def _register_native_callback():
+    global _callback
+    try:
+        import llama_cpp
+        levels = _level_map(llama_cpp)
+
+        @llama_cpp.llama_log_callback
+        def on_log(level, text, user_data):
+            buffered = getattr(_partial, "text", "") + text.decode("utf-8", errors="replace")
+            *lines, rest = buffered.split("\n")
+            _partial.text = rest
+            for line in lines:
+                if line.strip():
+                    logger.log(levels.get(level, logging.INFO), line)
+
+        llama_cpp.llama_log_set(on_log, ctypes.c_void_p(0))
+        _callback = on_log
+    except (ImportError, AttributeError) as e:
+        print(f"[LLM] llama.cpp log callback unavailable, native logs will not be captured: {e}")
+
+
+def install_llama_logging(logfile_path=LLAMA_LOG_PATH, max_bytes=LLAMA_LOG_MAX_BYTES, backup_count=LLAMA_LOG_BACKUPS):
+    """
+    Route llama.cpp's native logs to a rotating file via a background writer thread.
+    Safe to call repeatedly; only the first call configures the file.
+    """
+    global _listener
+    with _install_lock:
+        if _listener is None:
+            if os.path.dirname(logfile_path):
+                os.makedirs(os.path.dirname(logfile_path), exist_ok=True)
+            log_queue = queue.SimpleQueue()
+            handler = logging.handlers.RotatingFileHandler(
+                logfile_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+            _listener = logging.handlers.QueueListener(log_queue, handler)
+            _listener.start()
+            atexit.register(_listener.stop)
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+        if _callback is None:
+            _register_native_callback()
+
+
 @contextmanager
-def llama_log_redirect(logfile_path):
-    os.makedirs(os.path.dirname(logfile_path), exist_ok=True)
-    orig_stdout = sys.stdout
-    orig_stderr = sys.stderr
-    with open(logfile_path, "a") as f:
-        sys.stdout = f
-        sys.stderr = f
-        try:
-            yield
-        finally:
-            sys.stdout = orig_stdout
-            sys.stderr = orig_stderr
+def llama_log_redirect(logfile_path=LLAMA_LOG_PATH):
+    """
+    Backwards-compatible wrapper: makes sure llama.cpp logging is installed.
+    It no longer swaps sys.stdout/sys.stderr, so it is safe around concurrent calls.
+    """
+    install_llama_logging(logfile_path)
+    yield
@@ -0,0 +1,278 @@
+"""
+Priority-aware scheduler for local LLM inference.
+
+llama.cpp models are not thread-safe, so a single worker thread owns the model
+and runs every generation. Requests wait in a bounded priority queue: lower
+priority values are served first and requests within a class are served in
+FIFO order. Each request records how long it waited and how long it ran.
+
+In worker-pool mode there is one owner thread per model process, all pulling
+from the same queue. Owners can be replaced while the scheduler runs: the old
+owner threads finish their current job and exit, and the new ones take over.
+"""
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+# Priority classes (lower value is served first)
+PRIORITY_INTERACTIVE = 0  # /log motivations and onboarding questions
+PRIORITY_ASK = 1          # /ask answers
+PRIORITY_PLAN = 2         # /plan generation
+PRIORITY_BACKGROUND = 3   # idle-time jobs
+
+# Maximum number of waiting requests per priority class
+DEFAULT_QUEUE_LIMITS = {
+    PRIORITY_INTERACTIVE: 32,
+    PRIORITY_ASK: 16,
+    PRIORITY_PLAN: 8,
+    PRIORITY_BACKGROUND: 4,
+}
+
+
+class LLMQueueFull(Exception):
+    """Raised when a priority class has no room for another request."""
+
+
+class LLMJob:
+    """A single unit of work for the model owner thread."""
+
+    def __init__(self, fn, priority, label):
+        self.fn = fn
+        self.priority = priority
+        self.label = label
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def queue_wait(self):
+        """Seconds spent waiting in the queue."""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.enqueued_at
+
+    @property
+    def service_time(self):
+        """Seconds spent running on the model."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class LLMScheduler:
+    """
+    Runs LLM jobs one at a time on a dedicated thread that owns the model.
+    Jobs are callables that receive the model and return a result.
+    """
+
+    def __init__(self, get_model, queue_limits=None, history=200):
+        self._model_getters = [get_model]
+        self.queue_limits = dict(DEFAULT_QUEUE_LIMITS)
+        if queue_limits:
+            self.queue_limits.update(queue_limits)
+        self._heap = []
+        self._pending = {p: 0 for p in self.queue_limits}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._generation = 0  # Bumped when the owners are replaced; older owner threads exit
+        self._running = 0
+        self._closed = False
+        self.stats = deque(maxlen=history)  # Per-request stats, newest last
+
+    def submit(self, fn, priority=PRIORITY_ASK, label="llm"):
+        """Queue a job and return a concurrent.futures.Future for its result."""
+        job = LLMJob(fn, priority, label)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LLM scheduler is shut down.")
+            limit = self.queue_limits.get(priority, DEFAULT_QUEUE_LIMITS[PRIORITY_BACKGROUND])
+            if self._pending.get(priority, 0) >= limit:
+                raise LLMQueueFull(f"LLM queue is full for priority {priority} ({limit} waiting).")
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._pending[priority] = self._pending.get(priority, 0) + 1
+            if not self._threads:
+                self._start_owners()
+            self._cond.notify()
+        return job.future
+
+    def _start_owners(self):
+        """Start one owner thread per model getter. Called with the lock held."""
+        for i, get_model in enumerate(self._model_getters):
+            thread = threading.Thread(
+                target=self._worker, args=(get_model, self._generation),
+                name=f"llm-owner-{self._generation}-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def set_model_owners(self, getters):
+        """
+        Serve the queue with one owner thread per model getter (e.g. one per worker process).
+        If jobs were already submitted, the current owners finish their running job and stop,
+        and owners for the new getters take over the queue.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LLM scheduler is shut down.")
+            self._model_getters = list(getters)
+            if self._threads:
+                self._generation += 1
+                self._start_owners()
+                self._cond.notify_all()  # Idle old owners wake up and exit
+
+    async def run(self, fn, priority=PRIORITY_ASK, label="llm"):
+        """Queue a job and await its result from the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, priority, label))
+
+    async def stream(self, fn, priority=PRIORITY_ASK, label="llm"):
+        """
+        Queue a streaming job and yield its chunks on the event loop as the model produces them.
+        fn(model) must return an iterator; generation stops early if the consumer stops iterating.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def stream_job(model):
+            try:
+                for chunk in fn(model):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+        future = self.submit(stream_job, priority, label)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is done:
+                    break
+                yield chunk
+            # Re-raise any error from the model thread
+            await asyncio.wrap_future(future)
+        finally:
+            stopped.set()
+            future.cancel()
+
+    def run_sync(self, fn, priority=PRIORITY_ASK, label="llm"):
+        """Queue a job and block the calling thread until it finishes."""
+        return self.submit(fn, priority, label).result()
+
+    def pending(self):
+        """Number of jobs waiting to run."""
+        with self._cond:
+            return len(self._heap)
+
+    def is_idle(self):
+        """True when nothing is running or waiting."""
+        with self._cond:
+            return not self._heap and not self._running
+
+    def summary(self):
+        """Aggregate queue-wait and service-time stats per label."""
+        totals = {}
+        for entry in list(self.stats):
+            agg = totals.setdefault(entry["label"], {"count": 0, "queue_wait": 0.0, "service_time": 0.0})
+            agg["count"] += 1
+            agg["queue_wait"] += entry["queue_wait"]
+            agg["service_time"] += entry["service_time"]
+        for agg in totals.values():
+            agg["avg_queue_wait"] = agg.pop("queue_wait") / agg["count"]
+            agg["avg_service_time"] = agg.pop("service_time") / agg["count"]
+        return totals
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs and let the worker drain the queue."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _next_job(self, generation):
+        with self._cond:
+            while True:
+                if generation != self._generation:
+                    return None  # Replaced by set_model_owners
+                if self._heap:
+                    break
+                if self._closed:
+                    return None
+                self._cond.wait()
+            _, _, job = heapq.heappop(self._heap)
+            self._pending[job.priority] -= 1
+            self._running += 1
+            return job
+
+    def _worker(self, get_model, generation):
+        while True:
+            job = self._next_job(generation)
+            if job is None:
+                return
+            try:
+                # Skip jobs whose caller has already given up
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                job.started_at = time.monotonic()
+                result, error = None, None
+                try:
+                    model = get_model()
+                    if model is None:
+                        raise RuntimeError("LLM model failed to load.")
+                    result = job.fn(model)
+                except BaseException as e:
+                    error = e
+                job.finished_at = time.monotonic()
+                self._record(job)
+            finally:
+                with self._cond:
+                    self._running -= 1
+            # Resolve only after the stats are recorded and the worker is free
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def _record(self, job):
+        entry = {
+            "label": job.label,
+            "priority": job.priority,
+            "queue_wait": job.queue_wait,
+            "service_time": job.service_time,
+        }
+        self.stats.append(entry)
+        print(f"[LLM] {job.label}: waited {job.queue_wait:.2f}s, served in {job.service_time:.2f}s "
+              f"({self.pending()} queued)")
+
+
+async def fill_while_idle(is_idle, keys, size, target, generate, add, label):
+    """
+    Background top-up shared by the precomputed pools (motivations, plans).
+    While is_idle() is true, generate(key, PRIORITY_BACKGROUND) one item for the key with the
+    smallest size(key) and store it with add(key, item), until every key holds `target` items.
+    """
+    # Bound the work per run in case the model keeps producing items add() rejects
+    for _ in range(target * len(keys) * 2):
+        if not is_idle():
+            return
+        key = min(keys, key=size)
+        if size(key) >= target:
+            return
+        try:
+            item = await generate(key, PRIORITY_BACKGROUND)
+        except LLMQueueFull:
+            return
+        except Exception as e:
+            print(f"[LLM ERROR] {label} failed for {key}: {e}")
+            return
+        add(key, item)
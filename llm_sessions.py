@@ -0,0 +1,135 @@
+"""
+Saved llama states for multi-round conversations (LLM onboarding).
+
+Each onboarding round sends the previous round's prompt plus one new Q/A pair.
+After a round, the model's state (its KV cache) is saved under the session
+id; before the next round it is loaded back, and llama-cpp-python then only
+evaluates the tokens after the longest shared prefix, i.e. the new Q/A pair.
+
+States are large (the KV cache for every token so far), so only a few recent
+sessions are kept in memory. Idle sessions are evicted to files on disk and
+loaded back when the user answers; files older than max_age are deleted, and
+the oldest files go first whenever the directory exceeds max_disk_bytes.
+"""
+import glob
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+MAX_DISK_BYTES = 512 * 1024 * 1024  # Budget for evicted session states on disk
+
+
+def shared_prefix_length(a, b) -> int:
+    """Number of leading tokens two token sequences have in common."""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class SessionStateCache:
+    """LRU of (tokens, llama state) per session id, spilling to disk. Used from one model owner thread."""
+
+    def __init__(self, max_in_memory=4, directory="cache/llm_sessions", max_age=3600, max_disk_bytes=MAX_DISK_BYTES):
+        self.max_in_memory = max_in_memory
+        self.directory = directory
+        self.max_age = max_age
+        self.max_disk_bytes = max_disk_bytes
+        self._states = OrderedDict()  # session_id -> (tokens, state)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pruned = 0
+        self.reused_tokens = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id) -> str:
+        name = hashlib.sha1(str(session_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.state")
+
+    def get(self, session_id):
+        """(tokens, state) saved for the session, from memory or disk, or None."""
+        entry = self._states.get(session_id)
+        if entry is not None:
+            self._states.move_to_end(session_id)
+            self.memory_hits += 1
+            return entry
+        path = self._path(session_id)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            os.remove(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"[LLM] Discarding unreadable session state {path}: {e}")
+            self._remove_file(path)
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._keep(session_id, entry)
+        return entry
+
+    def put(self, session_id, tokens, state):
+        self._keep(session_id, (list(tokens), state))
+        self._prune_disk()
+
+    def drop(self, session_id):
+        """Forget a finished session."""
+        self._states.pop(session_id, None)
+        self._remove_file(self._path(session_id))
+
+    def _keep(self, session_id, entry):
+        self._states[session_id] = entry
+        self._states.move_to_end(session_id)
+        while len(self._states) > self.max_in_memory:
+            evicted, evicted_entry = self._states.popitem(last=False)
+            try:
+                with open(self._path(evicted), "wb") as f:
+                    pickle.dump(evicted_entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                print(f"[LLM] Could not write session state for {evicted} to disk: {e}")
+            self.evictions += 1
+
+    def _prune_disk(self):
+        """Delete files older than max_age, then the oldest ones until the rest fit in max_disk_bytes."""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*.state")):
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+        files.sort()
+        cutoff = time.time() - self.max_age
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if mtime >= cutoff and total <= self.max_disk_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+            self.pruned += 1
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        return {
+            "in_memory": len(self._states),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "pruned": self.pruned,
+            "reused_tokens": self.reused_tokens,
+        }
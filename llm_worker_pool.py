@@ -0,0 +1,206 @@
+"""
+Opt-in multi-process worker pool for LLM inference.
+
+Each worker process opens the same GGUF file with mmap (and without mlock),
+so the weights live once in the OS page cache and are shared read-only by all
+workers; only the small per-worker KV cache is private. Every worker is
+pinned to its own slice of cores and runs llama.cpp with that many threads,
+instead of every instance claiming cpu_count() threads.
+
+The bot's LLMScheduler gets one owner thread per worker, and each owner
+drives its worker through a RemoteModel proxy, so jobs written against a
+local Llama work unchanged.
+
+Workers start with this module as their main module: a spawned child would
+otherwise re-run the bot's script, importing discord, Firebase and the Google
+clients and opening the SQLite caches in every worker.
+"""
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+import traceback
+
+
+def available_cores():
+    """CPU ids this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_slices(n_workers, cores=None):
+    """Split the available cores into n_workers contiguous, non-overlapping slices."""
+    cores = list(cores if cores is not None else available_cores())
+    n_workers = max(1, min(n_workers, len(cores)))
+    size, extra = divmod(len(cores), n_workers)
+    slices = []
+    start = 0
+    for i in range(n_workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+@contextlib.contextmanager
+def _spawn_from_this_module():
+    """
+    A spawned child re-imports the parent's __main__ (as __mp_main__) before it runs the target.
+    While workers start, __main__ is swapped for this module, which only imports the standard library.
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def _worker_main(conn, model_path, model_kwargs, cores, prefixes, log_path):
+    """Entry point of a worker process: load the model, then serve requests from the pipe."""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        from llama_cpp import Llama
+        from llama_log_redirect import install_llama_logging
+        install_llama_logging(log_path)
+        from prefix_cache import PrefixStateCache, PrefixCachedModel
+        from llm_sessions import SessionStateCache
+        llm = Llama(
+            model_path=model_path,
+            n_threads=len(cores),
+            use_mmap=True,   # Share the weights through the page cache
+            use_mlock=False,  # Locking would pin a copy of the mapping per process
+            **model_kwargs
+        )
+        prefix_cache = PrefixStateCache(prefixes or [])
+        prefix_cache.warm(llm)
+        # Session states spill to a directory shared by all workers, so an evicted
+        # session can resume on whichever worker serves its next round
+        model = PrefixCachedModel(llm, prefix_cache, sessions=SessionStateCache())
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            return
+        if request == "stop":
+            # Late stop for a stream that had already finished
+            continue
+        prompt, kwargs = request
+        try:
+            if isinstance(kwargs.get("grammar"), str):
+                # Grammars cross the pipe as GBNF text; each worker compiles (and caches) its own
+                from plan_grammar import compile_grammar
+                kwargs["grammar"] = compile_grammar(kwargs["grammar"])
+            if kwargs.get("stream"):
+                for chunk in model(prompt, **kwargs):
+                    # The front end may ask us to stop early between chunks
+                    if conn.poll() and conn.recv() == "stop":
+                        break
+                    conn.send(("chunk", chunk))
+                conn.send(("done", None))
+            else:
+                conn.send(("done", model(prompt, **kwargs)))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+
+
+class RemoteModel:
+    """
+    Front-end proxy for one worker process with the same call signature as Llama.
+    Only one thread (its scheduler owner thread) may use a RemoteModel at a time.
+    """
+
+    compiles_grammar = True  # grammar= is sent as GBNF text and compiled in the worker
+
+    def __init__(self, conn, process):
+        self._conn = conn
+        self.process = process
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def wait_ready(self):
+        """Block until the worker has loaded its model; raises if it failed to start."""
+        with self._ready_lock:
+            if self._ready:
+                return
+            status, detail = self._conn.recv()
+            if status != "ready":
+                raise RuntimeError(f"LLM worker failed to start:\n{detail}")
+            self._ready = True
+
+    def __call__(self, prompt, **kwargs):
+        self.wait_ready()
+        self._conn.send((prompt, kwargs))
+        if kwargs.get("stream"):
+            return self._stream()
+        status, payload = self._conn.recv()
+        if status == "error":
+            raise RuntimeError(f"LLM worker error:\n{payload}")
+        return payload
+
+    def _stream(self):
+        finished = False
+        try:
+            while True:
+                status, payload = self._conn.recv()
+                if status == "chunk":
+                    yield payload
+                    continue
+                finished = True
+                if status == "error":
+                    raise RuntimeError(f"LLM worker error:\n{payload}")
+                return
+        finally:
+            if not finished:
+                # Consumer stopped early: tell the worker, then drain until it acknowledges
+                self._conn.send("stop")
+                while True:
+                    status, _ = self._conn.recv()
+                    if status != "chunk":
+                        break
+
+
+class LLMWorkerPool:
+    """Starts N model worker processes and hands out one RemoteModel per worker."""
+
+    def __init__(self, model_path, n_workers, model_kwargs=None, prefixes=None):
+        ctx = multiprocessing.get_context("spawn")
+        self.models = []
+        for i, cores in enumerate(core_slices(n_workers)):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker_main,
+                args=(child_conn, model_path, model_kwargs or {}, cores, list(prefixes or []), f"logs/llama_worker{i}.log"),
+                name=f"llm-worker-{i}",
+                daemon=True
+            )
+            with _spawn_from_this_module():
+                process.start()
+            child_conn.close()
+            self.models.append(RemoteModel(parent_conn, process))
+            print(f"[LLM] Started worker {i} (pid {process.pid}) on cores {cores}")
+
+    def wait_ready(self):
+        """Block until every worker has loaded its model."""
+        for model in self.models:
+            model.wait_ready()
+
+    def model_getters(self):
+        """One getter per worker, for LLMScheduler.set_model_owners."""
+        return [lambda model=model: model for model in self.models]
+
+    def close(self):
+        for model in self.models:
+            try:
+                model._conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for model in self.models:
+            model.process.join(timeout=5)
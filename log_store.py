@@ -0,0 +1,133 @@
+"""
+Month-sharded workout log storage.
+
+Layout:
+    logs/{uid}                  {"meta": {"format": "monthly", "last_date": "YYYY-MM-DD"}}
+    logs/{uid}/months/{YYYY-MM} {"days": {"01": minutes, ..., "31": minutes}}
+
+Each shard holds at most 31 small fields, so documents stay tiny no matter
+how long someone has been logging, and a range read only fetches the months
+it covers. Logging a day is a blind merge into its shard (no read first), so
+it can go through the write-behind buffer. The parent document stays small
+and still marks the user as known to the bot.
+
+Run `python log_store.py migrate` once to move the old one-field-per-day
+documents into shards.
+"""
+import asyncio
+import datetime
+import sys
+
+LOGS_COLLECTION = "logs"
+SHARDS_SUBCOLLECTION = "months"
+LOG_FORMAT = "monthly"
+
+
+def shard_id(day: datetime.date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def shards_collection(uid: str) -> str:
+    return f"{LOGS_COLLECTION}/{uid}/{SHARDS_SUBCOLLECTION}"
+
+
+def shard_ids_between(start: datetime.date, end: datetime.date):
+    """Month shard ids covering start..end (inclusive), oldest first."""
+    ids = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        ids.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return ids
+
+
+def shard_entries(shard: str, data: dict):
+    """Yield (date, minutes) for every day stored in a shard document."""
+    year, month = (int(part) for part in shard.split("-"))
+    for day, minutes in (data or {}).get("days", {}).items():
+        yield datetime.date(year, month, int(day)), minutes
+
+
+def legacy_log_dates(data: dict):
+    """ISO-date keys of an old-format logs document, ignoring any non-date fields."""
+    dates = []
+    for key in data:
+        try:
+            datetime.date.fromisoformat(key)
+        except ValueError:
+            continue
+        dates.append(key)
+    return dates
+
+
+def log_workout(store, uid: str, day: datetime.date, minutes: int):
+    """Record `minutes` for `day` (replacing an earlier value for that day) via the write-behind buffer."""
+    store.set_later(shards_collection(uid), shard_id(day), {"days": {f"{day.day:02d}": minutes}}, merge=True)
+    store.set_later(LOGS_COLLECTION, uid, {"meta": {"format": LOG_FORMAT, "last_date": day.isoformat()}}, merge=True)
+
+
+async def read_range(store, uid: str, start: datetime.date, end: datetime.date) -> dict:
+    """{date: minutes} for start..end (inclusive), reading only the month shards in that range."""
+    shards = shard_ids_between(start, end)
+    documents = await asyncio.gather(*(store.get(shards_collection(uid), shard) for shard in shards))
+    logs = {}
+    for shard, data in zip(shards, documents):
+        for day, minutes in shard_entries(shard, data):
+            if start <= day <= end:
+                logs[day] = minutes
+    return dict(sorted(logs.items()))
+
+
+async def last_n_days(store, uid: str, n: int, today: datetime.date | None = None) -> dict:
+    """{date: minutes} for the last `n` days up to and including today."""
+    today = today or datetime.date.today()
+    return await read_range(store, uid, today - datetime.timedelta(days=n - 1), today)
+
+
+def iter_user_log_dates(db):
+    """Yield (uid, [ISO dates]) for every user, read from the month shards (sync client, for CLI tools)."""
+    dates = {}
+    for doc in db.collection_group(SHARDS_SUBCOLLECTION).stream():
+        uid = doc.reference.parent.parent.id
+        dates.setdefault(uid, []).extend(day.isoformat() for day, _ in shard_entries(doc.id, doc.to_dict()))
+    yield from dates.items()
+
+
+def migrate_logs(db, batch_size: int = 500) -> int:
+    """Move old one-field-per-day logs documents into month shards. Returns the number of users migrated."""
+    batch = db.batch()
+    pending = 0
+    migrated = 0
+    for doc in db.collection(LOGS_COLLECTION).stream():
+        data = doc.to_dict() or {}
+        dates = legacy_log_dates(data)
+        if not dates:
+            continue
+        shards = {}
+        for iso in dates:
+            day = datetime.date.fromisoformat(iso)
+            shards.setdefault(shard_id(day), {})[f"{day.day:02d}"] = data[iso]
+        # A user's shards and parent rewrite go in the same batch, so a user is never half-migrated
+        if pending and pending + len(shards) + 1 > batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+        for shard, days in shards.items():
+            batch.set(doc.reference.collection(SHARDS_SUBCOLLECTION).document(shard), {"days": days}, merge=True)
+        # Rewrite the parent without the per-day fields, keeping the newest date seen in either format
+        last_date = max(dates + [data.get("meta", {}).get("last_date", "")])
+        batch.set(doc.reference, {"meta": {"format": LOG_FORMAT, "last_date": last_date}})
+        pending += len(shards) + 1
+        migrated += 1
+    if pending:
+        batch.commit()
+    return migrated
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("Usage: python log_store.py migrate")
+        sys.exit(1)
+    from data_access import db
+    count = migrate_logs(db)
+    print(f"✅ Migrated workout logs for {count} users to month shards")
@@ -0,0 +1,83 @@
+"""
+Pre-generated pool of motivational messages for /log.
+
+Messages are grouped into duration buckets (e.g. the COMMON_MINUTES values) so a
+logged workout can be answered instantly with a message written for a similar
+duration. A background job refills the buckets while the LLM is idle, served
+messages are evicted from the pool, and recently seen messages are never stored
+again so users don't get the same text twice in a row.
+"""
+from collections import deque
+
+from llm_scheduler import PRIORITY_INTERACTIVE, fill_while_idle
+
+# Used only when the pool is empty and live generation fails too
+FALLBACK_MOTIVATION = "💪 Awesome work today — every minute counts. Keep showing up!"
+
+
+class MotivationPool:
+    """
+    Per-duration-bucket pool of motivational messages.
+    generate(minutes, priority) is an async function returning a new message.
+    """
+
+    def __init__(self, buckets, generate, per_bucket=3, recent_limit=100):
+        self.buckets = sorted(buckets)
+        self.per_bucket = per_bucket
+        self._generate = generate
+        self._pool = {bucket: deque() for bucket in self.buckets}
+        # Recently served or stored messages, used to reject repeats
+        self._recent = deque(maxlen=recent_limit)
+        self.hits = 0
+        self.misses = 0
+
+    def bucket_for(self, minutes: int) -> int:
+        """Closest bucket to the logged duration."""
+        return min(self.buckets, key=lambda bucket: (abs(bucket - minutes), bucket))
+
+    def size(self) -> int:
+        return sum(len(messages) for messages in self._pool.values())
+
+    def take(self, minutes: int):
+        """Remove and return a pooled message for this duration, or None if the bucket is empty."""
+        messages = self._pool[self.bucket_for(minutes)]
+        if not messages:
+            return None
+        return messages.popleft()
+
+    def add(self, bucket: int, message: str) -> bool:
+        """Store a message unless it is empty or a recent repeat."""
+        message = message.strip()
+        if not message or message in self._recent:
+            return False
+        self._pool[bucket].append(message)
+        self._recent.append(message)
+        return True
+
+    async def get(self, minutes: int) -> str:
+        """
+        Serve a pooled message immediately, falling back to live generation
+        on the LLM scheduler only when the bucket is empty.
+        """
+        message = self.take(minutes)
+        if message is not None:
+            self.hits += 1
+            return message
+        self.misses += 1
+        try:
+            message = await self._generate(minutes, PRIORITY_INTERACTIVE)
+        except Exception as e:
+            print(f"[LLM ERROR] Could not generate motivation for {minutes} minutes: {e}")
+            return FALLBACK_MOTIVATION
+        self._recent.append(message)
+        return message
+
+    async def refill(self, is_idle):
+        """
+        Top up the emptiest buckets one message at a time while is_idle() is true.
+        Meant to be run periodically from the scheduler.
+        """
+        await fill_while_idle(
+            is_idle, self.buckets, lambda bucket: len(self._pool[bucket]), self.per_bucket,
+            self._generate, self.add, "Motivation pool refill"
+        )
@@ -0,0 +1,255 @@
+"""
+Resumable, concurrency-bounded LLM onboarding.
+
+The old onboarding ran as one coroutine per member that blocked on a
+120-second wait for every answer, so a wave of joins left hundreds of
+coroutines stalled on DMs and competing for the model. Here onboarding is a
+small state machine per user instead:
+
+    consent -> queued -> active -> awaiting_answer -> queued -> ... -> done
+
+Only "active" sessions are doing LLM work (choosing the next question or
+drafting the plan). At most max_active run at once; the rest wait in a FIFO
+queue. A session waiting for the user's reply holds no coroutine at all: the
+bot's on_message hands the reply to handle_reply(), which queues the next
+step. The state (status, transcript, open question) is written to Firestore
+after every transition, so a late reply or a restart picks up where the
+session stopped; resume_pending() re-queues sessions that were mid-step.
+
+handle_reply() sees every DM the bot gets, so only open sessions are kept in
+memory, and users found to have no open session are remembered for
+NO_SESSION_TTL seconds instead of being looked up in Firestore on every DM.
+"""
+import asyncio
+import datetime
+import time
+from collections import deque
+
+ONBOARDING_COLLECTION = "onboarding"
+MAX_ROUNDS = 10  # Safety: the plan is drafted after this many answers even if the LLM wants more
+NO_SESSION_TTL = 10 * 60  # Seconds a "no open session" lookup is trusted before Firestore is read again
+CONSENT_ANSWERS = ("yes", "sure", "ok", "okay", "y")
+CONSENT_QUESTION = (
+    "Hey 👋 — great to meet you! I’m your AI accountability partner. "
+    "Before we dive in, is it okay if I ask a few quick questions about your health, workout history, "
+    "and goals (will take 2 mins) so I can build a safe, personalized plan?"
+)
+# Statuses of sessions that are still in progress; anything else is finished
+OPEN_STATUSES = ("consent", "queued", "active", "awaiting_answer", "failed")
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def transcript(history, folded: int = 0) -> str:
+    """
+    The conversation as prompt text. Appending a Q/A pair only ever extends it.
+    The `folded` oldest turns are condensed into one summary line, to fit long
+    conversations into the context (see PromptBudget.fit).
+    """
+    text = ""
+    if folded:
+        summary = "; ".join(f"{_shorten(turn['q'], 40)} -> {_shorten(turn['a'], 80)}" for turn in history[:folded])
+        text = f"Summary of earlier answers: {summary}\n"
+    return text + "".join(
+        f"Q{i}: {turn['q']}\nA{i}: {turn['a']}\n" for i, turn in enumerate(history[folded:], start=folded + 1)
+    )
+
+
+class OnboardingManager:
+    """
+    Runs onboarding sessions with an admission limit on concurrent LLM steps.
+    send(user_id, text), ask_next(user_id, history) -> question or "DONE" and
+    draft_plan(user_id, history) are coroutines supplied by the bot.
+    """
+
+    def __init__(self, store, send, ask_next, draft_plan, max_active=2, max_rounds=MAX_ROUNDS,
+                 collection=ONBOARDING_COLLECTION, no_session_ttl=NO_SESSION_TTL):
+        self.store = store
+        self._send = send
+        self._ask_next = ask_next
+        self._draft_plan = draft_plan
+        self.max_active = max_active
+        self.max_rounds = max_rounds
+        self.collection = collection
+        self.no_session_ttl = no_session_ttl
+        self._states = {}  # user_id -> state dict, for open sessions this process has touched
+        self._no_session = {}  # user_id -> monotonic time until which they are known to have no open session
+        self._queue = deque()  # (user_id, enqueued_at)
+        self._queued = set()
+        self._active = set()
+        self._tasks = set()
+        self.completed = 0
+        self.declined = 0
+        self.failed = 0
+        self.queue_waits = deque(maxlen=200)
+
+    async def _load(self, user_id: str):
+        """The user's open session state, or None if they have none (finished sessions count as none)."""
+        state = self._states.get(user_id)
+        if state is not None:
+            return state
+        if self._no_session.get(user_id, 0) > time.monotonic():
+            return None
+        state = await self.store.get(self.collection, user_id)
+        if state is None or state.get("status") not in OPEN_STATUSES:
+            self._no_session[user_id] = time.monotonic() + self.no_session_ttl
+            return None
+        self._states[user_id] = state
+        return state
+
+    def _save(self, user_id: str, state: dict, status: str):
+        state["status"] = status
+        state["updated_at"] = datetime.datetime.utcnow().isoformat()
+        if status in OPEN_STATUSES:
+            self._states[user_id] = state
+            self._no_session.pop(user_id, None)
+        else:
+            # Persisted below; finished sessions aren't kept in memory
+            self._states.pop(user_id, None)
+            self._no_session[user_id] = time.monotonic() + self.no_session_ttl
+        self.store.set_later(self.collection, user_id, dict(state))
+
+    async def begin(self, user_id: str, consented: bool = False):
+        """
+        Start onboarding for a user, or resume their unfinished session.
+        With consented=True (the user asked for it) the consent question is skipped.
+        """
+        user_id = str(user_id)
+        state = await self._load(user_id)
+        if state is None:
+            state = {"history": [], "question": None}
+            if not consented:
+                self._save(user_id, state, "consent")
+                await self._send(user_id, CONSENT_QUESTION)
+                return
+        status = state.get("status")
+        if user_id in self._queued or user_id in self._active:
+            return  # Already on its way to the next question
+        if status == "awaiting_answer":
+            await self._send(user_id, f"Let's pick up where we left off:\n{state['question']}")
+        elif status == "consent" and not consented:
+            await self._send(user_id, CONSENT_QUESTION)
+        else:
+            self._save(user_id, state, "queued")
+            self._enqueue(user_id)
+
+    async def handle_reply(self, user_id: str, text: str) -> bool:
+        """Feed a DM from the user into their session. Returns False if they have none waiting for a reply."""
+        user_id = str(user_id)
+        state = await self._load(user_id)
+        if state is None or state.get("status") not in ("consent", "awaiting_answer"):
+            return False
+        if state["status"] == "consent":
+            if text.strip().lower() not in CONSENT_ANSWERS:
+                self.declined += 1
+                self._save(user_id, state, "declined")
+                return True
+            self._save(user_id, state, "queued")
+            self._enqueue(user_id)
+            return True
+        question = state["question"]
+        state["history"].append({"q": question, "a": text})
+        state["question"] = None
+        # Answers are part of the user's profile too
+        self.store.set_later("profiles", user_id, {question: text}, merge=True)
+        self._save(user_id, state, "queued")
+        await self._send(user_id, f"Got it! Your answer: '{text}'\n\nNext question...")
+        self._enqueue(user_id)
+        return True
+
+    async def resume_pending(self) -> int:
+        """After a restart: re-queue sessions that were waiting for (or in the middle of) an LLM step."""
+        pending = await self.store.query(self.collection, "status", "in", ["queued", "active"])
+        for user_id, state in pending:
+            self._states[user_id] = state
+            self._enqueue(user_id)
+        return len(pending)
+
+    def _enqueue(self, user_id: str):
+        if user_id in self._queued or user_id in self._active:
+            return
+        self._queued.add(user_id)
+        self._queue.append((user_id, time.monotonic()))
+        self._pump()
+
+    def _pump(self):
+        """Start queued steps while there is room under the admission limit."""
+        while self._queue and len(self._active) < self.max_active:
+            user_id, enqueued_at = self._queue.popleft()
+            self._queued.discard(user_id)
+            self.queue_waits.append(time.monotonic() - enqueued_at)
+            self._active.add(user_id)
+            task = asyncio.create_task(self._step(user_id), name=f"onboarding-{user_id}")
+            self._tasks.add(task)
+            task.add_done_callback(lambda t, user_id=user_id: self._step_done(user_id, t))
+
+    def _step_done(self, user_id: str, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._active.discard(user_id)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[LLM ERROR] Onboarding step for user {user_id} failed: {task.exception()}")
+        self._pump()
+
+    async def _step(self, user_id: str):
+        """One LLM step: ask the next question, or draft the plan once the LLM has enough."""
+        state = await self._load(user_id)
+        if state is None:
+            return
+        self._save(user_id, state, "active")
+        history = state["history"]
+        drafting = False
+        try:
+            if len(history) >= self.max_rounds:
+                next_question = "DONE"
+            else:
+                next_question = (await self._ask_next(user_id, history)).strip()
+            if next_question.upper() == "DONE":
+                drafting = True
+                await self._draft_plan(user_id, history)
+                self.completed += 1
+                self._save(user_id, state, "done")
+                return
+        except Exception:
+            self.failed += 1
+            # /introduceyourself resumes a failed session from its last answer
+            self._save(user_id, state, "failed")
+            problem = "drafting your workout plan" if drafting else "generating the next question"
+            await self._send(user_id, f"[LLM ERROR] Sorry, there was a problem {problem}. "
+                                      "Use /introduceyourself to continue where we left off.")
+            raise
+        state["question"] = next_question
+        self._save(user_id, state, "awaiting_answer")
+        await self._send(user_id, next_question)
+
+    def prune(self, max_idle: float = 3600) -> int:
+        """
+        Drop idle sessions waiting for a reply from memory (their state stays in Firestore)
+        and expired "no open session" entries. Returns how many sessions were dropped.
+        """
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=max_idle)).isoformat()
+        idle = [
+            user_id for user_id, state in self._states.items()
+            if state["status"] in ("consent", "awaiting_answer", "failed") and state["updated_at"] < cutoff
+        ]
+        for user_id in idle:
+            del self._states[user_id]
+        now = time.monotonic()
+        for user_id in [user_id for user_id, until in self._no_session.items() if until <= now]:
+            del self._no_session[user_id]
+        return len(idle)
+
+    def stats(self):
+        waits = sorted(self.queue_waits)
+        return {
+            "active": len(self._active),
+            "queued": len(self._queue),
+            "awaiting_reply": sum(1 for state in self._states.values() if state["status"] in ("consent", "awaiting_answer")),
+            "completed": self.completed,
+            "declined": self.declined,
+            "failed": self.failed,
+            "queue_wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "queue_wait_max": waits[-1] if waits else 0.0,
+        }
@@ -0,0 +1,82 @@
+"""
+Grammar-constrained workout plan generation.
+
+Free-form plan prompts let the model ramble for hundreds of tokens before,
+between and after the seven days. Plans are instead generated under a GBNF
+grammar that only admits the seven days in order, one line each:
+
+    Monday: Squats, lunges and planks (45 min)
+    ...
+    Sunday: Rest (0 min)
+
+Once Sunday's line is complete the grammar allows nothing but end of text,
+so generation stops there, and the output is read back into PlanDay records
+by splitting fixed separators, with no regex search.
+
+The grammar is passed as GBNF text. Local models get it compiled once per
+process; worker-pool proxies forward the text and the worker compiles it.
+"""
+import functools
+
+from plan_parser import DAYS, PlanDay
+
+PLAN_WORKOUT_CHARS = 90  # Longest workout description per day
+PLAN_MAX_TOKENS = 320  # Seven bounded lines fit comfortably; free-form plans used 768
+
+PLAN_GRAMMAR = "\n".join([
+    "root ::= " + " ".join(f'"{day}: " entry' for day in DAYS),
+    'entry ::= workout " (" minutes " min)\\n"',
+    f"workout ::= [A-Za-z0-9] [^\\n()]{{0,{PLAN_WORKOUT_CHARS - 1}}}",
+    "minutes ::= [0-9] | [1-9] [0-9] | [1-9] [0-9] [0-9]",
+])
+
+PLAN_FORMAT_INSTRUCTIONS = (
+    "List only the days and the workout for each day, one line per day, formatted exactly as "
+    "'Monday: <workout> (<minutes> min)' from Monday to Sunday. Use '(0 min)' for rest days. "
+    "No introduction, no summary, just the plan."
+)
+
+
+@functools.lru_cache(maxsize=8)
+def compile_grammar(text: str):
+    """Compiled LlamaGrammar for GBNF text, built once per process."""
+    from llama_cpp import LlamaGrammar
+    return LlamaGrammar.from_string(text, verbose=False)
+
+
+def grammar_for(model, text: str):
+    """The grammar= argument for model(): worker proxies take the GBNF text, local models a compiled grammar."""
+    if getattr(model, "compiles_grammar", False):
+        return text
+    return compile_grammar(text)
+
+
+def parse_constrained_plan(text: str):
+    """
+    PlanDay records from grammar-constrained output. Lines that are not complete
+    (e.g. the last one when max_tokens ran out) are skipped.
+    """
+    records = []
+    for line in (text or "").splitlines():
+        day, sep, entry = line.strip().partition(": ")
+        workout, paren, tail = entry.rpartition(" (")
+        if not sep or not paren or day not in DAYS or not tail.endswith(" min)"):
+            continue
+        minutes = tail[:-len(" min)")]
+        if not minutes.isdigit():
+            continue
+        minutes = int(minutes)
+        workout = workout.strip()
+        records.append(PlanDay(
+            day=day,
+            title=workout,
+            duration_minutes=minutes or None,
+            rest_day=minutes == 0,
+            description=f"{workout} ({minutes} min)" if minutes else workout
+        ))
+    return records
+
+
+def plan_entries(records):
+    """(day, workout) pairs for the calendar, like plan_parser.parse_workout_plan."""
+    return [(record.day, record.description) for record in records]
@@ -0,0 +1,104 @@
+"""
+Workout plan parser.
+
+Finds day headers with one precompiled pattern and slices the text between
+them, so parsing is a single left-to-right pass. Every quantifier in the
+patterns is bounded, which keeps the regex work per position constant and
+the whole parse linear in the input size, even on long or malformed LLM
+output.
+
+Accepted header styles include "Monday: ...", "monday - ...", "**Monday:**",
+"**Monday**: ...", "### Monday", "- Monday: ..." and "1. Monday (Rest): ...".
+Like the original parser, "Monday: " is also a header in the middle of a line,
+as in "Monday: run 5k, Tuesday: yoga", "Day 1 - Monday: ..." or
+"Week plan: Monday: ...".
+"""
+import re
+from collections import namedtuple
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+PlanDay = namedtuple("PlanDay", ["day", "title", "duration_minutes", "rest_day", "description"])
+
+_EMPHASIS = r"(?:\*\*|__|\*|_)?"
+_DAY_HEADER = re.compile(
+    r"^[ \t]{0,8}(?:>[ \t]{0,4})?"                        # Indentation, blockquote
+    r"(?:#{1,6}[ \t]{1,4})?"                                # Markdown heading
+    r"(?:(?:[-*+•]|\d{1,2}[.)])[ \t]{1,4})?"                # Bullet or numbered list item
+    + _EMPHASIS + r"[ \t]{0,4}"
+    r"(?P<day>" + "|".join(DAYS) + r")\b"
+    r"(?:[ \t]{0,4}\(([^()\n]{0,40})\))?"                   # "(Rest)", "(Day 1)"
+    + _EMPHASIS + r"[ \t]{0,4}(?::|-|–|—|(?=\n)|$)" + _EMPHASIS
+    # Mid-line: a capitalized day after a space or separator, with a colon and then whitespace
+    + r"|(?<=[ \t,;|])" + _EMPHASIS + r"(?-i:(?P<inline_day>" + "|".join(DAYS) + r"))"
+    + _EMPHASIS + r"[ \t]{0,2}:" + _EMPHASIS + r"(?!\S)",
+    re.IGNORECASE | re.MULTILINE
+)
+_DURATION = re.compile(
+    r"(\d{1,3}(?:\.\d{1,2})?)[ \t]{0,3}(?:(?:-|–|to)[ \t]{0,3}\d{1,3}[ \t]{0,3})?"
+    r"(minutes|minute|mins|min|hours|hour|hrs|hr|h)\b",
+    re.IGNORECASE
+)
+_REST = re.compile(r"^\W{0,4}(?:rest|off|recovery)\b|\brest day\b|\bday off\b", re.IGNORECASE)
+_LINE_MARKUP = re.compile(r"^[ \t]{0,8}(?:>[ \t]{0,4})?(?:[-*+•]|\d{1,2}[.)])?[ \t]{0,4}")
+_INLINE_MARKUP = re.compile(r"\*\*|__|`")
+
+
+def _duration_minutes(text: str):
+    match = _DURATION.search(text)
+    if match is None:
+        return None
+    value = float(match.group(1))
+    if match.group(2).lower().startswith("h"):
+        value *= 60
+    return int(round(value))
+
+
+def _clean_lines(body: str):
+    lines = []
+    for line in body.splitlines():
+        # Trailing separators are left over from mid-line headers ("run 5k, Tuesday: yoga")
+        line = _INLINE_MARKUP.sub("", _LINE_MARKUP.sub("", line, count=1)).strip().rstrip(",;|").rstrip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def parse_plan(plan_text: str):
+    """Parse LLM plan text into PlanDay records, in the order the days appear."""
+    headers = list(_DAY_HEADER.finditer(plan_text or ""))
+    records = []
+    for i, header in enumerate(headers):
+        end = len(plan_text)
+        if i + 1 < len(headers):
+            end = headers[i + 1].start()
+            if headers[i + 1].group("inline_day"):
+                # A label before a mid-line header on its own line ("Day 2 - Tuesday:") isn't part of this day
+                line_start = plan_text.rfind("\n", header.end(), end)
+                if line_start != -1:
+                    end = line_start
+        body = plan_text[header.end():end]
+        if i + 1 == len(headers):
+            # Drop closing commentary ("This plan will help you...") after the last day's paragraph
+            stripped = body.strip("\n")
+            cut = stripped.find("\n\n")
+            if cut != -1 and stripped[:cut].strip():
+                body = stripped[:cut]
+        lines = _clean_lines(body)
+        note = (header.group(2) or "").strip()
+        if not lines and not note:
+            continue
+        description = "; ".join(lines) if lines else note
+        records.append(PlanDay(
+            day=(header.group("day") or header.group("inline_day")).capitalize(),
+            title=lines[0] if lines else note,
+            duration_minutes=_duration_minutes(description),
+            rest_day=bool(_REST.search(description) or _REST.search(note)),
+            description=description
+        ))
+    return records
+
+
+def parse_workout_plan(plan_text: str):
+    """(day, workout) pairs, as used by /confirmplan."""
+    return [(record.day, record.description) for record in parse_plan(plan_text)]
@@ -0,0 +1,165 @@
+"""
+Precomputed workout plans keyed by normalized goal.
+
+Almost every /plan goal comes from the autocomplete list, so plans for those
+goals are generated ahead of time, a few variants each, by a background job
+that only runs while the LLM is idle. A free-text goal is mapped onto a
+stored goal by normalizing it (case, punctuation, whitespace) and, failing an
+exact match, by allowing typos against the precomputed goals only: the same
+number of words, each equal or one edit away (two for long words) with the
+same first letter. Similar-looking goals with a different meaning ("muscle
+pain" vs "muscle gain", "hit" vs "hiit") are not merged. Hits are served
+instantly and rotate between variants. Goals that match nothing are generated
+live and the result is stored under the goal exactly as normalized, so
+repeats are hits too.
+
+Plans are stored as grammar-constrained plan text (see plan_grammar.py) in a
+local SQLite file, so the store survives restarts.
+"""
+import time
+from collections import OrderedDict
+
+from llm_scheduler import fill_while_idle
+from plan_grammar import parse_constrained_plan
+from plan_parser import DAYS
+from response_cache import normalize_prompt
+from sqlite_store import open_sqlite
+
+MIN_TYPO_WORD_LENGTH = 4  # Shorter words must match exactly
+LONG_WORD_LENGTH = 8  # Words at least this long may be two edits away
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance where swapping two adjacent letters counts as one edit."""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def is_typo_of(word: str, target: str) -> bool:
+    """True if `word` is `target` or a likely misspelling of it."""
+    if word == target:
+        return True
+    if min(len(word), len(target)) < MIN_TYPO_WORD_LENGTH or word[0] != target[0]:
+        return False
+    return edit_distance(word, target) <= (2 if len(target) >= LONG_WORD_LENGTH else 1)
+
+
+class PlanStore:
+    """
+    Plan variants per goal. `goals` are precomputed by precompute(); other goals are added as they are generated live.
+    generate(goal, priority) is an async function returning plan text.
+    """
+
+    def __init__(self, goals, generate, path="cache/plan_store.sqlite3", per_goal=3, max_goals=500):
+        self.goals = [normalize_prompt(goal) for goal in goals]
+        self.per_goal = per_goal
+        self.max_goals = max_goals
+        self._generate = generate
+        self._plans = OrderedDict()  # normalized goal -> {"variants": [plan_text], "next": int}
+        self.hits = 0
+        self.misses = 0
+        self._db = open_sqlite(
+            path,
+            "CREATE TABLE IF NOT EXISTS plans ("
+            " goal TEXT NOT NULL, plan_text TEXT NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (goal, plan_text))"
+        )
+        for goal in self.goals:
+            self._plans[goal] = {"variants": [], "next": 0}
+        for goal, plan_text in self._db.execute("SELECT goal, plan_text FROM plans ORDER BY created_at"):
+            self._plans.setdefault(goal, {"variants": [], "next": 0})["variants"].append(plan_text)
+
+    def match(self, goal: str):
+        """Stored goal key for a free-text goal (exact after normalization, else a typo of a precomputed goal), or None."""
+        goal = normalize_prompt(goal)
+        if goal in self._plans:
+            return goal
+        # Spaces are folded too, so "5 k run" and "weightloss" still find "5k run" and "weight loss"
+        compact = goal.replace(" ", "")
+        for key, entry in self._plans.items():
+            if entry["variants"] and key.replace(" ", "") == compact:
+                return key
+        words = goal.split()
+        for key in self.goals:
+            key_words = key.split()
+            if (self._plans[key]["variants"] and len(key_words) == len(words)
+                    and all(is_typo_of(word, target) for word, target in zip(words, key_words))):
+                return key
+        return None
+
+    def get(self, goal: str):
+        """A stored plan for the goal, rotating between variants, or None on a miss."""
+        key = self.match(goal)
+        entry = self._plans.get(key) if key is not None else None
+        if entry is None or not entry["variants"]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._plans.move_to_end(key)
+        plan_text = entry["variants"][entry["next"] % len(entry["variants"])]
+        entry["next"] += 1
+        return plan_text
+
+    def add(self, goal: str, plan_text: str) -> bool:
+        """
+        Store a generated plan under the normalized goal (never a fuzzy match, which could fill
+        another goal's slot). Only complete seven-day plans are kept.
+        """
+        plan_text = plan_text.strip()
+        if len(parse_constrained_plan(plan_text)) != len(DAYS):
+            return False
+        key = normalize_prompt(goal)
+        if not key:
+            return False
+        entry = self._plans.setdefault(key, {"variants": [], "next": 0})
+        self._plans.move_to_end(key)
+        if plan_text in entry["variants"]:
+            return False
+        entry["variants"].append(plan_text)
+        dropped = entry["variants"][:-self.per_goal]
+        entry["variants"] = entry["variants"][-self.per_goal:]
+        with self._db:
+            for old_text in dropped:
+                self._db.execute("DELETE FROM plans WHERE goal = ? AND plan_text = ?", (key, old_text))
+            self._db.execute(
+                "INSERT OR REPLACE INTO plans (goal, plan_text, created_at) VALUES (?, ?, ?)",
+                (key, plan_text, time.time())
+            )
+        self._evict()
+        return True
+
+    def _evict(self):
+        """Drop the least recently used live goals beyond max_goals; precomputed goals are kept."""
+        live = [key for key in self._plans if key not in self.goals]
+        for key in live[:max(0, len(self._plans) - self.max_goals)]:
+            del self._plans[key]
+            with self._db:
+                self._db.execute("DELETE FROM plans WHERE goal = ?", (key,))
+
+    async def precompute(self, is_idle):
+        """
+        Generate variants for the precomputed goals, emptiest first, while is_idle() is true.
+        Meant to be run periodically from the scheduler.
+        """
+        await fill_while_idle(
+            is_idle, self.goals, lambda goal: len(self._plans[goal]["variants"]), self.per_goal,
+            self._generate, self.add, "Plan precompute"
+        )
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "goals": len(self._plans),
+            "plans": sum(len(entry["variants"]) for entry in self._plans.values()),
+        }
+
+    def close(self):
+        self._db.close()
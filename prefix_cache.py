@@ -0,0 +1,128 @@
+"""
+KV-cache reuse for fixed prompt prefixes and multi-round sessions.
+
+Every prompt the bot sends starts with one of a handful of fixed templates
+(e.g. "[INST] You are a friendly, supportive fitness coach."). Each prefix is
+tokenized and evaluated once, and the llama state is snapshotted. Before a
+request, the snapshot for the longest matching prefix is restored so
+llama.cpp only has to evaluate the user-specific suffix.
+"""
+
+
+def tokenize(model, text: str):
+    """Tokenize the way Llama.create_completion does, so prefix tokens line up with prompt tokens."""
+    try:
+        return model.tokenize(text.encode("utf-8"), special=True)
+    except TypeError:
+        # Older llama-cpp-python versions have no `special` argument
+        return model.tokenize(text.encode("utf-8"))
+
+
+def cached_tokens(model):
+    """
+    Tokens currently in the model's KV cache. Llama.input_ids is a buffer of n_ctx entries;
+    only the first n_tokens are valid, the rest is left over from earlier prompts.
+    """
+    return list(model.input_ids[:model.n_tokens])
+
+
+class PrefixStateCache:
+    """Token lists and saved llama states for a set of fixed prompt prefixes."""
+
+    def __init__(self, prefixes):
+        # Longest first so the most specific template wins
+        self.prefixes = sorted(set(prefixes), key=len, reverse=True)
+        self.tokens = {}
+        self._states = {}
+        self.restores = 0
+        self.reuses = 0
+
+    def warm(self, model):
+        """Tokenize and evaluate every prefix once, keeping a state snapshot for each."""
+        for prefix in self.prefixes:
+            tokens = tokenize(model, prefix)
+            model.reset()
+            model.eval(tokens)
+            self.tokens[prefix] = tokens
+            self._states[prefix] = model.save_state()
+        model.reset()
+
+    def match(self, prompt: str):
+        """Longest warmed prefix the prompt starts with, or None."""
+        for prefix in self.prefixes:
+            if prefix in self._states and prompt.startswith(prefix):
+                return prefix
+        return None
+
+    def prepare(self, model, prompt: str):
+        """
+        Make sure the model's KV cache already holds the prompt's prefix.
+        llama-cpp-python then skips the matching tokens when it evaluates the prompt.
+        """
+        prefix = self.match(prompt)
+        if prefix is None:
+            return
+        tokens = self.tokens[prefix]
+        if cached_tokens(model)[:len(tokens)] == tokens:
+            # The previous request left this prefix in the cache already
+            self.reuses += 1
+            return
+        model.load_state(self._states[prefix])
+        self.restores += 1
+
+
+class PrefixCachedModel:
+    """
+    Wraps a Llama instance so every completion starts from the cached prefix state.
+    Everything other than __call__ is passed straight through to the model.
+
+    With `sessions` (an llm_sessions.SessionStateCache), a call can pass session_id=...
+    to continue from the state saved by that session's previous call, when it shares
+    more of the prompt than the template prefix does; end_session=True drops the
+    saved state after the call.
+    """
+
+    def __init__(self, model, prefix_cache: PrefixStateCache, sessions=None):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.sessions = sessions
+
+    def __call__(self, prompt, session_id=None, end_session=False, **kwargs):
+        if session_id is None or self.sessions is None:
+            self.prefix_cache.prepare(self.model, prompt)
+            return self.model(prompt, **kwargs)
+        self._prepare_session(session_id, prompt)
+        output = self.model(prompt, **kwargs)
+        if kwargs.get("stream"):
+            return self._stream_then_save(output, session_id, end_session)
+        self._save_session(session_id, end_session)
+        return output
+
+    def _prepare_session(self, session_id, prompt: str):
+        from llm_sessions import shared_prefix_length
+        entry = self.sessions.get(session_id)
+        prefix = self.prefix_cache.match(prompt)
+        prefix_length = len(self.prefix_cache.tokens[prefix]) if prefix is not None else 0
+        if entry is not None:
+            tokens = tokenize(self.model, prompt)
+            saved_tokens, state = entry
+            shared = shared_prefix_length(saved_tokens, tokens)
+            if shared > prefix_length:
+                if shared_prefix_length(cached_tokens(self.model), tokens) < shared:
+                    self.model.load_state(state)
+                self.sessions.reused_tokens += shared
+                return
+        self.prefix_cache.prepare(self.model, prompt)
+
+    def _save_session(self, session_id, end_session: bool):
+        if end_session:
+            self.sessions.drop(session_id)
+        else:
+            self.sessions.put(session_id, cached_tokens(self.model), self.model.save_state())
+
+    def _stream_then_save(self, chunks, session_id, end_session: bool):
+        yield from chunks
+        self._save_session(session_id, end_session)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
@@ -1,68 +1,175 @@
 # Import necessary libraries
+from startup_report import startup_report  # Imported first so the startup clock starts with the process
 import discord  # Discord API wrapper
 import os  # For environment variable access
 import datetime  # For date handling
 import asyncio  # For async event loop
+import time  # For latency measurements
+from collections import deque
 from discord.ext import commands  # Discord bot commands extension
-from apscheduler.schedulers.asyncio import AsyncIOScheduler  # Scheduler for periodic jobs
 from dotenv import load_dotenv  # For loading environment variables from .env
-import firebase_admin  # Firebase SDK
-from firebase_admin import credentials, firestore  # For auth and database access
 from discord import app_commands  # For slash commands and autocomplete
-import pickle  # For saving user tokens
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
 import re  # For regex operations
-from google_auth_oauthlib.helpers import session_from_client_secrets_file
-import requests
-from llama_log_redirect import llama_log_redirect
+# Google API client libraries are imported lazily by utils.get_calendar_service on first /confirmplan
+startup_report.mark("import discord.py")
 from utils import (
     get_calendar_service,
-    parse_workout_plan,
-    get_motivation,
+    calendar_services,
+    generate_motivation,
     check_streaks,
-    db,
     scheduler,
-    llm
+    llm_available,
+    llm_loaded,
+    llm_scheduler,
+    prompt_budget,
+    start_llm_loading,
+    wait_for_llm,
+    LLM_WARMING_UP_MESSAGE,
+    COACH_PREFIX,
+    PLAN_PREFIX,
+    ONBOARDING_PREFIX,
+    ONBOARDING_PLAN_PREFIX
 )
-import concurrent.futures
+from llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_ASK, PRIORITY_PLAN, PRIORITY_BACKGROUND
+from motivation_pool import MotivationPool
+from response_cache import ResponseCache, normalize_prompt
+from data_access import store, write_buffer
+from log_store import log_workout
+from calendar_events import insert_plan_events, describe_results
+from google_oauth import close_http_session
+from plan_store import PlanStore
+from expiring_store import ExpiringStore
+from onboarding import OnboardingManager, transcript
+from prompt_budget import PromptTooLong
+from plan_parser import parse_workout_plan
+from plan_grammar import PLAN_GRAMMAR, PLAN_MAX_TOKENS, PLAN_FORMAT_INSTRUCTIONS, grammar_for, parse_constrained_plan, plan_entries
+startup_report.mark("import utils (Firestore client, scheduler)")
 
 # Load environment variables from .env file (e.g., DISCORD_BOT_TOKEN)
 load_dotenv()
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 
-# Initialize Firebase using service account credentials
-cred = credentials.Certificate("serviceAccountKey.json")
-# firebase_admin.initialize_app(cred)
-db = firestore.client()  # Firestore database client
-
 # Set up Discord bot with required permissions (specifically to read message content)
 intents = discord.Intents.default()
 intents.message_content = True  # Needed for message content access
 bot = commands.Bot(command_prefix='/', intents=intents)  # Define bot with '/' as command prefix
 
-# Initialize scheduler to run background tasks (like daily streak checks)
-scheduler = AsyncIOScheduler()
-
 # Google Calendar API setup
 SCOPES = ["https://www.googleapis.com/auth/calendar.events"]
 GOOGLE_CREDENTIALS_FILE = "./google_api_credentials.json"  # Your OAuth2 credentials file
 
-# Use a thread pool executor for LLM calls
-llm_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+async def call_llm_async(prompt, max_tokens=None, stop=None, top_p=0.95, priority=PRIORITY_ASK, label="ask", grammar=None,
+                         session_id=None, end_session=False):
+    """
+    Queue a completion on the LLM scheduler and await the result.
+    max_tokens is clamped to the context left after the prompt (None: all of it); a prompt that
+    leaves no room for an answer raises PromptTooLong before it is queued.
+    Interactive work (/log, onboarding) should use PRIORITY_INTERACTIVE so it is served ahead of /ask and /plan.
+    `grammar` is optional GBNF text that constrains the output (see plan_grammar.py).
+    `session_id` continues from the state saved by the session's previous call (see llm_sessions.py).
+    """
+    max_tokens = prompt_budget.max_tokens(prompt, max_tokens)
 
-async def call_llm_async(prompt, max_tokens=20000, stop=None, top_p=0.95):
-    loop = asyncio.get_event_loop()
-    def llm_call():
+    def llm_call(model):
         # Only pass supported parameters to llm() call
-        return llm(
+        extra = {"grammar": grammar_for(model, grammar)} if grammar else {}
+        if session_id is not None:
+            extra.update(session_id=session_id, end_session=end_session)
+        return model(
             prompt,
             max_tokens=max_tokens,
             top_p=top_p,
-            stop=stop or ["</s>"]
+            stop=stop or ["</s>"],
+            **extra
         )
-    return await loop.run_in_executor(llm_executor, llm_call)
+    return await llm_scheduler.run(llm_call, priority=priority, label=label)
+
+async def stream_llm_async(prompt, max_tokens=None, stop=None, top_p=0.95, priority=PRIORITY_ASK, label="ask", grammar=None):
+    """
+    Queue a streaming completion on the LLM scheduler and yield text chunks as they are generated.
+    max_tokens is clamped like in call_llm_async.
+    """
+    max_tokens = prompt_budget.max_tokens(prompt, max_tokens)
+
+    def llm_stream(model):
+        extra = {"grammar": grammar_for(model, grammar)} if grammar else {}
+        for chunk in model(
+            prompt,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=stop or ["</s>"],
+            stream=True,
+            **extra
+        ):
+            yield chunk["choices"][0]["text"]
+    async for text in llm_scheduler.stream(llm_stream, priority=priority, label=label):
+        yield text
+
+# --- Streaming replies ---
+# Discord allows roughly 5 message edits per 5 seconds, so stay comfortably below that
+STREAM_EDIT_INTERVAL = 1.5
+DISCORD_MESSAGE_LIMIT = 2000
+# A sentence is ready once it ends in punctuation followed by whitespace, or a newline
+SENTENCE_END = re.compile(r"[.!?:](\s|$)|\n")
+# Time from command invocation to the first visible token, per command (most recent last)
+first_token_latencies = {"ask": deque(maxlen=200), "plan": deque(maxlen=200)}
+
+async def send_streamed_reply(interaction: discord.Interaction, render, chunks, started_at: float, command: str) -> str:
+    """
+    Posts a followup as soon as the first sentence of a streamed LLM reply is ready,
+    then edits it every STREAM_EDIT_INTERVAL seconds until generation finishes.
+    render(text, done) builds the message content. Returns the full generated text.
+    """
+    text = ""
+    message = None
+    shown = None
+    last_edit = 0.0
+    async for chunk in chunks:
+        text += chunk
+        if message is None:
+            if not SENTENCE_END.search(text.lstrip()):
+                continue
+            shown = render(text.strip(), False)[:DISCORD_MESSAGE_LIMIT]
+            message = await interaction.followup.send(shown, wait=True)
+            last_edit = time.monotonic()
+            latency = last_edit - started_at
+            first_token_latencies[command].append(latency)
+            print(f"[LLM] /{command} first visible token after {latency:.2f}s")
+        elif time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+            content = render(text.strip(), False)[:DISCORD_MESSAGE_LIMIT]
+            if content != shown:
+                await message.edit(content=content)
+                shown = content
+                last_edit = time.monotonic()
+    content = render(text.strip(), True)[:DISCORD_MESSAGE_LIMIT]
+    if message is None:
+        await interaction.followup.send(content)
+        latency = time.monotonic() - started_at
+        first_token_latencies[command].append(latency)
+        print(f"[LLM] /{command} first visible token after {latency:.2f}s")
+    elif content != shown:
+        await message.edit(content=content)
+    return text.strip()
+
+# --- /ask response cache ---
+# Generation parameters for /ask; they are part of the cache key
+ASK_PARAMS = {"max_tokens": 512, "stop": ["</s>"], "top_p": 0.95}
+# /ask prompts must leave at least this much of the context for the answer
+ASK_MIN_ANSWER_TOKENS = 128
+ask_cache = ResponseCache("cache/ask_responses.sqlite3")
+# Prompts that currently have a background variant being generated
+_ask_variant_tasks = set()
+
+def ask_llm_prompt(prompt: str) -> str:
+    return f"{COACH_PREFIX} {prompt} [/INST]"
+
+async def add_ask_variant(prompt: str):
+    """Generate one more cached variant for a popular /ask prompt at background priority."""
+    try:
+        response = await call_llm_async(ask_llm_prompt(prompt), priority=PRIORITY_BACKGROUND, label="ask_variant", **ASK_PARAMS)
+        ask_cache.put(prompt, response["choices"][0]["text"], **ASK_PARAMS)  # type: ignore
+    except Exception as e:
+        print(f"[LLM] Skipped extra /ask variant: {e}")
 
 # --- Autocomplete helpers ---
 # Common workout durations and example prompts for autocomplete in discord slash commands
@@ -75,6 +182,46 @@ EXAMPLE_PROMPTS = [
     "How do I recover from muscle soreness?"
 ]
 
+# Pre-generated motivations for /log, bucketed by the common durations and refilled while the LLM is idle
+motivation_pool = MotivationPool(COMMON_MINUTES, generate_motivation)
+MOTIVATION_REFILL_SECONDS = 30
+
+async def refill_motivation_pool():
+    await motivation_pool.refill(lambda: llm_available() and llm_scheduler.is_idle())
+
+# --- Precomputed /plan answers ---
+# Goals offered by /plan autocomplete; their plans are generated ahead of time while the LLM is idle
+PLAN_GOALS = [
+    "strength training",
+    "cardio",
+    "yoga",
+    "5k run",
+    "HIIT",
+    "upper body",
+    "lower body",
+    "full body",
+    "weight loss",
+    "muscle gain",
+    "flexibility"
+]
+PLAN_PRECOMPUTE_SECONDS = 60
+
+def plan_prompt(goal: str) -> str:
+    return f"{PLAN_PREFIX} {goal}. {PLAN_FORMAT_INSTRUCTIONS} [/INST]"
+
+async def generate_plan_text(goal: str, priority=PRIORITY_PLAN) -> str:
+    """Generate a grammar-constrained plan for a goal on the LLM scheduler."""
+    response = await call_llm_async(
+        plan_prompt(goal), max_tokens=PLAN_MAX_TOKENS, stop=["<s>"], top_p=0.95,
+        priority=priority, label="plan_precompute", grammar=PLAN_GRAMMAR
+    )
+    return response["choices"][0]["text"].strip()  # type: ignore
+
+plan_store = PlanStore(PLAN_GOALS, generate_plan_text)
+
+async def precompute_plans():
+    await plan_store.precompute(lambda: llm_available() and llm_scheduler.is_idle())
+
 async def get_minutes_autocomplete(interaction: discord.Interaction, current: str):
     """Suggest common workout durations for /log command autocomplete."""
     return [
@@ -92,22 +239,9 @@ async def get_prompt_autocomplete(interaction: discord.Interaction, current: str
 # Helper for /plan autocomplete
 async def plan_goal_autocomplete(interaction: discord.Interaction, current: str):
     """Suggest example workout goals for /plan command autocomplete."""
-    EXAMPLES = [
-        "strength training",
-        "cardio",
-        "yoga",
-        "5k run",
-        "HIIT",
-        "upper body",
-        "lower body",
-        "full body",
-        "weight loss",
-        "muscle gain",
-        "flexibility"
-    ]
     return [
         app_commands.Choice(name=ex, value=ex)
-        for ex in EXAMPLES if current.lower() in ex.lower()
+        for ex in PLAN_GOALS if current.lower() in ex.lower()
     ][:5]
 
 
@@ -134,10 +268,10 @@ async def log(interaction: discord.Interaction, minutes: int):
         )
         return
     uid = str(interaction.user.id)
-    today = datetime.date.today().isoformat()
-    entry = {today: minutes}
-    db.collection("logs").document(uid).set(entry, merge=True)
-    motivation = get_motivation(minutes)
+    today = datetime.date.today()
+    log_workout(store, uid, today, minutes)
+    await store.record_streak(uid, today)
+    motivation = await motivation_pool.get(minutes)
     await interaction.followup.send(
         f"{interaction.user.mention} logged `/log {minutes}`\n\n✅ *{minutes} min* for today!\n{motivation}"
     )
@@ -152,20 +286,47 @@ async def ask(interaction: discord.Interaction, prompt: str):
     Uses deferred response to avoid Discord timeout.
     Echoes the user's request in the bot's response for chat visibility.
     """
+    started_at = time.monotonic()
     await interaction.response.defer()  # Defer response to prevent timeout
     print(f"executing /ask with {interaction.user}: {prompt}")
-    llm_prompt = f"[INST] You are a friendly, supportive fitness coach. {prompt} [/INST]"
+    llm_prompt = ask_llm_prompt(prompt)
+    try:
+        # Refuse prompts that can't fit with an answer before they wait in the queue
+        prompt_budget.check(llm_prompt, min_output=ASK_MIN_ANSWER_TOKENS)
+    except PromptTooLong as e:
+        await interaction.followup.send(
+            f"{interaction.user.mention} ✂️ Your question is too long for me to answer "
+            f"({e.tokens} tokens; I can read about {e.limit}). Please shorten it and try again."
+        )
+        return
+    cached = ask_cache.get(prompt, **ASK_PARAMS)
+    if cached is not None:
+        await interaction.followup.send(f"**{interaction.user.mention} asked:** `{prompt}`\n💡 {cached}")
+        latency = time.monotonic() - started_at
+        first_token_latencies["ask"].append(latency)
+        print(f"[LLM] /ask served from cache after {latency:.2f}s ({ask_cache.stats()})")
+        # Build up a few variants for popular prompts so answers don't feel canned
+        key = normalize_prompt(prompt)
+        if ask_cache.needs_variant(prompt, **ASK_PARAMS) and key not in _ask_variant_tasks:
+            _ask_variant_tasks.add(key)
+            task = asyncio.create_task(add_ask_variant(prompt))
+            task.add_done_callback(lambda _: _ask_variant_tasks.discard(key))
+        return
+    if not llm_loaded.is_set():
+        await interaction.followup.send(f"**{interaction.user.mention} asked:** `{prompt}`\n{LLM_WARMING_UP_MESSAGE}")
+        return
     import traceback
     try:
-        with llama_log_redirect("logs/project5k_bot_llm.log"):
-            if llm is None:
-                raise RuntimeError("LLM model failed to load.")
-            response = await call_llm_async(
-                llm_prompt,
-                max_tokens=512,  # Balanced for speed/quality
-                stop=["</s>"]
-            )
-        reply = response["choices"][0]["text"].strip()  # type: ignore
+        if not llm_available():
+            raise RuntimeError("LLM model failed to load.")
+        reply = await send_streamed_reply(
+            interaction,
+            lambda text, done: f"**{interaction.user.mention} asked:** `{prompt}`\n💡 {text}" + ("" if done else " …"),
+            stream_llm_async(llm_prompt, **ASK_PARAMS),
+            started_at,
+            "ask"
+        )
+        ask_cache.put(prompt, reply, **ASK_PARAMS)
     except Exception as e:
         error_log_path = "logs/project5k_bot_llm_error.log"
         with open(error_log_path, "a") as f:
@@ -176,12 +337,18 @@ async def ask(interaction: discord.Interaction, prompt: str):
             f.write("\n---\n")
         print(f"[LLM ERROR] Exception occurred in /ask. Details written to {error_log_path}")
         reply = "[LLM ERROR] Sorry, there was a problem generating a response. Please try again later."
-    await interaction.followup.send(
-        f"**{interaction.user.mention} asked:** `{prompt}`\n💡 {reply}"
-    )
+        await interaction.followup.send(
+            f"**{interaction.user.mention} asked:** `{prompt}`\n💡 {reply}"
+        )
 
-# Global in-memory store for pending plans (user_id -> {plan_text, timestamp})
-pending_plans = {}
+# Plans waiting for /confirmplan (user_id -> {plan_text}). Entries expire after PLAN_CONFIRM_SECONDS,
+# a scheduler job sweeps them, and they are kept on disk so a restart doesn't drop them.
+PLAN_CONFIRM_SECONDS = 120
+pending_plans = ExpiringStore(PLAN_CONFIRM_SECONDS, max_entries=10000, path="cache/pending.sqlite3", namespace="plans")
+
+def remember_plan(user_id: int, plan_text: str):
+    """Hold a generated plan for the user's /confirmplan."""
+    pending_plans.put(user_id, {'plan_text': plan_text})
 
 @bot.tree.command(name="plan", description="Create a weekly workout plan and add it to your Google Calendar.")
 @app_commands.describe(goal="Describe your workout goal or type (e.g. 'strength', 'cardio', 'yoga', '5k run', 'full body', etc.)")
@@ -191,27 +358,54 @@ async def plan(interaction: discord.Interaction, goal: str):
     Generates a weekly workout plan using the LLM based on the user's goal and, upon user confirmation, adds it to the user's Google Calendar.
     Prompts the user to authenticate with Google if needed.
     """
+    started_at = time.monotonic()
     await interaction.response.defer()
     print(f"executing /plan with {interaction.user}: {goal}")
-    prompt = (
-        f"Create a 7-day workout plan for the goal: {goal}. "
-        "List only the days and the workout for each day. "
-        "Format exactly as: Monday: ...\\nTuesday: ...\\nWednesday: ...\\nThursday: ...\\nFriday: ...\\nSaturday: ...\\nSunday: ... "
-        "No introduction, no summary, just the plan."
-    )
-    prompt = f"<s>[INST] You are a friendly, supportive fitness coach. {prompt} [/INST]"
+    prompt = plan_prompt(goal)
+
+    def render_plan(text, done):
+        header = f"Here is your weekly workout plan for **{goal}**:\n```\n{text}\n```"
+        if not done:
+            return header + "\n⏳ Still writing…"
+        return header + "\n\nIf you want to add this plan to your Google Calendar, reply with `/confirmplan` in the next 2 minutes.\n\n**Example prompts for /plan:**\n- strength training\n- yoga\n- 5k run\n- full body\n- weight loss\n- flexibility\n- HIIT\n- upper body\n- lower body\n- muscle gain\n- cardio"
+
+    try:
+        # The plan needs its full token budget, so an overly long goal is refused up front
+        prompt_budget.check(prompt, min_output=PLAN_MAX_TOKENS)
+    except PromptTooLong:
+        await interaction.followup.send("✂️ That goal is too long for me to plan around. Please describe it in a sentence or two.")
+        return
+    cached = plan_store.get(goal)
+    if cached is not None:
+        await interaction.followup.send(render_plan(cached, True))
+        latency = time.monotonic() - started_at
+        first_token_latencies["plan"].append(latency)
+        print(f"[LLM] /plan served from plan store after {latency:.2f}s ({plan_store.stats()})")
+        remember_plan(interaction.user.id, cached)
+        return
+    if not llm_loaded.is_set():
+        await interaction.followup.send(LLM_WARMING_UP_MESSAGE)
+        return
     import traceback
     try:
-        with llama_log_redirect("logs/project5k_bot_llm.log"):
-            if llm is None:
-                raise RuntimeError("LLM model failed to load.")
-            output = await call_llm_async(
+        if not llm_available():
+            raise RuntimeError("LLM model failed to load.")
+        response = await send_streamed_reply(
+            interaction,
+            render_plan,
+            stream_llm_async(
                 prompt,
-                max_tokens=768,  # Slightly higher for plan
+                # The grammar only admits the seven day lines, so generation ends after Sunday
+                max_tokens=PLAN_MAX_TOKENS,
                 stop=["<s>"],
-                top_p=0.95
-            )
-        response = output["choices"][0]["text"] # type: ignore
+                top_p=0.95,
+                priority=PRIORITY_PLAN,
+                label="plan",
+                grammar=PLAN_GRAMMAR
+            ),
+            started_at,
+            "plan"
+        )
     except Exception as e:
         error_log_path = "logs/project5k_bot_llm_error.log"
         with open(error_log_path, "a") as f:
@@ -221,20 +415,12 @@ async def plan(interaction: discord.Interaction, goal: str):
             f.write(traceback.format_exc())
             f.write("\n---\n")
         print(f"[LLM ERROR] Exception occurred in /plan. Details written to {error_log_path}")
-        response = "[LLM ERROR] Sorry, there was a problem generating a response. Please try again later."
+        await interaction.followup.send("[LLM ERROR] Sorry, there was a problem generating a response. Please try again later.")
+        return
     print("Response from LLM: ", response)
-    monday_idx = response.find("Monday:")
-    if monday_idx != -1:
-        plan_text = response[monday_idx:]
-    else:
-        plan_text = response
-    await interaction.followup.send(
-        f"Here is your weekly workout plan for **{goal}**:\n```\n{response}\n```\n\nIf you want to add this plan to your Google Calendar, reply with `/confirmplan` in the next 2 minutes.\n\n**Example prompts for /plan:**\n- strength training\n- yoga\n- 5k run\n- full body\n- weight loss\n- flexibility\n- HIIT\n- upper body\n- lower body\n- muscle gain\n- cardio"
-    )
-    pending_plans[interaction.user.id] = {
-        'plan_text': response,
-        'timestamp': datetime.datetime.utcnow()
-    }
+    # Unmatched goals are stored too, so the next request for this goal is a hit
+    plan_store.add(goal, response)
+    remember_plan(interaction.user.id, response)
 
 @bot.tree.command(name="confirmplan", description="Confirm and add your last generated workout plan to Google Calendar.")
 async def confirmplan(interaction: discord.Interaction):
@@ -244,49 +430,46 @@ async def confirmplan(interaction: discord.Interaction):
     await interaction.response.defer()
     print(f"executing /confirmplan with {interaction.user}")
     user_id = interaction.user.id
-    # Check for pending plan
+    # Check for a pending plan; expired ones (older than 2 minutes) are never returned
     pending = pending_plans.get(user_id)
     if not pending:
-        await interaction.followup.send("❌ No recent workout plan found to confirm. Please use `/plan` first.")
-        return
-    # Check if confirmation is within 2 minutes
-    now = datetime.datetime.utcnow()
-    if (now - pending['timestamp']).total_seconds() > 120:
-        del pending_plans[user_id]
-        await interaction.followup.send("❌ Your workout plan confirmation timed out. Please use `/plan` again.")
+        await interaction.followup.send("❌ No recent workout plan found to confirm (plans can be confirmed for 2 minutes). Please use `/plan` first.")
         return
     plan_text = pending['plan_text']
+    # Structured days from the constrained output; the text parser is only a fallback
+    entries = plan_entries(parse_constrained_plan(plan_text)) or parse_workout_plan(plan_text)
     try:
         # Call the async get_calendar_service function directly
         service = await get_calendar_service(str(user_id), interaction)
-        events = parse_workout_plan(plan_text)
-        today = datetime.date.today()
-        weekday_map = {day: i for i, day in enumerate(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"])}
-        for day, desc in events:
-            if day in weekday_map:
-                days_ahead = (weekday_map[day] - today.weekday() + 7) % 7
-                event_date = today + datetime.timedelta(days=days_ahead)
-                event = {
-                    'summary': f'Workout: {desc}',
-                    'start': {'date': event_date.isoformat()},
-                    'end': {'date': event_date.isoformat()},
-                }
-                service.events().insert(calendarId='primary', body=event).execute()
-        await interaction.followup.send("✅ Added your workout plan to your Google Calendar!")
+        # One batch request, sent from a worker thread; event ids make a retry safe
+        results = await insert_plan_events(service, str(user_id), entries)
     except Exception as e:
         await interaction.followup.send(f"⚠️ Could not add to Google Calendar: {e}\nIf this is your first time, check your Discord DMs for a Google login link.")
-    finally:
-        if user_id in pending_plans:
-            del pending_plans[user_id]
+        return
+    await interaction.followup.send(describe_results(results))
+    # Keep the plan around after a partial failure so /confirmplan can be retried
+    if all(r.status != "failed" for r in results):
+        pending_plans.pop(user_id)
 
 # --- IMPORTANT: Sync slash commands on startup ---
+onboarding_resumed = False
+
 @bot.event
 async def on_ready():
     """
     Event handler for when the bot is ready. Syncs slash commands with Discord.
     """
     await bot.tree.sync()
-    print(f'✅ Bot is online as {bot.user}')
+    startup_report.mark("connect to Discord and sync commands")
+    print(f'✅ Bot is online as {bot.user} (LLM {"ready" if llm_available() else "still loading"})')
+    print(startup_report.summary())
+    # on_ready fires again after reconnects; unfinished onboarding steps only need re-queueing once
+    global onboarding_resumed
+    if not onboarding_resumed:
+        onboarding_resumed = True
+        resumed = await onboarding.resume_pending()
+        if resumed:
+            print(f"[LLM] Resumed {resumed} onboarding sessions")
 
 # Method to prompt a user a question via DM after their first login and wait for their response using the Discord API.
 async def dm_user(user: discord.User | discord.Member, bot: commands.Bot, question: str, timeout: int = 120) -> str | None:
@@ -332,9 +515,7 @@ async def get_to_know_user(member: discord.User | discord.Member, bot: commands.
             await member.send("⏰ You did not respond in time. If you want to answer later, just message me again with /introduceyourself!")
             return
         # add the response to the user's profile in Firestore
-        db.collection("profiles").document(str(member.id)).set(
-            {question: response}, merge=True
-        )
+        store.set_later("profiles", str(member.id), {question: response}, merge=True)
         # Send a confirmation message back to the user
         await member.send(f"Got it! Your answer: '{response}'\n\nNext question...") 
         
@@ -342,116 +523,120 @@ async def get_to_know_user(member: discord.User | discord.Member, bot: commands.
     # After all questions, thank the user and store their goal
     await member.send("Thanks for sharing all that! I'll use this info to help you stay on track and reach your goals. 💪")
 
-# --- Automated LLM-driven onboarding Q&A loop ---
-
-async def llm_onboarding_loop(member: discord.User | discord.Member, bot: commands.Bot):
-    """
-    Automated onboarding: LLM generates each question based on conversation so far, stops when LLM replies 'DONE', then drafts a plan.
-    Stores Q&A in Firestore under 'profiles'.
-    """
-    conversation = []  # List of (Q, A) tuples
-    user_id = str(member.id)
-    max_rounds = 10  # Safety: prevent infinite loops
-    for round_num in range(max_rounds):
-        # Build LLM prompt with conversation so far
-        if conversation:
-            history = "\n".join([f"Q{i+1}: {q}\nA{i+1}: {a}" for i, (q, a) in enumerate(conversation)])
-        else:
-            history = ""
-        onboarding_prompt = (
-            f"[INST] You are onboarding a fitness client. Here is the conversation so far:\n"
-            f"{history}\n"
-            "If you have enough information to draft a personalized weekly workout plan, reply with ONLY 'DONE'. "
-            "Otherwise, reply with the next best question to ask. [/INST]"
-        )
-        # Get next question or 'DONE' from LLM
-        try:
-            with llama_log_redirect("logs/project5k_bot_llm.log"):
-                llm_response = await call_llm_async(onboarding_prompt, max_tokens=128, stop=["</s>"])
-            # Handle LLM response format (dict with 'choices' list)
-            if isinstance(llm_response, dict) and "choices" in llm_response:
-                next_q = llm_response["choices"][0]["text"].strip()
-            else:
-                next_q = str(llm_response).strip()
-        except Exception as e:
-            await member.send("[LLM ERROR] Sorry, there was a problem generating the next question. Please try again later.")
-            return
-        if next_q.strip().upper() == "DONE":
-            break
-        # Ask user the next question via DM
-        answer = await dm_user(member, bot, next_q)
-        if answer is None:
-            await member.send("⏰ You did not respond in time. If you want to answer later, just message me again with /introduceyourself!")
-            return
-        # Store Q&A
-        conversation.append((next_q, answer))
-        db.collection("profiles").document(user_id).set({next_q: answer}, merge=True)
-        await member.send(f"Got it! Your answer: '{answer}'\n\nNext question...")
-    # After loop, draft the plan
-    plan_history = "\n".join([f"Q{i+1}: {q}\nA{i+1}: {a}" for i, (q, a) in enumerate(conversation)])
-    plan_prompt = (
-        f"[INST] You are a fitness coach. Here is the onboarding conversation with a new client:\n"
-        f"{plan_history}\n"
-        "Based on this, draft a safe, personalized 7-day workout plan. "
-        "List only the days and the workout for each day. "
-        "Format exactly as: Monday: ...\\nTuesday: ...\\nWednesday: ...\\nThursday: ...\\nFriday: ...\\nSaturday: ...\\nSunday: ... "
-        "No introduction, no summary, just the plan. [/INST]"
+# --- Automated LLM-driven onboarding Q&A ---
+# OnboardingManager (onboarding.py) drives the sessions; these callbacks do the DMs and the LLM work.
+# At most ONBOARDING_MAX_ACTIVE sessions use the LLM at once, matching the worker count in pool mode.
+ONBOARDING_MAX_ACTIVE = max(2, int(os.getenv("LLM_WORKERS", "0")))
+ONBOARDING_QUESTION_TOKENS = 128
+
+async def send_dm(user_id: str, text: str):
+    user = bot.get_user(int(user_id)) or await bot.fetch_user(int(user_id))
+    await user.send(text)
+
+async def next_onboarding_question(user_id: str, history) -> str:
+    """The LLM's next onboarding question for the conversation so far, or 'DONE'."""
+    # New members can join while the model is still loading; wait for it without blocking the loop
+    if not await wait_for_llm(timeout=600):
+        raise RuntimeError("LLM model failed to load.")
+    # Each round's prompt extends the previous one, so the model continues from this session's
+    # saved state and only evaluates the newest Q/A pair. Long conversations fold their oldest
+    # turns into a summary line to stay within the context.
+    prompt, _ = prompt_budget.fit(
+        lambda folded: f"{ONBOARDING_PREFIX}{transcript(history, folded)}[/INST]", len(history), ONBOARDING_QUESTION_TOKENS
     )
-    try:
-        with llama_log_redirect("logs/project5k_bot_llm.log"):
-            plan_response = await call_llm_async(plan_prompt, max_tokens=768, stop=["<s>"])
-        if isinstance(plan_response, dict) and "choices" in plan_response:
-            plan_text = plan_response["choices"][0]["text"].strip()
-        else:
-            plan_text = str(plan_response).strip()
-    except Exception as e:
-        await member.send("[LLM ERROR] Sorry, there was a problem generating your workout plan. Please try again later.")
-        return
-    monday_idx = plan_text.find("Monday:")
-    if monday_idx != -1:
-        plan_text = plan_text[monday_idx:]
-    await member.send(f"Here is your weekly workout plan!\n```\n{plan_text}\n```")
-    # Optionally, store the plan in Firestore
-    db.collection("profiles").document(user_id).set({"workout_plan": plan_text}, merge=True)
+    llm_response = await call_llm_async(
+        prompt, max_tokens=ONBOARDING_QUESTION_TOKENS, stop=["</s>"],
+        priority=PRIORITY_INTERACTIVE, label="onboarding", session_id=f"onboarding-{user_id}"
+    )
+    return llm_response["choices"][0]["text"].strip()  # type: ignore
+
+async def draft_onboarding_plan(user_id: str, history):
+    """Draft the new member's plan from their answers, DM it and hold it for /confirmplan."""
+    plan_prompt, _ = prompt_budget.fit(
+        lambda folded: (
+            f"{ONBOARDING_PLAN_PREFIX}"
+            f"{transcript(history, folded)}"
+            "Based on this, draft a safe, personalized 7-day workout plan. "
+            f"{PLAN_FORMAT_INSTRUCTIONS} [/INST]"
+        ),
+        len(history), PLAN_MAX_TOKENS
+    )
+    plan_response = await call_llm_async(
+        plan_prompt, max_tokens=PLAN_MAX_TOKENS, stop=["<s>"],
+        priority=PRIORITY_INTERACTIVE, label="onboarding_plan", grammar=PLAN_GRAMMAR,
+        session_id=f"onboarding-{user_id}", end_session=True  # Onboarding is over; drop the saved session state
+    )
+    plan_text = plan_response["choices"][0]["text"].strip()  # type: ignore
+    plan_days = parse_constrained_plan(plan_text)
+    # Same structured records as /plan, so the onboarding plan can go straight to /confirmplan
+    remember_plan(int(user_id), plan_text)
+    await send_dm(
+        user_id,
+        "Thanks for sharing all that! Here is your weekly workout plan!\n```\n" + plan_text + "\n```\n"
+        "If you want to add this plan to your Google Calendar, reply with `/confirmplan` in the next 2 minutes."
+    )
+    store.set_later("profiles", user_id, {
+        "workout_plan": plan_text,
+        "workout_days": [day._asdict() for day in plan_days]
+    }, merge=True)
 
-# --- Refactor onboarding event to be async and use LLM onboarding loop ---
+onboarding = OnboardingManager(
+    store, send_dm, next_onboarding_question, draft_onboarding_plan, max_active=ONBOARDING_MAX_ACTIVE
+)
+
+async def report_onboarding():
+    """Scheduler job: forget long-idle sessions from memory and log the session metrics."""
+    onboarding.prune()
+    stats = onboarding.stats()
+    if stats["active"] or stats["queued"] or stats["awaiting_reply"]:
+        print(f"[LLM] Onboarding sessions: {stats}")
+
+@bot.listen("on_message")
+async def onboarding_reply(message: discord.Message):
+    """DM replies resume the sender's onboarding session, however late they arrive."""
+    if message.author.bot or message.guild is not None:
+        return
+    await onboarding.handle_reply(str(message.author.id), message.content)
 
 @bot.event
 async def on_member_join(member):
     print(f"New member joined: {member.name} ({member.id})")
-    user_doc_ref = db.collection("logs").document(str(member.id))
-    user_doc = user_doc_ref.get()
-    if not hasattr(user_doc, 'exists') or not user_doc.exists:
-        question = ("Hey 👋 — great to meet you! I’m your AI accountability partner. "
-                    "Before we dive in, is it okay if I ask a few quick questions about your health, workout history, and goals (will take 2 mins) so I can build a safe, personalized plan?")
-        response = await dm_user(member, bot, question)
-        if response and response.lower() in ("yes", "sure", "ok", "okay", "y"):
-            await llm_onboarding_loop(member, bot)
-        else:
-            pass  # Optionally log or handle users who don't respond
+    if not await store.exists("logs", str(member.id)):
+        # Asks for consent by DM; the session continues from on_message when they reply
+        await onboarding.begin(str(member.id))
 
 @bot.tree.command(name="introduceyourself", description="Answer a few questions to help me understand your fitness journey.")
 async def introduce_yourself(interaction: discord.Interaction):
     """
-    Slash command to start the LLM-driven onboarding Q&A if the user missed it on join.
+    Slash command to start (or resume) the LLM-driven onboarding Q&A if the user missed it on join.
     """
     await interaction.response.defer()
     print(f"executing /introduceyourself with {interaction.user}")
-    user_doc_ref = db.collection("logs").document(str(interaction.user.id))
-    user_doc = user_doc_ref.get()
-    if not hasattr(user_doc, 'exists') or not user_doc.exists:
-        await llm_onboarding_loop(interaction.user, bot)
-        await interaction.followup.send("Thanks for answering! I'll use this info to help you stay on track and reach your goals. 💪")
+    if not await store.exists("logs", str(interaction.user.id)):
+        await onboarding.begin(str(interaction.user.id), consented=True)
+        await interaction.followup.send("📬 Check your DMs — I'll ask you a few questions there to help you stay on track and reach your goals. 💪")
     else:
         await interaction.followup.send("You have already answered these questions. If you want to update your profile, please contact support.")
 
 # Main async function to start the scheduler and bot
 async def main():
-    scheduler.add_job(lambda: check_streaks(bot), 'cron', hour=7)
+    # Load and warm up the model in the background; Discord connects right away
+    start_llm_loading()
+    scheduler.add_job(check_streaks, 'cron', hour=7, args=[bot])
+    scheduler.add_job(refill_motivation_pool, 'interval', seconds=MOTIVATION_REFILL_SECONDS, max_instances=1, coalesce=True)
+    scheduler.add_job(pending_plans.sweep, 'interval', seconds=30, max_instances=1, coalesce=True)
+    scheduler.add_job(precompute_plans, 'interval', seconds=PLAN_PRECOMPUTE_SECONDS, max_instances=1, coalesce=True)
+    scheduler.add_job(report_onboarding, 'interval', minutes=10, max_instances=1, coalesce=True)
+    scheduler.add_job(calendar_services.refresh_expiring, 'interval', minutes=5, max_instances=1, coalesce=True)
     scheduler.start()
 
     # Start the Discord bot
-    await bot.start(TOKEN)  # type: ignore
+    try:
+        await bot.start(TOKEN)  # type: ignore
+    finally:
+        # Commit any buffered Firestore writes before exiting
+        await write_buffer.close()
+        await close_http_session()
 
 # Entry point: run the main() coroutine using asyncio
 if __name__ == "__main__":
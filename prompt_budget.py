@@ -0,0 +1,90 @@
+"""
+Token budgets for prompts in the model's 1024-token context.
+
+Every prompt is counted with the model's own tokenizer before it is queued.
+max_tokens is clamped to what is left of the context after the prompt, so
+the old 2000/20000-token defaults can't ask for more than the model can
+produce. A prompt that doesn't leave room for a useful answer is refused
+with PromptTooLong before it ever reaches the model. Multi-turn prompts
+(onboarding) are fitted with fit(), which folds the oldest turns into a
+short summary until the prompt fits.
+
+In worker-pool mode the bot process has no model loaded, so it counts with a
+vocab-only copy of the GGUF (see utils.load_llm). Until a tokenizer is set,
+counts are a conservative estimate from the UTF-8 length.
+"""
+from prefix_cache import tokenize
+
+N_CTX = 1024  # Context size the model is created with
+MIN_OUTPUT_TOKENS = 32  # Smallest completion worth running
+BYTES_PER_TOKEN_ESTIMATE = 3  # Used before the tokenizer is available; real prompts average closer to 4
+
+
+class PromptTooLong(Exception):
+    """The prompt leaves too little of the context for the answer."""
+
+    def __init__(self, tokens: int, limit: int):
+        super().__init__(f"Prompt is {tokens} tokens; at most {limit} fit with room for an answer")
+        self.tokens = tokens
+        self.limit = limit
+
+
+class PromptBudget:
+    """Counts prompt tokens and fits prompts and completions into n_ctx."""
+
+    def __init__(self, n_ctx=N_CTX, tokenizer=None, min_output=MIN_OUTPUT_TOKENS):
+        self.n_ctx = n_ctx
+        self.min_output = min_output
+        self.tokenizer = tokenizer  # Anything with Llama.tokenize
+        self.clamped = 0
+        self.refused = 0
+
+    def set_tokenizer(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        """Tokens the model will evaluate for this prompt (including BOS)."""
+        if self.tokenizer is None:
+            return len(text.encode("utf-8")) // BYTES_PER_TOKEN_ESTIMATE + 1
+        return len(tokenize(self.tokenizer, text))
+
+    def check(self, prompt: str, min_output: int | None = None) -> int:
+        """Tokens left for the completion; raises PromptTooLong if fewer than min_output."""
+        min_output = self.min_output if min_output is None else min_output
+        tokens = self.count(prompt)
+        available = self.n_ctx - tokens
+        if available < min_output:
+            self.refused += 1
+            raise PromptTooLong(tokens, self.n_ctx - min_output)
+        return available
+
+    def max_tokens(self, prompt: str, requested: int | None = None, min_output: int | None = None) -> int:
+        """`requested` (or everything left, if None) clamped to the context left after the prompt."""
+        available = self.check(prompt, min_output)
+        if requested is None:
+            return available
+        if requested > available:
+            self.clamped += 1
+            return available
+        return requested
+
+    def fit(self, render, turns: int, reserve: int, step: int = 4):
+        """
+        Smallest number of folded turns that makes render(folded) leave `reserve` tokens for the answer.
+        render(n) builds the prompt with the n oldest turns replaced by a summary. Folding happens `step`
+        turns at a time, so the prompt text stays stable (and session states reusable) between folds.
+        Returns (prompt, folded); raises PromptTooLong if even folding every turn is not enough.
+        """
+        folded = 0
+        while True:
+            prompt = render(folded)
+            tokens = self.count(prompt)
+            if tokens + reserve <= self.n_ctx:
+                return prompt, folded
+            if folded >= turns:
+                self.refused += 1
+                raise PromptTooLong(tokens, self.n_ctx - reserve)
+            folded = min(turns, folded + step)
+
+    def stats(self):
+        return {"clamped": self.clamped, "refused": self.refused}
@@ -0,0 +1,158 @@
+"""
+Persistent response cache for LLM answers.
+
+Entries are keyed on a normalized prompt (case, whitespace and punctuation
+folded) plus the generation parameters, and each key holds a few answer
+variants that are served in rotation. Variants expire after a TTL, keys are
+evicted least-recently-used once the in-memory size cap is reached, and
+everything is written through to a local SQLite file so the cache survives
+restarts.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_store import open_sqlite
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, punctuation and whitespace so close variants share a key."""
+    prompt = _PUNCTUATION.sub(" ", prompt.lower())
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(prompt: str, **params) -> str:
+    """Stable key for a prompt and the generation parameters used to answer it."""
+    raw = json.dumps([normalize_prompt(prompt), params], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of generated responses with several variants per key.
+    Safe to use from the event loop; disk writes are small local SQLite upserts.
+    """
+
+    def __init__(self, path="cache/ask_responses.sqlite3", ttl=7 * 24 * 3600, max_variants=3, max_bytes=2 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> {"variants": [(text, created_at)], "next": int}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = open_sqlite(
+            path,
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (key, text))"
+        )
+        self._load()
+
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        with self._db:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+        rows = self._db.execute(
+            "SELECT key, text, created_at, MAX(last_access) OVER (PARTITION BY key) AS key_access"
+            " FROM responses ORDER BY key_access, created_at"
+        ).fetchall()
+        for key, text, created_at, _ in rows:
+            entry = self._entries.setdefault(key, {"variants": [], "next": 0})
+            entry["variants"].append((text, created_at))
+            self._bytes += len(text.encode("utf-8"))
+        self._evict()
+
+    def _size(self, entry):
+        return sum(len(text.encode("utf-8")) for text, _ in entry["variants"])
+
+    def _expire(self, key, entry, now):
+        fresh = [(text, created) for text, created in entry["variants"] if now - created <= self.ttl]
+        if len(fresh) != len(entry["variants"]):
+            self._bytes -= self._size(entry)
+            entry["variants"] = fresh
+            self._bytes += self._size(entry)
+            with self._db:
+                self._db.execute("DELETE FROM responses WHERE key = ? AND created_at < ?", (key, now - self.ttl))
+
+    def _evict(self):
+        """Drop least-recently-used keys until the cache fits in max_bytes."""
+        while self._bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= self._size(entry)
+            with self._db:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def get(self, prompt: str, **params):
+        """Return a cached variant for the prompt (rotating between variants), or None on a miss."""
+        key = cache_key(prompt, **params)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._expire(key, entry, now)
+                if not entry["variants"]:
+                    del self._entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            text, _ = entry["variants"][entry["next"] % len(entry["variants"])]
+            entry["next"] += 1
+            with self._db:
+                self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return text
+
+    def needs_variant(self, prompt: str, **params) -> bool:
+        """True when the key has fewer than max_variants cached answers."""
+        entry = self._entries.get(cache_key(prompt, **params))
+        return entry is None or len(entry["variants"]) < self.max_variants
+
+    def put(self, prompt: str, text: str, **params):
+        """Store a generated answer as a new variant for the prompt."""
+        text = text.strip()
+        if not text:
+            return
+        key = cache_key(prompt, **params)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.setdefault(key, {"variants": [], "next": 0})
+            self._entries.move_to_end(key)
+            if any(existing == text for existing, _ in entry["variants"]):
+                return
+            self._bytes -= self._size(entry)
+            entry["variants"].append((text, now))
+            dropped = entry["variants"][:-self.max_variants]
+            entry["variants"] = entry["variants"][-self.max_variants:]
+            self._bytes += self._size(entry)
+            with self._db:
+                for old_text, _ in dropped:
+                    self._db.execute("DELETE FROM responses WHERE key = ? AND text = ?", (key, old_text))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, text, created_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, text, now, now)
+                )
+            self._evict()
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "keys": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def close(self):
+        self._db.close()
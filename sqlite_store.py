@@ -0,0 +1,24 @@
+"""
+Shared setup for the bot's local SQLite files (response cache, plan store,
+pending confirmations, Google tokens).
+
+Every store opens its file the same way: the parent directory is created,
+the connection may be used from any thread (each store guards it with its own
+lock or only uses it from the event loop), the journal is in WAL mode so
+readers never block the writer, and the store's tables and indexes are
+created if they don't exist yet.
+"""
+import os
+import sqlite3
+
+
+def open_sqlite(path: str, *schema: str) -> sqlite3.Connection:
+    """Open a WAL-mode SQLite file, creating its directory and running the CREATE ... IF NOT EXISTS statements."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    for statement in schema:
+        db.execute(statement)
+    db.commit()
+    return db
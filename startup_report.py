@@ -0,0 +1,51 @@
+"""
+Startup-time report.
+
+Import this module first so its clock starts with the process. Foreground
+steps (imports, client setup, connecting to Discord) are recorded with
+mark(), background work (model load, warm-up) with phase(background=True),
+and summary() prints where the seconds went.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last_mark = self.started
+        self._lock = threading.Lock()
+        self.phases = []  # (name, seconds, background)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark(self, name: str):
+        """Record the foreground time since the previous mark under `name`."""
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append((name, now - self._last_mark, False))
+            self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str, background: bool = False):
+        """Time a block of work, e.g. the model load on its background thread."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - start, background))
+
+    def summary(self) -> str:
+        with self._lock:
+            phases = list(self.phases)
+        lines = [f"⏱️ Startup report ({self.elapsed():.2f}s since process start)"]
+        for name, seconds, background in phases:
+            where = "background" if background else "foreground"
+            lines.append(f"   {name:<40} {seconds:>7.2f}s  ({where})")
+        return "\n".join(lines)
+
+
+startup_report = StartupReport()
@@ -0,0 +1,106 @@
+"""
+Materialized workout streaks.
+
+Each user has a compact record in the `streaks` collection:
+    {"current": int, "last_date": "YYYY-MM-DD", "best": int}
+It is advanced at write time by /log, so the daily streak job only has to
+query users with an active streak instead of scanning every log document.
+
+The daily query filters on `last_date` (in) and `current` (>=), which needs a
+composite Firestore index on streaks(last_date ASC, current ASC).
+
+Run `python streaks.py backfill` to rebuild every record from the month-sharded
+workout logs (see log_store.py).
+"""
+import datetime
+import sys
+
+STREAKS_COLLECTION = "streaks"
+MIN_NOTIFY_STREAK = 3
+
+
+def advance_streak(record: dict, day: datetime.date) -> dict:
+    """Return the streak record after a workout logged on `day`."""
+    current = record.get("current", 0)
+    best = record.get("best", 0)
+    last_date = record.get("last_date")
+    if last_date is not None:
+        last = datetime.date.fromisoformat(last_date)
+        if last >= day:
+            # Already counted today (or a backdated log); nothing changes
+            return {"current": current, "last_date": last_date, "best": best}
+        if last == day - datetime.timedelta(days=1):
+            current += 1
+        else:
+            current = 1
+    else:
+        current = 1
+    return {"current": current, "last_date": day.isoformat(), "best": max(best, current)}
+
+
+def streak_from_dates(dates) -> dict:
+    """Build a streak record from an iterable of ISO dates (used by the backfill)."""
+    record = {}
+    for day in sorted({datetime.date.fromisoformat(d) for d in dates}):
+        record = advance_streak(record, day)
+    return record
+
+
+async def update_streak_on_log(db, uid: str, day: datetime.date) -> dict:
+    """Atomically advance a user's streak record for a workout logged on `day` (db is a Firestore AsyncClient)."""
+    from firebase_admin import firestore
+    ref = db.collection(STREAKS_COLLECTION).document(uid)
+
+    @firestore.async_transactional
+    async def update(transaction):
+        snapshot = await ref.get(transaction=transaction)
+        record = advance_streak((snapshot.to_dict() or {}) if snapshot.exists else {}, day)
+        transaction.set(ref, record)
+        return record
+
+    return await update(db.transaction())
+
+
+def active_streaks_query(db, today: datetime.date, minimum: int = MIN_NOTIFY_STREAK):
+    """
+    Query for users whose streak is at least `minimum` and still alive,
+    i.e. they logged yesterday (or already today). Works with the sync and the async client.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+    yesterday = today - datetime.timedelta(days=1)
+    return (
+        db.collection(STREAKS_COLLECTION)
+        .where(filter=FieldFilter("last_date", "in", [yesterday.isoformat(), today.isoformat()]))
+        .where(filter=FieldFilter("current", ">=", minimum))
+    )
+
+
+def backfill_streaks(db, batch_size: int = 400) -> int:
+    """Rebuild every streak record from the month-sharded logs. Returns the number of users written."""
+    from log_store import iter_user_log_dates
+    batch = db.batch()
+    pending = 0
+    written = 0
+    for uid, dates in iter_user_log_dates(db):
+        record = streak_from_dates(dates)
+        if not record:
+            continue
+        batch.set(db.collection(STREAKS_COLLECTION).document(uid), record)
+        pending += 1
+        written += 1
+        if pending >= batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return written
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python streaks.py backfill")
+        sys.exit(1)
+    from data_access import db
+    count = backfill_streaks(db)
+    print(f"✅ Rebuilt streak records for {count} users")
@@ -0,0 +1,177 @@
+"""
+SQLite-backed store for users' Google Calendar credentials.
+
+One WAL-mode database replaces the per-user token_{user_id}.pickle files.
+Each row holds the credentials as JSON (Credentials.to_json, no pickling),
+their access-token expiry and when they were last used; an index on expiry
+lets the background refresh sweep find tokens that are about to expire
+among recently active users. Saves are single-statement upserts, and
+recently used credentials are kept in an in-memory hot cache.
+
+Run `python token_store.py import [directory]` to import existing pickle files.
+"""
+import calendar
+import datetime
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_store import open_sqlite
+
+TOKEN_DB_PATH = "cache/google_tokens.sqlite3"
+ACTIVE_WINDOW = 7 * 24 * 3600  # Only users seen this recently are refreshed in the background
+
+
+def _expiry_timestamp(creds):
+    expiry = getattr(creds, "expiry", None)
+    # google-auth stores expiry as a naive UTC datetime
+    return calendar.timegm(expiry.timetuple()) if expiry is not None else None
+
+
+def _from_json(token_json: str):
+    # Built field by field: from_authorized_user_info rejects tokens without a refresh token
+    from google.oauth2.credentials import Credentials
+    info = json.loads(token_json)
+    expiry = info.get("expiry")
+    return Credentials(
+        token=info.get("token"),
+        refresh_token=info.get("refresh_token"),
+        token_uri=info.get("token_uri"),
+        client_id=info.get("client_id"),
+        client_secret=info.get("client_secret"),
+        scopes=info.get("scopes"),
+        expiry=datetime.datetime.fromisoformat(expiry.rstrip("Z")) if expiry else None
+    )
+
+
+class TokenStore:
+    """Credentials per user in SQLite, with an LRU hot cache. Safe to call from worker threads."""
+
+    def __init__(self, path=TOKEN_DB_PATH, hot_size=500, serialize=None, deserialize=None):
+        self.path = path
+        self.hot_size = hot_size
+        self._serialize = serialize or (lambda creds: creds.to_json())
+        self._deserialize = deserialize or _from_json
+        self._hot = OrderedDict()  # user_id -> Credentials
+        self._lock = threading.Lock()
+        self._db = open_sqlite(
+            path,
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            " user_id TEXT PRIMARY KEY, token_json TEXT NOT NULL, expiry REAL,"
+            " updated_at REAL NOT NULL, last_used REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS tokens_expiry ON tokens (expiry)"
+        )
+
+    def _remember(self, user_id: str, creds):
+        self._hot[user_id] = creds
+        self._hot.move_to_end(user_id)
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def load(self, user_id: str, touch: bool = True):
+        """
+        The user's credentials, or None. Marks the user as active unless touch=False
+        (background jobs must not keep idle users inside the active window).
+        """
+        user_id = str(user_id)
+        now = time.time()
+        with self._lock:
+            creds = self._hot.get(user_id)
+            if creds is not None:
+                self._hot.move_to_end(user_id)
+            else:
+                row = self._db.execute("SELECT token_json FROM tokens WHERE user_id = ?", (user_id,)).fetchone()
+                if row is None:
+                    return None
+                creds = self._deserialize(row[0])
+                self._remember(user_id, creds)
+            if touch:
+                with self._db:
+                    self._db.execute("UPDATE tokens SET last_used = ? WHERE user_id = ?", (now, user_id))
+            return creds
+
+    def save(self, user_id: str, creds, last_used: float | None = None, touch: bool = True):
+        """
+        Insert or replace the user's credentials in one atomic upsert.
+        With touch=False an existing row keeps its last_used (e.g. after a background refresh).
+        """
+        user_id = str(user_id)
+        now = time.time()
+        last_used_update = "excluded.last_used" if touch else "tokens.last_used"
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO tokens (user_id, token_json, expiry, updated_at, last_used) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT(user_id) DO UPDATE SET token_json = excluded.token_json,"
+                    " expiry = excluded.expiry, updated_at = excluded.updated_at,"
+                    f" last_used = {last_used_update}",
+                    (user_id, self._serialize(creds), _expiry_timestamp(creds), now, last_used or now)
+                )
+            self._remember(user_id, creds)
+
+    def touch(self, user_id: str):
+        """Mark the user as active without loading their credentials."""
+        with self._lock:
+            with self._db:
+                self._db.execute("UPDATE tokens SET last_used = ? WHERE user_id = ?", (time.time(), str(user_id)))
+
+    def last_used(self, user_id: str):
+        with self._lock:
+            row = self._db.execute("SELECT last_used FROM tokens WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row is not None else None
+
+    def delete(self, user_id: str):
+        user_id = str(user_id)
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM tokens WHERE user_id = ?", (user_id,))
+            self._hot.pop(user_id, None)
+
+    def expiring(self, within: float, active_window: float = ACTIVE_WINDOW):
+        """User ids whose access token expires within `within` seconds and who used the bot recently."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT user_id FROM tokens WHERE expiry < ? AND last_used > ? ORDER BY expiry",
+                (now + within, now - active_window)
+            ).fetchall()
+        return [user_id for (user_id,) in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+
+    def import_pickles(self, directory: str = ".") -> int:
+        """Import token_{user_id}.pickle files. Returns the number imported; the files are left in place."""
+        import pickle
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(directory, "token_*.pickle"))):
+            match = re.fullmatch(r"token_(.+)\.pickle", os.path.basename(path))
+            try:
+                with open(path, "rb") as f:
+                    creds = pickle.load(f)
+            except Exception as e:
+                print(f"⚠️ Skipping {path}: {e}")
+                continue
+            # The file's mtime stands in for the last use, so long-idle users aren't swept as active
+            self.save(match.group(1), creds, last_used=os.path.getmtime(path))
+            imported += 1
+        return imported
+
+    def close(self):
+        self._db.close()
+
+
+if __name__ == "__main__":
+    if not sys.argv[1:] or sys.argv[1] != "import" or len(sys.argv) > 3:
+        print("Usage: python token_store.py import [directory]")
+        sys.exit(1)
+    store = TokenStore()
+    count = store.import_pickles(sys.argv[2] if len(sys.argv) == 3 else ".")
+    print(f"✅ Imported {count} Google tokens into {store.path} ({store.count()} stored); "
+          f"the token_*.pickle files can be deleted once the bot works with the new store")
@@ -1,84 +1,219 @@
 import os
 import datetime
-import pickle
-import re
-import requests
 import asyncio
-import firebase_admin
-from firebase_admin import credentials, firestore
+import threading
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import discord
-from discord.ext import commands
-from llama_cpp import Llama
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from llama_log_redirect import llama_log_redirect
+from llama_log_redirect import install_llama_logging
+from startup_report import startup_report
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE
+from prefix_cache import PrefixStateCache, PrefixCachedModel
+from llm_sessions import SessionStateCache
+from prompt_budget import PromptBudget, N_CTX
+from llm_worker_pool import LLMWorkerPool
+from dm_fanout import DMFanout
+from data_access import store
+from calendar_services import CalendarServiceRegistry
+from google_oauth import DeviceFlows
+from token_store import ACTIVE_WINDOW, TokenStore
 
 # Set your local model path here (Phi-3 Mini, optimized for Apple Silicon or CPU)
 MODEL_PATH = "./phi-2.Q4_K_M.gguf"
 
-# Initialize the model only once (use caching if needed)
+# Fixed prompt prefixes. Their KV state is evaluated once after the model loads
+# and restored before each request, so only the user-specific suffix is evaluated.
+# Prefixes must not end in a space: the tokenizer merges a space into the word after
+# it, so the prefix's last token would never match the full prompt's tokens.
+COACH_PREFIX = "[INST] You are a friendly, supportive fitness coach."
+PLAN_PREFIX = f"<s>{COACH_PREFIX} Create a 7-day workout plan for the goal:"
+MOTIVATION_PREFIX = f"<s>{COACH_PREFIX}\nThe user just completed a workout of"
+# Onboarding prompts end with the conversation so it only grows at the end between rounds,
+# which lets each round continue from the previous round's saved session state
+ONBOARDING_PREFIX = (
+    "[INST] You are onboarding a fitness client. If you have enough information to draft a personalized "
+    "weekly workout plan, reply with ONLY 'DONE'. Otherwise, reply with the next best question to ask. "
+    "Here is the conversation so far:\n"
+)
+ONBOARDING_PLAN_PREFIX = "[INST] You are a fitness coach. Here is the onboarding conversation with a new client:\n"
+prefix_cache = PrefixStateCache([
+    COACH_PREFIX,
+    PLAN_PREFIX,
+    MOTIVATION_PREFIX,
+    ONBOARDING_PREFIX,
+    ONBOARDING_PLAN_PREFIX,
+])
+
+# Opt-in worker-pool mode: LLM_WORKERS=N serves generations from N model processes
+# that share one memory-mapped GGUF, each pinned to its own slice of cores.
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "0"))
+llm_pool = None
+
+# The model loads in the background (see start_llm_loading) so the bot can connect to Discord immediately
 llm = None
-try:
-    with llama_log_redirect("logs/utils_llm.log"):
-        llm = Llama(
-            model_path=MODEL_PATH,
-            n_ctx=1024,  # Balanced context size for Phi-3 Mini
-            n_threads=os.cpu_count() or 8,
-            use_mlock=True,
-            backend="cpu"  # Use "cpu" if you have issues with Metal
-        )
-except Exception as e:
-    import traceback
-    error_log_path = "logs/utils_llm_error.log"
-    with open(error_log_path, "a") as f:
-        f.write(f"\n[ERROR] {datetime.datetime.now()}\n")
-        f.write(f"Exception: {e}\n")
-        f.write(traceback.format_exc())
-        f.write("\n---\n")
-    print(f"[LLM ERROR] Exception occurred during model load. Details written to {error_log_path}")
-    llm = None
+cached_llm = None
+llm_status = "not_loaded"  # "loading", "ready" or "failed"
+llm_loaded = threading.Event()  # Set once loading has finished, successfully or not
+LLM_WARMING_UP_MESSAGE = "⏳ I'm still warming up my coaching brain — please try again in a minute!"
+_llm_loader = None
+
+# Single owner of the model: every generation goes through this scheduler
+llm_scheduler = LLMScheduler(lambda: cached_llm)
+# Prompts are counted against the context window before they are queued (tokenizer set in load_llm)
+prompt_budget = PromptBudget(N_CTX)
+
+def start_llm_worker_pool():
+    """
+    Start the model worker processes when LLM_WORKERS is set.
+    Must be called from the bot's entry point (or the loader thread), not at import
+    time, so importing utils (e.g. from the tests) never starts processes.
+    """
+    global llm_pool
+    if LLM_WORKERS <= 0 or llm_pool is not None:
+        return
+    llm_pool = LLMWorkerPool(
+        MODEL_PATH,
+        LLM_WORKERS,
+        model_kwargs={"n_ctx": N_CTX},
+        prefixes=prefix_cache.prefixes
+    )
+    llm_scheduler.set_model_owners(llm_pool.model_getters())
+
+def load_llm():
+    """
+    Load the model (or start the worker pool) and warm the shared prompt prefixes.
+    Blocks until done; the bot runs this on a background thread via start_llm_loading().
+    Whatever happens, llm_loaded is set when it returns, so waiters are always released.
+    """
+    global llm_status
+    if llm_loaded.is_set():
+        return
+    llm_status = "loading"
+    try:
+        if LLM_WORKERS > 0:
+            _start_worker_pool()
+        else:
+            _load_local_llm()
+    except Exception as e:
+        print(f"[LLM ERROR] Unexpected error while loading the model: {e}")
+    finally:
+        if llm_status != "ready":
+            llm_status = "failed"
+        llm_loaded.set()
+
+def _start_worker_pool():
+    global llm_status
+    try:
+        with startup_report.phase(f"LLM worker pool ({LLM_WORKERS} workers)", background=True):
+            start_llm_worker_pool()
+            llm_pool.wait_ready()
+        llm_status = "ready"
+    except Exception as e:
+        print(f"[LLM ERROR] LLM worker pool failed to start: {e}")
+        llm_status = "failed"
+    try:
+        from llama_cpp import Llama
+        # Only the vocabulary, for counting prompt tokens in this process; the workers hold the weights
+        prompt_budget.set_tokenizer(Llama(model_path=MODEL_PATH, vocab_only=True, verbose=False))
+    except Exception as e:
+        print(f"[LLM ERROR] Could not load the tokenizer, estimating prompt sizes instead: {e}")
+
+def _load_local_llm():
+    global llm, cached_llm, llm_status
+    try:
+        from llama_cpp import Llama  # Imported lazily: loading the native library takes a while
+        # llama.cpp logs go to logs/llama.log through a background writer, never via sys.stdout/stderr
+        install_llama_logging()
+        with startup_report.phase("LLM model load", background=True):
+            llm = Llama(
+                model_path=MODEL_PATH,
+                n_ctx=N_CTX,  # Balanced context size for Phi-3 Mini
+                n_threads=os.cpu_count() or 8,
+                use_mlock=True,
+                backend="cpu"  # Use "cpu" if you have issues with Metal
+            )
+    except Exception as e:
+        import traceback
+        error_log_path = "logs/utils_llm_error.log"
+        # install_llama_logging() may not have run (e.g. llama_cpp failed to import), so logs/ may not exist
+        os.makedirs(os.path.dirname(error_log_path), exist_ok=True)
+        with open(error_log_path, "a") as f:
+            f.write(f"\n[ERROR] {datetime.datetime.now()}\n")
+            f.write(f"Exception: {e}\n")
+            f.write(traceback.format_exc())
+            f.write("\n---\n")
+        print(f"[LLM ERROR] Exception occurred during model load. Details written to {error_log_path}")
+        llm = None
+        llm_status = "failed"
+        return
+    prompt_budget.set_tokenizer(llm)
+    # Evaluate the shared prompt prefixes once; requests then start from these snapshots
+    try:
+        with startup_report.phase("LLM prefix warm-up", background=True):
+            prefix_cache.warm(llm)
+        # Multi-round onboarding continues from its own saved state (see llm_sessions.py)
+        cached_llm = PrefixCachedModel(llm, prefix_cache, sessions=SessionStateCache())
+    except Exception as e:
+        print(f"[LLM ERROR] Could not warm prompt prefix cache, continuing without it: {e}")
+        # Still wrapped so callers can pass session_id; without a session cache it is ignored
+        cached_llm = PrefixCachedModel(llm, PrefixStateCache([]))
+    llm_status = "ready"
+    print(f"✅ LLM ready {startup_report.elapsed():.2f}s after startup")
+
+def start_llm_loading():
+    """Load the model on a background thread. Safe to call more than once."""
+    global _llm_loader
+    if _llm_loader is None:
+        _llm_loader = threading.Thread(target=load_llm, name="llm-loader", daemon=True)
+        _llm_loader.start()
+
+def llm_available() -> bool:
+    """True when generations can be served, in-process or by the worker pool."""
+    return llm_status == "ready"
+
+async def wait_for_llm(timeout=None) -> bool:
+    """Wait (without blocking the event loop) until loading finishes; True if the model is usable."""
+    start_llm_loading()
+    await asyncio.to_thread(llm_loaded.wait, timeout)
+    return llm_available()
 
 SCOPES = ["https://www.googleapis.com/auth/calendar.events"]
 GOOGLE_CREDENTIALS_FILE = "./google_api_credentials.json"
 
-# Firebase and Firestore initialization
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
 # Scheduler initialization (for streaks)
 scheduler = AsyncIOScheduler()
 
-async def get_calendar_service(user_id: str, interaction=None):
-    creds = None
-    token_file = f"token_{user_id}.pickle"
-    if os.path.exists(token_file):
-        with open(token_file, "rb") as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        from google.oauth2.credentials import Credentials
+# Google credentials live in one SQLite store (see token_store.py for importing old token_*.pickle files)
+token_store = TokenStore()
+# Built Calendar clients are cached per user and their tokens refreshed before they expire
+calendar_services = CalendarServiceRegistry(
+    token_store.load, token_store.save, list_expiring=token_store.expiring,
+    # The refresh sweep must not count as activity, or nobody would ever leave the active window
+    peek_credentials=lambda user_id: token_store.load(user_id, touch=False),
+    save_refreshed=lambda user_id, creds: token_store.save(user_id, creds, touch=False),
+    mark_used=token_store.touch, active_window=ACTIVE_WINDOW
+)
+
+_device_flows = None
+
+
+def get_device_flows():
+    """Device-flow runner for the OAuth client in GOOGLE_CREDENTIALS_FILE (read on first use)."""
+    global _device_flows
+    if _device_flows is None:
         import json
-        device_auth_url = "https://oauth2.googleapis.com/device/code"
-        token_url = "https://oauth2.googleapis.com/token"
         with open(GOOGLE_CREDENTIALS_FILE, "r") as f:
             client_info = json.load(f)["installed"]
-        client_id = client_info["client_id"]
-        client_secret = client_info["client_secret"]
-        data = {
-            "client_id": client_id,
-            "scope": " ".join(SCOPES)
-        }
-        r = requests.post(device_auth_url, data=data)
-        resp = r.json()
-        if "verification_url" not in resp:
-            raise Exception(f"Google OAuth device flow error: {resp}")
-        verification_url = resp["verification_url"]
-        user_code = resp["user_code"]
-        device_code = resp["device_code"]
-        expires_in = resp["expires_in"]
-        interval = resp.get("interval", 5)
+        _device_flows = DeviceFlows(client_info["client_id"], client_info["client_secret"], SCOPES)
+    return _device_flows
+
+
+async def get_calendar_service(user_id: str, interaction=None):
+    service = await calendar_services.get(user_id)
+    if service is not None:
+        return service
+    # No stored token, or one that can't be refreshed: run the device flow
+    flows = get_device_flows()
+
+    async def notify(verification_url, user_code, expires_in):
         if interaction:
             await interaction.user.send(
                 f"🔗 **Google Calendar Authentication Required**\n\n"
@@ -90,54 +225,34 @@ async def get_calendar_service(user_id: str, interaction=None):
             )
         else:
             print(f"Go to {verification_url} and enter code: {user_code}")
-        start_time = asyncio.get_event_loop().time()
-        while True:
-            await asyncio.sleep(interval)
-            data = {
-                "client_id": client_id,
-                "client_secret": client_secret,
-                "device_code": device_code,
-                "grant_type": "urn:ietf:params:oauth:grant-type:device_code"
-            }
-            token_resp = requests.post(token_url, data=data).json()
-            if "access_token" in token_resp:
-                creds = Credentials(
-                    token=token_resp["access_token"],
-                    refresh_token=token_resp.get("refresh_token"),
-                    token_uri=token_url,
-                    client_id=client_id,
-                    client_secret=client_secret,
-                    scopes=SCOPES
-                )
-                with open(token_file, "wb") as token:
-                    pickle.dump(creds, token)
-                break
-            elif token_resp.get("error") == "authorization_pending":
-                if asyncio.get_event_loop().time() - start_time > expires_in:
-                    raise Exception("Device code expired. Please try again.")
-                continue
-            else:
-                raise Exception(f"Google OAuth error: {token_resp}")
-    service = build("calendar", "v3", credentials=creds)
-    return service
-
-def parse_workout_plan(plan_text: str):
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    events = []
-    day_pattern = r"(" + "|".join(days) + "):(.*?)(?=(?:" + "|".join(days) + "):(?!\\S)|$)"
-    matches = re.findall(day_pattern, plan_text, re.DOTALL)
-    for day, content in matches:
-        workout = content.strip()
-        events.append((day, workout))
-    return events
-
-def get_llm_response(prompt, max_tokens=2000, stop=None):
+
+    async def on_token(token_resp):
+        # Google client libraries are heavy to import, so load them on first use
+        from google.oauth2.credentials import Credentials
+        creds = Credentials(
+            token=token_resp["access_token"],
+            refresh_token=token_resp.get("refresh_token"),
+            expiry=datetime.datetime.utcnow() + datetime.timedelta(seconds=token_resp.get("expires_in", 3600)),
+            token_uri=flows.token_url,
+            client_id=flows.client_id,
+            client_secret=flows.client_secret,
+            scopes=SCOPES
+        )
+        return await calendar_services.register(user_id, creds)
+
+    flow = await flows.start(user_id, notify, on_token)
+    # Shielded: if this handler is cancelled, the flow still finishes and stores the token
+    return await asyncio.shield(flow)
+
+def get_llm_response(prompt, max_tokens=None, stop=None, priority=PRIORITY_INTERACTIVE, label="motivation"):
     """
     Helper to get LLM response and handle both streaming and non-streaming outputs.
+    Runs on the scheduler's model thread and blocks until the response is ready.
+    max_tokens is clamped to the context left after the prompt (None: all of it).
     Adds extra logging to catch silent errors.
     """
     import traceback
-    if llm is None:
+    if not llm_available():
         error_log_path = "logs/utils_llm_error.log"
         with open(error_log_path, "a") as f:
             f.write(f"\n[ERROR] {datetime.datetime.now()}\n")
@@ -147,12 +262,16 @@ def get_llm_response(prompt, max_tokens=2000, stop=None):
         print(f"[LLM ERROR] LLM model is not loaded. Details written to {error_log_path}")
         return "[LLM ERROR] Sorry, the language model is not available. Please try again later."
     try:
-        with llama_log_redirect("logs/utils_llm.log"):
-            response = llm(
+        max_tokens = prompt_budget.max_tokens(prompt, max_tokens)
+        response = llm_scheduler.run_sync(
+            lambda model: model(
                 prompt,
                 max_tokens=max_tokens,
                 stop=stop or ["</s>"]
-            )
+            ),
+            priority=priority,
+            label=label
+        )
         # If response is a generator/iterator, get the first item
         if hasattr(response, '__iter__') and not isinstance(response, dict):
             response = next(iter(response))
@@ -170,28 +289,47 @@ def get_llm_response(prompt, max_tokens=2000, stop=None):
 
 # Update get_motivation to use get_llm_response
 
+def motivation_prompt(user_log_minutes: int) -> str:
+    return f"""{MOTIVATION_PREFIX} {user_log_minutes} minutes.\nGive them a short, energetic motivational message. [/INST]"""
+
 def get_motivation(user_log_minutes: int) -> str:
-    prompt = f"""<s>[INST] You are a friendly, supportive fitness coach.\nThe user just completed a workout of {user_log_minutes} minutes.\nGive them a short, energetic motivational message. [/INST]"""
-    return get_llm_response(prompt)
+    return get_llm_response(motivation_prompt(user_log_minutes))
+
+async def generate_motivation(user_log_minutes: int, priority=PRIORITY_INTERACTIVE) -> str:
+    """
+    Generates a motivational message on the LLM scheduler without blocking the event loop.
+    Raises on failure so callers can decide how to fall back.
+    """
+    prompt = motivation_prompt(user_log_minutes)
+    max_tokens = prompt_budget.max_tokens(prompt, 2000)
+    response = await llm_scheduler.run(
+        lambda model: model(prompt, max_tokens=max_tokens, stop=["</s>"]),
+        priority=priority,
+        label="motivation"
+    )
+    return response["choices"][0]["text"].strip()  # type: ignore
+
+# Streak checking logic: streak records are maintained by /log, so only active streakers are read
+_dm_fanout = None
+
+
+def get_dm_fanout(bot):
+    """One fan-out engine per bot, so its user cache and rate-limit buckets survive between runs."""
+    global _dm_fanout
+    if _dm_fanout is None or _dm_fanout.bot is not bot:
+        _dm_fanout = DMFanout(bot)
+    return _dm_fanout
+
 
-# Streak checking logic
 async def check_streaks(bot):
-    docs = db.collection("logs").stream()
     today = datetime.date.today()
-    for doc in docs:
-        data = doc.to_dict()
-        streak = 0
-        for i in range(7):
-            day = (today - datetime.timedelta(days=i)).isoformat()
-            if day in data:
-                streak += 1
-            else:
-                break
-        if streak >= 3:
-            user_id = doc.id
-            user = await bot.fetch_user(int(user_id))
-            if user:
-                try:
-                    await user.send(f"🔥 You're on a {streak}-day streak! Keep going!")
-                except:
-                    print(f"Could not DM user {user_id}")
+    messages = [
+        (user_id, f"🔥 You're on a {record['current']}-day streak! Keep going!")
+        for user_id, record in await store.active_streaks(today)
+    ]
+    report = await get_dm_fanout(bot).send_all(messages)
+    print(
+        f"🔥 Streak DMs: {report['sent']} sent, {report['deferred']} deferred, {report['failed']} failed "
+        f"in {report['elapsed']:.1f}s ({report['throughput']:.1f} DMs/s)"
+    )
+    return report
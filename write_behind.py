@@ -0,0 +1,226 @@
+"""
+Write-behind buffer for Firestore document writes.
+
+Handlers call set() and return immediately; writes to the same document are
+coalesced in memory and committed with a WriteBatch when enough documents are
+pending (size trigger) or when the oldest pending write reaches the flush
+interval (time trigger). Commits run in a worker thread so the event loop
+never waits on a Firestore round trip. close() flushes whatever is left.
+
+A failed batch is retried with exponential backoff. Each write counts its
+attempts; once a write has failed max_attempts times, or the error can't be
+fixed by retrying (invalid or oversized data, permission denied), the batch is
+bisected so the offending write is committed on its own, and then logged and
+dropped. One bad document never blocks the writes queued behind it.
+
+Writes that need read-modify-write semantics (e.g. the streak transaction)
+must not go through this buffer.
+"""
+import asyncio
+import time
+from collections import deque
+
+FIRESTORE_BATCH_LIMIT = 500  # Maximum writes per WriteBatch
+MAX_ATTEMPTS = 8  # A write is dropped after failing this many times
+MAX_BACKOFF = 60.0  # Seconds; cap for the exponential backoff between failed flushes
+
+# Errors retrying can't fix. The client raises ValueError/TypeError for data it can't encode
+NON_RETRYABLE_ERRORS = (ValueError, TypeError)
+try:
+    from google.api_core.exceptions import InvalidArgument, PermissionDenied  # Oversized documents are InvalidArgument
+    NON_RETRYABLE_ERRORS += (InvalidArgument, PermissionDenied)
+except ImportError:
+    pass
+
+
+def deep_merge(target: dict, data: dict):
+    """Merge `data` into `target` the way set(merge=True) merges nested maps."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            deep_merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class PendingWrite:
+    def __init__(self, data: dict, merge: bool):
+        self.data = {}
+        deep_merge(self.data, data)  # Copy, so later merges never mutate the caller's dicts
+        self.merge = merge
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0  # Failed commits so far
+
+    def absorb(self, data: dict, merge: bool):
+        """Fold a newer write for the same document into this one."""
+        if merge:
+            deep_merge(self.data, data)
+        else:
+            self.data = {}
+            deep_merge(self.data, data)
+            self.merge = False
+            self.attempts = 0  # Replaced data gets a fresh set of attempts
+
+
+class WriteBehindBuffer:
+    """Coalesces per-document writes and flushes them in Firestore batches."""
+
+    def __init__(self, db, max_batch=FIRESTORE_BATCH_LIMIT, flush_interval=1.0, history=200,
+                 max_attempts=MAX_ATTEMPTS, max_backoff=MAX_BACKOFF):
+        self.db = db
+        self.max_batch = min(max_batch, FIRESTORE_BATCH_LIMIT)
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._pending = {}  # (collection, doc_id) -> PendingWrite
+        self._wakeup = None
+        self._task = None
+        self._flush_lock = None
+        self._closed = False
+        self.writes = 0
+        self.coalesced = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=history)  # Seconds from first enqueue to commit
+        self.batch_sizes = deque(maxlen=history)
+
+    def set(self, collection: str, doc_id: str, data: dict, merge: bool = False):
+        """Queue a document write (same semantics as DocumentReference.set). Must be called on the event loop."""
+        if self._closed:
+            raise RuntimeError("WriteBehindBuffer is closed")
+        self._ensure_started()
+        key = (collection, str(doc_id))
+        self.writes += 1
+        if key in self._pending:
+            self._pending[key].absorb(data, merge)
+            self.coalesced += 1
+        else:
+            self._pending[key] = PendingWrite(data, merge)
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def is_pending(self, collection: str, doc_id: str) -> bool:
+        """True if a write to this document is buffered but not yet committed."""
+        return (collection, str(doc_id)) in self._pending
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        failures = 0
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._time_to_flush())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._pending or self._closed:
+                continue
+            if await self.flush():
+                failures = 0
+            else:
+                # Back off exponentially before retrying the writes that failed
+                failures += 1
+                await asyncio.sleep(min(self.max_backoff, self.flush_interval * 2 ** (failures - 1)))
+
+    def _time_to_flush(self) -> float:
+        if not self._pending:
+            return self.flush_interval
+        oldest = min(write.enqueued_at for write in self._pending.values())
+        return max(0.0, oldest + self.flush_interval - time.monotonic())
+
+    def _commit(self, items):
+        batch = self.db.batch()
+        for (collection, doc_id), write in items:
+            batch.set(self.db.collection(collection).document(doc_id), write.data, merge=write.merge)
+        batch.commit()
+
+    def _give_up(self, write: PendingWrite, error) -> bool:
+        return isinstance(error, NON_RETRYABLE_ERRORS) or write.attempts + 1 >= self.max_attempts
+
+    def _commit_isolating(self, items):
+        """
+        Commit items as one batch. If that fails with an error some write won't survive a retry,
+        split the batch in halves until the failing writes are committed on their own.
+        Returns (committed items, [(key, write, error)] that failed).
+        """
+        try:
+            self._commit(items)
+            return items, []
+        except Exception as e:
+            if len(items) == 1 or not any(self._give_up(write, e) for _, write in items):
+                return [], [(key, write, e) for key, write in items]
+        middle = len(items) // 2
+        committed, failed = self._commit_isolating(items[:middle])
+        more_committed, more_failed = self._commit_isolating(items[middle:])
+        return committed + more_committed, failed + more_failed
+
+    def _requeue(self, key, write: PendingWrite):
+        """Put a failed write back without overriding anything queued after it."""
+        newer = self._pending.get(key)
+        if newer is not None:
+            write.absorb(newer.data, newer.merge)
+        self._pending[key] = write
+
+    async def flush(self):
+        """
+        Commit everything pending, in batches of at most max_batch documents.
+        Returns False if writes failed and were queued again for a retry.
+        """
+        if self._flush_lock is None:
+            return True
+        async with self._flush_lock:
+            retrying = 0
+            while self._pending and not retrying:
+                items = list(self._pending.items())[:self.max_batch]
+                for key, _ in items:
+                    del self._pending[key]
+                committed, failed = await asyncio.to_thread(self._commit_isolating, items)
+                if failed:
+                    self.failed_batches += 1
+                for key, write, e in failed:
+                    if self._give_up(write, e):
+                        self.dropped += 1
+                        print(f"[Firestore ERROR] Dropping write to {key[0]}/{key[1]} "
+                              f"after {write.attempts + 1} attempts: {e}")
+                    else:
+                        write.attempts += 1
+                        self._requeue(key, write)
+                        retrying += 1
+                if retrying:
+                    print(f"[Firestore ERROR] {retrying} writes failed, will retry: {failed[-1][2]}")
+                if committed:
+                    now = time.monotonic()
+                    self.batch_sizes.append(len(committed))
+                    self.latencies.extend(now - write.enqueued_at for _, write in committed)
+            return not retrying
+
+    async def close(self):
+        """Stop the background flusher and commit any remaining writes."""
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+        await self.flush()
+        if self._pending:
+            print(f"[Firestore ERROR] {len(self._pending)} buffered writes could not be committed on shutdown")
+        print(self.summary())
+
+    def summary(self) -> str:
+        if not self.batch_sizes:
+            return f"💾 Write-behind: {self.writes} writes, nothing committed yet"
+        avg_batch = sum(self.batch_sizes) / len(self.batch_sizes)
+        avg_latency = sum(self.latencies) / len(self.latencies)
+        return (
+            f"💾 Write-behind: {self.writes} writes ({self.coalesced} coalesced), "
+            f"avg batch {avg_batch:.1f} docs (max {max(self.batch_sizes)}), "
+            f"write latency avg {avg_latency * 1000:.0f} ms / max {max(self.latencies) * 1000:.0f} ms, "
+            f"{self.failed_batches} failed batches, {self.dropped} dropped writes"
+        )